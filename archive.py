@@ -0,0 +1,215 @@
+# encoding: utf-8
+"""
+an archive of squitters in hourly parquet files, for analytics over
+months of data without keeping it all in the database.
+
+files are laid out hive-style, so pyarrow.dataset, duckdb, spark etc.
+can prune by date and client without opening anything else:
+
+    <directory>/date=2019-04-16/client_id=0/squitters-2019041612.parquet
+
+each file holds the rows whose parsed_time falls in one hour. rows are
+buffered into large row groups, which are written out once they're full
+or `flush_interval` seconds after their first row, whichever comes
+first, so a busy feed doesn't pile up rows in memory. a file is written
+under a hidden `.tmp` name and only renamed once it's complete, so a
+crash never leaves a truncated file where readers would find it.
+"""
+
+import datetime
+import os
+import time
+
+import sbs1
+
+try:
+  import pyarrow
+  import pyarrow.parquet
+except ImportError:
+  pyarrow = None
+
+# rows per row group. bigger groups compress and scan better, but are
+# held in memory until they're written.
+ROW_GROUP_SIZE = 100000
+# the most seconds rows are held in memory before they're written out as
+# a (smaller) row group
+FLUSH_INTERVAL = 300.0
+COMPRESSIONS = ('zstd', 'snappy', 'gzip', 'none')
+COMPRESSION = 'zstd'
+# rows handed to the archive at a time
+BATCH_SIZE = 5000
+
+_ROTATE = 3600
+_PARSED_TIME = sbs1.SQUITTER_COLUMNS.index('parsed_time')
+_CLIENT_ID = sbs1.SQUITTER_COLUMNS.index('client_id')
+
+
+def _types(compact):
+  # arrow types of sbs1.SQUITTER_COLUMNS, as parsed by sbs1.parse_line
+  # or, with `compact`, sbs1.parse_line_compact
+  # ids are parsed as integers of any size
+  ids = pyarrow.int64() if compact else pyarrow.string()
+  latlon = pyarrow.int32() if compact else pyarrow.float64()
+  return (
+    pyarrow.string(),       # message_type
+    pyarrow.int8(),         # transmission_type
+    ids,                    # session_id
+    ids,                    # aircraft_id
+    pyarrow.int32(),        # icao_addr
+    ids,                    # flight_id
+    pyarrow.string(),       # callsign
+    pyarrow.int32(),        # altitude
+    pyarrow.int16(),        # ground_speed
+    pyarrow.int16(),        # track
+    latlon,                 # lat
+    latlon,                 # lon
+    pyarrow.int32(),        # vertical_rate
+    pyarrow.int16(),        # decimal_squawk
+    pyarrow.bool_(),        # alert
+    pyarrow.bool_(),        # emergency
+    pyarrow.bool_(),        # spi
+    pyarrow.bool_(),        # is_on_ground
+    pyarrow.timestamp('ms'),  # generated_datetime
+    pyarrow.timestamp('ms'),  # logged_datetime
+    pyarrow.timestamp('ms'),  # parsed_time
+    pyarrow.bool_(),        # is_mlat
+    pyarrow.uint8(),        # client_id
+  )
+
+
+def _tmp_path(path):
+  # readers skip files starting with a dot
+  (directory, name) = os.path.split(path)
+  return os.path.join(directory, ".%s.tmp" % (name,))
+
+
+class Archive(object):
+  """
+  writes `sbs1.SQUITTER_COLUMNS` rows (or, with `compact`, rows from
+  sbs1.parse_line_compact) to hourly parquet files under `directory`.
+  `write(rows)` can be used as a batching.RowBuffer's write function,
+  and `poll()` should be called regularly in between (as a
+  pipeline.Writer's `on_poll`).
+
+  rows are expected roughly in time order. the files of an hour are
+  finished once a batch arrives whose newest row is more than an hour
+  past it (or, as when replaying captures one after another, before
+  it). a row that turns up for an hour that's already been finished
+  starts another file for it.
+  """
+
+  def __init__(self, directory, compact=False, compression=COMPRESSION, row_group_size=ROW_GROUP_SIZE, flush_interval=FLUSH_INTERVAL):
+    if pyarrow is None:
+      raise ImportError("writing an archive needs the pyarrow package")
+    self.directory = directory
+    self.compact = compact
+    self.compression = compression
+    self.row_group_size = row_group_size
+    self.flush_interval = flush_interval
+    # client_id is in the path, not the files
+    types = _types(compact)
+    self._columns = [i for i in range(len(sbs1.SQUITTER_COLUMNS)) if i != _CLIENT_ID]
+    self._types = [types[i] for i in self._columns]
+    self.schema = pyarrow.schema([(sbs1.SQUITTER_COLUMNS[i], types[i]) for i in self._columns])
+    # counters
+    self.rows = 0
+    self.files = 0
+    # {(hour, client_id): rows}
+    self._pending = {}
+    # {(hour, client_id): when its oldest pending row was buffered}
+    self._since = {}
+    # {(hour, client_id): (path, ParquetWriter)}
+    self._writers = {}
+
+  def _hour(self, t):
+    if self.compact:
+      return t // (_ROTATE * 1000)
+    return int(sbs1.timestamp(t)) // _ROTATE
+
+  def write(self, rows):
+    pending = self._pending
+    now = time.time()
+    latest = None
+    for row in rows:
+      key = (self._hour(row[_PARSED_TIME]), row[_CLIENT_ID])
+      buffered = pending.get(key)
+      if buffered is None:
+        buffered = pending[key] = []
+        self._since[key] = now
+      buffered.append(row)
+      if len(buffered) >= self.row_group_size:
+        self._write_group(key)
+      if latest is None or key[0] > latest:
+        latest = key[0]
+    self.rows += len(rows)
+
+    if latest is not None:
+      for key in set(pending) | set(self._writers):
+        if key[0] < latest - 1 or key[0] > latest:
+          self._finish(key)
+
+    self.poll(now)
+
+  def poll(self, now=None):
+    """
+    write out the row groups whose first row was buffered
+    `flush_interval` seconds ago or more. write() only does this when
+    rows arrive, so on a quiet feed, or after its last row, rows would
+    otherwise stay buffered until the next one or until close().
+    """
+    if now is None:
+      now = time.time()
+    for (key, since) in self._since.items():
+      if now - since >= self.flush_interval:
+        self._write_group(key)
+
+  def _array(self, values, arrow_type):
+    if self.compact and pyarrow.types.is_timestamp(arrow_type):
+      return pyarrow.array(values, pyarrow.int64()).cast(arrow_type)
+    return pyarrow.array(values, arrow_type)
+
+  def _write_group(self, key):
+    self._since.pop(key, None)
+    rows = self._pending.pop(key, None)
+    if not rows:
+      return
+    columns = list(zip(*rows))
+    table = pyarrow.Table.from_arrays(
+      [self._array(columns[i], t) for (i, t) in zip(self._columns, self._types)],
+      schema=self.schema,
+    )
+    if key not in self._writers:
+      self._writers[key] = self._open(key)
+    self._writers[key][1].write_table(table, row_group_size=self.row_group_size)
+
+  def _open(self, key):
+    (hour, client_id) = key
+    start = datetime.datetime.utcfromtimestamp(hour * _ROTATE)
+    directory = os.path.join(self.directory, "date=%s" % (start.strftime("%Y-%m-%d"),), "client_id=%s" % (client_id,))
+    if not os.path.isdir(directory):
+      os.makedirs(directory)
+    # an hour that was already finished gets another file
+    name = "squitters-%s" % (start.strftime("%Y%m%d%H"),)
+    path = os.path.join(directory, name + ".parquet")
+    n = 0
+    while os.path.exists(path) or os.path.exists(_tmp_path(path)):
+      n += 1
+      path = os.path.join(directory, "%s-%d.parquet" % (name, n))
+    writer = pyarrow.parquet.ParquetWriter(_tmp_path(path), self.schema, compression=self.compression)
+    return (path, writer)
+
+  def _finish(self, key):
+    self._write_group(key)
+    entry = self._writers.pop(key, None)
+    if entry is not None:
+      (path, writer) = entry
+      writer.close()
+      os.rename(_tmp_path(path), path)
+      self.files += 1
+
+  def close(self):
+    """
+    write out everything that's buffered and finish every file
+    """
+    for key in set(self._pending) | set(self._writers):
+      self._finish(key)
@@ -0,0 +1,790 @@
+# encoding: utf-8
+"""
+the databases the logger can write to.
+
+a backend is opened, asked to make sure its tables exist, and then
+handed batches of `sbs1.SQUITTER_COLUMNS` rows (or `tracks.TRACK_COLUMNS`
+rows with --aggregate) from the writer thread. `write(rows)` writes and
+commits a batch, so it can be a batching.RowBuffer's write function.
+
+each backend adds its own command line options, and its database driver
+is only needed when it's used.
+"""
+
+import datetime
+import math
+import sqlite3
+
+import batching
+import indexes
+import partitions
+import pgcopy
+import sbs1
+import stream
+import tracks
+
+try:
+  import mysql.connector
+except ImportError:
+  mysql = None
+
+try:
+  import psycopg2
+  import psycopg2.extras
+except ImportError:
+  psycopg2 = None
+
+# we'll discard any rows with `transmission_type` not in this set.
+# 8 (all call reply) is very frequent but does not normally carry data
+# for us. 7 (air to air) is also common but only contains altitude.
+# your mileage may vary. see the following:
+#    http://woodair.net/SBS/Article/Barebones42_Socket_Data.htm
+#    https://github.com/wiseman/node-sbs1
+ONLY_LOG_TYPES = frozenset({1,2,3,4,5,6,7,8})
+
+
+class Backend(object):
+  """
+  the interface of a database backend. `table` and `columns` are what
+  batches are written to, once ensure_schema() has been called.
+  """
+
+  # the name used with --backend
+  name = None
+  # the package the driver comes from, for error messages
+  package = None
+  only_log_types = ONLY_LOG_TYPES
+  # whether --compact and --partition can be used
+  supports_compact = False
+  supports_partitions = False
+  # exceptions that mean the database can't be reached (rather than
+  # that a batch is bad), which --spool-dir spools rows for
+  errors = ()
+
+  @classmethod
+  def available(cls):
+    return True
+
+  @classmethod
+  def add_arguments(cls, parser):
+    pass
+
+  @classmethod
+  def from_args(cls, args):
+    raise NotImplementedError()
+
+  def open(self):
+    raise NotImplementedError()
+
+  def ensure_schema(self, aggregate=False, compact=False, index_profile=None, partition=None, partitions_ahead=partitions.AHEAD):
+    """
+    create the table we'll write to (squitters, squitters_compact or,
+    with `aggregate`, track_points) if it doesn't exist, with the indexes
+    of `index_profile`
+    """
+    raise NotImplementedError()
+
+  def write_batch(self, rows):
+    """
+    write rows to `table`, without committing them
+    """
+    raise NotImplementedError()
+
+  def flush(self):
+    """
+    commit everything written so far
+    """
+    raise NotImplementedError()
+
+  def close(self):
+    raise NotImplementedError()
+
+  def reconnect(self):
+    """
+    re-open the connection after the database went away
+    """
+    raise NotImplementedError()
+
+  def write(self, rows):
+    # write a whole batch and commit it
+    try:
+      self.write_batch(rows)
+      self.flush()
+    except Exception:
+      print
+      print "Could not write %s rows to database" % (len(rows),)
+      raise
+
+  # secondary indexes, for --bulk-load and --index-profile
+
+  def secondary_indexes(self):
+    """
+    the secondary indexes of `table`, in the form restore_indexes()
+    takes
+    """
+    raise NotImplementedError()
+
+  def drop_indexes(self, names=None):
+    """
+    drop the secondary indexes of `table` (or those in `names`),
+    returning what restore_indexes() needs to put them back
+    """
+    raise NotImplementedError()
+
+  def restore_indexes(self, deferred):
+    """
+    add the indexes `table` doesn't have yet, returning their names
+    """
+    raise NotImplementedError()
+
+  def profile_indexes(self, profile):
+    """
+    the indexes of an indexes.PROFILES profile, in the form
+    restore_indexes() takes
+    """
+    raise NotImplementedError()
+
+  def maintain_partitions(self, interval, ahead, retention):
+    """
+    create upcoming partitions of `table` and drop expired ones, on a
+    connection of its own (this is called from partitions.Maintainer)
+    """
+    raise NotImplementedError()
+
+  def check_partitions(self):
+    """
+    report rows of `table` that were written outside its partitions
+    """
+    pass
+
+  def _set_table(self, aggregate, compact):
+    if aggregate:
+      (self.table, self.columns) = ("track_points", tracks.TRACK_COLUMNS)
+    elif compact:
+      (self.table, self.columns) = ("squitters_compact", sbs1.SQUITTER_COLUMNS)
+    else:
+      (self.table, self.columns) = ("squitters", sbs1.SQUITTER_COLUMNS)
+
+
+def _print_maintained(created, dropped):
+  if created:
+    print "Created partitions %s" % (", ".join(created),)
+  if dropped:
+    print "Dropped partitions %s" % (", ".join(dropped),)
+
+
+def _timeout_seconds(timeout):
+  # both drivers take whole seconds, and take 0 to mean no timeout at all
+  return max(1, int(math.ceil(timeout)))
+
+
+# mysql
+
+class MySQL(Backend):
+  """
+  a mysql (or mariadb) database, with innodb table compression. each
+  batch is written as a single multi-row INSERT.
+  """
+
+  name = 'mysql'
+  package = 'mysql-connector'
+  supports_compact = True
+  supports_partitions = True
+
+  @classmethod
+  def available(cls):
+    return mysql is not None
+
+  @classmethod
+  def add_arguments(cls, parser):
+    group = parser.add_argument_group("mysql")
+    group.add_argument("--mysql-host", type=str, default="localhost")
+    group.add_argument("--mysql-port", type=int, default=3306)
+    group.add_argument("--mysql-user", type=str, default="dump1090")
+    group.add_argument("--mysql-pass", type=str, default="dump1090")
+    group.add_argument("--mysql-database", type=str, default="dump1090")
+    group.add_argument('--no-compress', default=False, action='store_true')
+
+  @classmethod
+  def from_args(cls, args):
+    return cls(
+      dict(
+        host=args.mysql_host,
+        port=args.mysql_port,
+        user=args.mysql_user,
+        password=args.mysql_pass,
+        database=args.mysql_database,
+        auth_plugin='mysql_native_password',
+      ),
+      args.batch_size,
+      compress=not args.no_compress,
+      connect_timeout=_timeout_seconds(args.connect_timeout),
+    )
+
+  def __init__(self, connect_args, batch_size, compress=True, connect_timeout=None):
+    self.connect_args = connect_args
+    self.connect_timeout = connect_timeout
+    # the most rows in a batch, for batching.MultiRowInsert
+    self.batch_size = batch_size
+    self.compress = compress
+    # only the ones for a lost connection; a bad batch would fail again
+    self.errors = (mysql.connector.InterfaceError, mysql.connector.OperationalError)
+    self.conn = None
+    self._compact = False
+
+  def __str__(self):
+    return "mysql"
+
+  def open(self):
+    self.conn = self._connect()
+
+  def _connect(self, timeout=True):
+    # mysql.connector's connection_timeout isn't only for connecting: it's
+    # the socket timeout of the whole connection, so it bounds every
+    # statement too. that's what we want for the writer, whose batches are
+    # quick, but not for ALTER TABLE on a large table, which gets a
+    # connection of its own without it.
+    if timeout and self.connect_timeout is not None:
+      return mysql.connector.connect(connection_timeout=self.connect_timeout, **self.connect_args)
+    return mysql.connector.connect(**self.connect_args)
+
+  def ensure_schema(self, aggregate=False, compact=False, index_profile=None, partition=None, partitions_ahead=partitions.AHEAD):
+    self._set_table(aggregate, compact)
+    self._compact = compact
+    if partition:
+      partition_clause = partitions.mysql_partition_clause(datetime.datetime.utcnow().date(), partition, partitions_ahead, compact)
+    else:
+      partition_clause = ""
+    table_setup(self.conn.cursor(), self.compress, aggregate, partition_clause, index_profile or indexes.PROFILE, compact)
+    self._insert = batching.MultiRowInsert(self.table, self.columns, self.batch_size)
+
+  def write_batch(self, rows):
+    cur = self.conn.cursor()
+    cur.execute(self._insert.statement(len(rows)), self._insert.params(rows))
+    cur.close()
+
+  def flush(self):
+    self.conn.commit()
+
+  def close(self):
+    self.conn.close()
+
+  def reconnect(self):
+    self.conn.reconnect()
+
+  def secondary_indexes(self):
+    return indexes.mysql_indexes(self.conn.cursor(), self.table)
+
+  def drop_indexes(self, names=None):
+    return indexes.mysql_drop(self.conn.cursor(), self.table, names)
+
+  def restore_indexes(self, deferred):
+    conn = self._connect(timeout=False)
+    try:
+      return indexes.mysql_restore(conn.cursor(), self.table, deferred)
+    finally:
+      conn.close()
+
+  def profile_indexes(self, profile):
+    return indexes.mysql_profile(profile)
+
+  def maintain_partitions(self, interval, ahead, retention):
+    conn = self._connect(timeout=False)
+    try:
+      (created, dropped) = partitions.mysql_maintain(conn.cursor(), self.table, datetime.datetime.utcnow().date(), interval, ahead, retention, self._compact)
+    finally:
+      conn.close()
+    _print_maintained(created, dropped)
+
+
+def table_setup(dbcursor, compress=True, track_points=False, partition_clause="", index_profile=indexes.PROFILE, compact=False):
+  # data format info:
+  #    http://woodair.net/SBS/Article/Barebones42_Socket_Data.htm
+  #    https://github.com/wiseman/node-sbs1
+  #dbcursor.execute("DROP TABLE IF EXISTS squitters")
+  if compress:
+      compress_arg = "ROW_FORMAT=COMPRESSED KEY_BLOCK_SIZE=4"
+  else:
+      compress_arg = ""
+  if compact:
+    # see sbs1.parse_line_compact. lat/lon are in units of
+    # 1/sbs1.LATLON_SCALE degree, and times in milliseconds since the epoch.
+    dbcursor.execute("""CREATE TABLE IF NOT EXISTS
+      squitters_compact(
+        message_type      CHAR(3) NOT NULL,
+        transmission_type TINYINT UNSIGNED NOT NULL,
+        session_id        INT UNSIGNED,
+        aircraft_id       INT UNSIGNED,
+        icao_addr         MEDIUMINT UNSIGNED NOT NULL,
+        flight_id         INT UNSIGNED,
+        callsign          CHAR({callsign_length}),
+        altitude          MEDIUMINT,
+        ground_speed      SMALLINT,
+        track             SMALLINT,
+        lat               INT,
+        lon               INT,
+        vertical_rate     SMALLINT,
+        decimal_squawk    SMALLINT UNSIGNED,
+        alert             BOOLEAN,
+        emergency         BOOLEAN,
+        spi               BOOLEAN,
+        is_on_ground      BOOLEAN,
+        parsed_time       BIGINT NOT NULL,
+        generated_datetime BIGINT,
+        logged_datetime   BIGINT,
+        is_mlat           BOOLEAN,
+        client_id         TINYINT UNSIGNED NOT NULL DEFAULT 0,
+        {indexes}
+      )
+      ENGINE=InnoDB
+      {compress_arg}
+      CHARACTER SET utf8
+      COLLATE utf8_general_ci
+      {partition_clause}
+    """.format(compress_arg=compress_arg, partition_clause=partition_clause, indexes=indexes.mysql_index_clauses(index_profile), callsign_length=sbs1.CALLSIGN_LENGTH))
+    return
+  dbcursor.execute("""CREATE TABLE IF NOT EXISTS
+    squitters(
+      message_type      VARCHAR(3) NOT NULL,
+      transmission_type TINYINT(1) UNSIGNED NOT NULL,
+      session_id        TEXT,
+      aircraft_id       TEXT,
+      icao_addr         MEDIUMINT UNSIGNED NOT NULL,
+      flight_id         TEXT,
+      callsign          TEXT,
+      altitude          MEDIUMINT,
+      ground_speed      SMALLINT,
+      track             INT,
+      lat               DECIMAL(8,5),
+      lon               DECIMAL(8,5),
+      vertical_rate     INT,
+      decimal_squawk    SMALLINT UNSIGNED,
+      alert             BOOLEAN,
+      emergency         BOOLEAN,
+      spi               BOOLEAN,
+      is_on_ground      BOOLEAN,
+      parsed_time       DATETIME NOT NULL,
+      generated_datetime DATETIME,
+      logged_datetime   DATETIME,
+      is_mlat           BOOLEAN,
+      client_id         TINYINT UNSIGNED NOT NULL DEFAULT 0,
+      {indexes}
+    )
+    ENGINE=InnoDB
+    {compress_arg}
+    CHARACTER SET utf8
+    COLLATE utf8_general_ci
+    {partition_clause}
+  """.format(compress_arg=compress_arg, partition_clause=partition_clause, indexes=indexes.mysql_index_clauses(index_profile)))
+  if track_points:
+    # one merged row per aircraft per --aggregate interval. `messages` is
+    # the number of squitters that went into it.
+    dbcursor.execute("""CREATE TABLE IF NOT EXISTS
+      track_points(
+        icao_addr         MEDIUMINT UNSIGNED NOT NULL,
+        callsign          TEXT,
+        altitude          MEDIUMINT,
+        ground_speed      SMALLINT,
+        track             INT,
+        lat               DECIMAL(8,5) NOT NULL,
+        lon               DECIMAL(8,5) NOT NULL,
+        vertical_rate     INT,
+        decimal_squawk    SMALLINT UNSIGNED,
+        alert             BOOLEAN,
+        emergency         BOOLEAN,
+        spi               BOOLEAN,
+        is_on_ground      BOOLEAN,
+        messages          SMALLINT UNSIGNED NOT NULL,
+        parsed_time       DATETIME NOT NULL,
+        is_mlat           BOOLEAN,
+        client_id         TINYINT UNSIGNED NOT NULL DEFAULT 0,
+        INDEX idx_parsed_time(parsed_time),
+        INDEX idx_icao_addr(icao_addr),
+        INDEX idx_client_id(client_id)
+      )
+      ENGINE=InnoDB
+      {compress_arg}
+      CHARACTER SET utf8
+      COLLATE utf8_general_ci
+    """.format(compress_arg=compress_arg))
+  #dbcursor.execute("""CREATE TABLE IF NOT EXISTS
+  #  callsigns(
+  #    icao_addr         MEDIUMINT UNSIGNED NOT NULL,
+  #    callsign          TEXT,
+  #    parsed_time       DATETIME NOT NULL,
+  #    INDEX idx_parsed_time(parsed_time),
+  #    INDEX idx_icao_addr(icao_addr),
+  #    PRIMARY KEY (icao_addr, parsed_time)
+  #  )
+  #  ENGINE=InnoDB
+  #  ROW_FORMAT=COMPRESSED KEY_BLOCK_SIZE=4
+  #  CHARACTER SET utf8
+  #  COLLATE utf8_general_ci
+  #""")
+
+
+# postgresql
+
+# lat/lon are stored as a single postgis point, so the row we insert
+# carries them last, as (lon, lat), for the geometry constructor.
+_LATLON = frozenset(('lat', 'lon'))
+PSQL_COLUMNS = tuple(c for c in sbs1.SQUITTER_COLUMNS if c not in _LATLON)
+# one statement for every batch, via psycopg2.extras.execute_values.
+# ST_MakePoint() is NULL when lon/lat are, so rows without a position
+# don't need a different statement.
+SQUITTER_INSERT = "INSERT INTO squitters (%s, latlon) VALUES %%s" % (
+  ", ".join(PSQL_COLUMNS),
+)
+SQUITTER_ROW_TEMPLATE = "(%s, ST_SetSRID(ST_MakePoint(%%s, %%s), 4326))" % (
+  ", ".join(["%s"] * len(PSQL_COLUMNS)),
+)
+
+# the same for the `track_points` table written with --aggregate
+TRACK_PSQL_COLUMNS = tuple(c for c in tracks.TRACK_COLUMNS if c not in _LATLON)
+TRACK_INSERT = "INSERT INTO track_points (%s, latlon) VALUES %%s" % (
+  ", ".join(TRACK_PSQL_COLUMNS),
+)
+TRACK_ROW_TEMPLATE = "(%s, ST_SetSRID(ST_MakePoint(%%s, %%s), 4326))" % (
+  ", ".join(["%s"] * len(TRACK_PSQL_COLUMNS)),
+)
+
+# these are NOT NULL DEFAULT '' in create.sql
+_EMPTY_STRING_COLUMNS = (sbs1.AIRCRAFT_ID, sbs1.FLIGHT_ID, sbs1.CALLSIGN)
+_PARSED_TIME = sbs1.SQUITTER_COLUMNS.index('parsed_time')
+
+
+def psql_row(row, timezone):
+  """
+  turn a `sbs1.SQUITTER_COLUMNS` row into one ordered like `PSQL_COLUMNS`
+  followed by (lon, lat).
+  """
+  line = list(row)
+  for idx in _EMPTY_STRING_COLUMNS:
+    if line[idx] is None:
+      line[idx] = ''
+  for idx in (sbs1.GENERATED_DATETIME, sbs1.LOGGED_DATETIME, _PARSED_TIME):
+    if line[idx] is not None:
+      line[idx] = "{} {}".format(line[idx], timezone)
+  lat = line[sbs1.LAT]
+  lon = line[sbs1.LON]
+  # pop lon first; it comes after lat
+  line.pop(sbs1.LON)
+  line.pop(sbs1.LAT)
+  line.append(lon)
+  line.append(lat)
+  return line
+
+def psql_track_row(point, timezone):
+  """
+  turn a `tracks.TRACK_COLUMNS` row into one ordered like
+  `TRACK_PSQL_COLUMNS` followed by (lon, lat).
+  """
+  line = list(point)
+  if line[tracks.CALLSIGN] is None:
+    line[tracks.CALLSIGN] = ''
+  line[tracks.PARSED_TIME] = "{} {}".format(line[tracks.PARSED_TIME], timezone)
+  lat = line[tracks.LAT]
+  lon = line[tracks.LON]
+  # pop lon first; it comes after lat
+  line.pop(tracks.LON)
+  line.pop(tracks.LAT)
+  line.append(lon)
+  line.append(lat)
+  return line
+
+
+class PostgreSQL(Backend):
+  """
+  a postgis database set up with psql/create.sql (or
+  create-partitioned.sql). batches are written with one multi-row INSERT,
+  or with `copy`, streamed through COPY.
+  """
+
+  name = 'psql'
+  package = 'psycopg2'
+  # the psql logger has never logged all call replies
+  only_log_types = frozenset({1,2,3,4,5,6,7})
+  supports_partitions = True
+
+  @classmethod
+  def available(cls):
+    return psycopg2 is not None
+
+  @classmethod
+  def add_arguments(cls, parser):
+    group = parser.add_argument_group("postgresql")
+    group.add_argument("--timezone", type=str, default="UTC")
+    group.add_argument("--psql-host", type=str, default="localhost")
+    group.add_argument("--psql-port", type=int, default=5432)
+    group.add_argument("--psql-user", type=str, default="dump1090")
+    group.add_argument("--psql-pass", type=str, default="dump1090")
+    group.add_argument("--psql-database", type=str, default="dump1090")
+    group.add_argument("--psql-sslmode", type=str, default="prefer")
+    group.add_argument("--psql-sslcert", type=str, default=None)
+    group.add_argument("--psql-sslkey", type=str, default=None)
+    group.add_argument("--copy", default=False, action='store_true', help="Write batches with COPY instead of INSERT, which is much faster for large batches.")
+
+  @classmethod
+  def from_args(cls, args):
+    return cls(
+      dict(
+        host=args.psql_host,
+        port=args.psql_port,
+        user=args.psql_user,
+        password=args.psql_pass,
+        database=args.psql_database,
+        sslmode=args.psql_sslmode,
+        sslcert=args.psql_sslcert,
+        sslkey=args.psql_sslkey,
+        # notice a server that's gone away as stream.keepalive() does
+        # for dump1090, instead of waiting on it for hours
+        connect_timeout=_timeout_seconds(args.connect_timeout),
+        keepalives=1,
+        keepalives_idle=stream.KEEPALIVE_IDLE,
+        keepalives_interval=stream.KEEPALIVE_INTERVAL,
+        keepalives_count=stream.KEEPALIVE_COUNT,
+      ),
+      timezone=args.timezone,
+      copy=args.copy,
+    )
+
+  def __init__(self, connect_args, timezone="UTC", copy=False):
+    self.connect_args = connect_args
+    self.timezone = timezone
+    self.copy = copy
+    self.errors = (psycopg2.OperationalError, psycopg2.InterfaceError)
+    self.conn = None
+
+  def __str__(self):
+    return "psql"
+
+  def open(self):
+    self.conn = psycopg2.connect(**self.connect_args)
+
+  def ensure_schema(self, aggregate=False, compact=False, index_profile=None, partition=None, partitions_ahead=partitions.AHEAD):
+    # the tables themselves come from create.sql
+    self._set_table(aggregate, False)
+    if aggregate:
+      (self._psql_columns, self._insert, self._template, self._convert) = (TRACK_PSQL_COLUMNS, TRACK_INSERT, TRACK_ROW_TEMPLATE, psql_track_row)
+    else:
+      (self._psql_columns, self._insert, self._template, self._convert) = (PSQL_COLUMNS, SQUITTER_INSERT, SQUITTER_ROW_TEMPLATE, psql_row)
+
+  def write_batch(self, rows):
+    # rows are converted here, on the writer thread, rather than by the
+    # thread reading dump1090
+    rows = [self._convert(row, self.timezone) for row in rows]
+    cur = self.conn.cursor()
+    if self.copy:
+      # stream a whole batch through COPY, with the point already encoded
+      # as EWKB so the server doesn't have to build it for every row
+      pgcopy.copy_rows(cur, self.table, self._psql_columns + ('latlon',), [
+        row[:-2] + [pgcopy.ewkb_point_hex(row[-2], row[-1])]
+        for row in rows
+      ])
+    else:
+      psycopg2.extras.execute_values(cur, self._insert, rows, template=self._template, page_size=len(rows))
+    cur.close()
+
+  def flush(self):
+    self.conn.commit()
+
+  def close(self):
+    self.conn.close()
+
+  def reconnect(self):
+    try:
+      self.conn.close()
+    except psycopg2.Error:
+      pass
+    self.open()
+
+  def secondary_indexes(self):
+    return indexes.psql_indexes(self.conn.cursor(), self.table)
+
+  def drop_indexes(self, names=None):
+    dropped = indexes.psql_drop(self.conn.cursor(), self.table, names)
+    self.conn.commit()
+    return dropped
+
+  def restore_indexes(self, deferred):
+    added = indexes.psql_restore(self.conn.cursor(), self.table, deferred)
+    self.conn.commit()
+    return added
+
+  def profile_indexes(self, profile):
+    return indexes.psql_profile(self.table, profile)
+
+  def maintain_partitions(self, interval, ahead, retention):
+    conn = psycopg2.connect(**self.connect_args)
+    try:
+      (created, dropped) = partitions.psql_maintain(conn.cursor(), self.table, datetime.datetime.utcnow().date(), interval, ahead, retention, self.timezone)
+      conn.commit()
+    finally:
+      conn.close()
+    _print_maintained(created, dropped)
+
+  def check_partitions(self):
+    partitions.psql_check_default(self.conn.cursor(), self.table)
+    self.conn.commit()
+
+
+# sqlite
+
+class SQLite(Backend):
+  """
+  a local sqlite database file, for logging without a database server.
+  it's opened in WAL mode with synchronous=NORMAL, and each batch is
+  written with one prepared statement in a single transaction.
+  """
+
+  name = 'sqlite'
+  supports_compact = True
+  errors = (sqlite3.OperationalError,)
+
+  @classmethod
+  def add_arguments(cls, parser):
+    group = parser.add_argument_group("sqlite")
+    group.add_argument("-d", "--database", type=str, default=None, metavar="PATH", help="Log to this sqlite database file, so no database server is needed. It's created if it doesn't exist.")
+
+  @classmethod
+  def from_args(cls, args):
+    return cls(args.database)
+
+  def __init__(self, path):
+    self.path = path
+    self.conn = None
+
+  def __str__(self):
+    return self.path
+
+  def open(self):
+    # the connection is opened here, but used from the writer thread
+    self.conn = sqlite3.connect(self.path, check_same_thread=False)
+    # in WAL mode, reading the database doesn't hold up the logger (or
+    # the other way around), and with synchronous=NORMAL a commit doesn't
+    # wait for an fsync. a power cut can lose the last few batches, but
+    # can't corrupt the database.
+    self.conn.execute("PRAGMA journal_mode=WAL")
+    self.conn.execute("PRAGMA synchronous=NORMAL")
+
+  def ensure_schema(self, aggregate=False, compact=False, index_profile=None, partition=None, partitions_ahead=partitions.AHEAD):
+    self._set_table(aggregate, compact)
+    cur = self.conn.cursor()
+    sqlite_table_setup(cur, aggregate, index_profile or indexes.PROFILE, compact)
+    self.conn.commit()
+    self._insert = "INSERT INTO %s (%s) VALUES (%s)" % (self.table, ", ".join(self.columns), ", ".join(["?"] * len(self.columns)))
+
+  def write_batch(self, rows):
+    try:
+      self.conn.executemany(self._insert, rows)
+    except sqlite3.Error:
+      self.conn.rollback()
+      raise
+
+  def flush(self):
+    self.conn.commit()
+
+  def close(self):
+    self.conn.close()
+
+  def reconnect(self):
+    self.conn.close()
+    self.open()
+
+  def secondary_indexes(self):
+    return indexes.sqlite_indexes(self.conn.cursor(), self.table)
+
+  def drop_indexes(self, names=None):
+    dropped = indexes.sqlite_drop(self.conn.cursor(), self.table, names)
+    self.conn.commit()
+    return dropped
+
+  def restore_indexes(self, deferred):
+    added = indexes.sqlite_restore(self.conn.cursor(), self.table, deferred)
+    self.conn.commit()
+    return added
+
+  def profile_indexes(self, profile):
+    return indexes.sqlite_profile(self.table, profile)
+
+
+def sqlite_table_setup(dbcursor, track_points=False, index_profile=indexes.PROFILE, compact=False):
+  # the same tables as table_setup(). sqlite stores whatever it's given,
+  # so the types are only there for whoever reads the schema; ints come
+  # out as ints and datetimes as text like "2019-04-16 12:00:00.123000".
+  table = "squitters_compact" if compact else "squitters"
+  dbcursor.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name IN (?, ?)", (table, "track_points"))
+  existing = set(name for (name,) in dbcursor.fetchall())
+  if table not in existing:
+    # see sbs1.parse_line_compact for the --compact columns
+    dbcursor.execute("""CREATE TABLE
+      {table}(
+        message_type      TEXT NOT NULL,
+        transmission_type INTEGER NOT NULL,
+        session_id        {ids},
+        aircraft_id       {ids},
+        icao_addr         INTEGER NOT NULL,
+        flight_id         {ids},
+        callsign          TEXT,
+        altitude          INTEGER,
+        ground_speed      INTEGER,
+        track             INTEGER,
+        lat               {latlon},
+        lon               {latlon},
+        vertical_rate     INTEGER,
+        decimal_squawk    INTEGER,
+        alert             BOOLEAN,
+        emergency         BOOLEAN,
+        spi               BOOLEAN,
+        is_on_ground      BOOLEAN,
+        parsed_time       {time} NOT NULL,
+        generated_datetime {time},
+        logged_datetime   {time},
+        is_mlat           BOOLEAN,
+        client_id         INTEGER NOT NULL DEFAULT 0
+      )
+    """.format(
+      table=table,
+      ids="INTEGER" if compact else "TEXT",
+      latlon="INTEGER" if compact else "REAL",
+      time="INTEGER" if compact else "TIMESTAMP",
+    ))
+    for (_, definition) in indexes.sqlite_profile(table, index_profile):
+      dbcursor.execute(definition)
+  if track_points and "track_points" not in existing:
+    dbcursor.execute("""CREATE TABLE
+      track_points(
+        icao_addr         INTEGER NOT NULL,
+        callsign          TEXT,
+        altitude          INTEGER,
+        ground_speed      INTEGER,
+        track             INTEGER,
+        lat               REAL NOT NULL,
+        lon               REAL NOT NULL,
+        vertical_rate     INTEGER,
+        decimal_squawk    INTEGER,
+        alert             BOOLEAN,
+        emergency         BOOLEAN,
+        spi               BOOLEAN,
+        is_on_ground      BOOLEAN,
+        messages          INTEGER NOT NULL,
+        parsed_time       TIMESTAMP NOT NULL,
+        is_mlat           BOOLEAN,
+        client_id         INTEGER NOT NULL DEFAULT 0
+      )
+    """)
+    dbcursor.execute("CREATE INDEX track_points_idx_parsed_time ON track_points (parsed_time)")
+    dbcursor.execute("CREATE INDEX track_points_idx_icao_addr ON track_points (icao_addr)")
+    dbcursor.execute("CREATE INDEX track_points_idx_client_id ON track_points (client_id)")
+
+
+# in the order they're listed in --help
+BACKENDS = (MySQL, PostgreSQL, SQLite)
+BACKEND = MySQL.name
+
+
+def by_name(name):
+  for backend in BACKENDS:
+    if backend.name == name:
+      return backend
+  raise KeyError(name)
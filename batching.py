@@ -0,0 +1,90 @@
+# encoding: utf-8
+"""
+row buffering and multi-row INSERT statements for the database writers.
+"""
+
+import time
+
+# flush a partially-filled batch after this many milliseconds
+BATCH_DELAY = 1000
+
+
+class MultiRowInsert(object):
+  """
+  builds `INSERT INTO table (cols) VALUES (...),(...)` statements for a
+  given number of rows. only the statement for a full batch is kept;
+  shorter ones (from time-based or final flushes) come in every size up to
+  the batch size and are built as needed, since caching them all would
+  hold batch_size statements of up to batch_size rows each.
+  """
+
+  def __init__(self, table, columns, batch_size, row_template=None):
+    self.columns = tuple(columns)
+    if row_template is None:
+      row_template = "(%s)" % ", ".join(["%s"] * len(self.columns))
+    self._prefix = "INSERT INTO %s (%s) VALUES " % (table, ", ".join(self.columns))
+    self._row_template = row_template
+    self.batch_size = batch_size
+    self._full_batch = self._build(batch_size)
+
+  def _build(self, count):
+    return self._prefix + ", ".join([self._row_template] * count)
+
+  def statement(self, count):
+    if count == self.batch_size:
+      return self._full_batch
+    return self._build(count)
+
+  @staticmethod
+  def params(rows):
+    return [v for row in rows for v in row]
+
+
+class RowBuffer(object):
+  """
+  collects rows and hands them to `write(rows)` every `batch_size` rows or
+  once the oldest buffered row is `max_delay` seconds old, whichever comes
+  first. `write` is expected to commit; rows stay buffered if it raises.
+  a `write` that takes care of rows some other way, like
+  spool.SpoolingWriter, returns the number it actually wrote, so
+  `rows_written` only counts those.
+  """
+
+  def __init__(self, write, batch_size, max_delay):
+    self.write = write
+    self.batch_size = batch_size
+    self.max_delay = max_delay
+    self.rows = []
+    self.rows_written = 0
+    self._first_added = 0.0
+
+  def add(self, row):
+    """
+    buffer a row, returning the number of rows written if this filled a
+    batch.
+    """
+    if not self.rows:
+      self._first_added = time.time()
+    self.rows.append(row)
+    if len(self.rows) >= self.batch_size:
+      return self.flush()
+    return 0
+
+  def poll(self):
+    """
+    flush a partial batch that has waited for longer than `max_delay`.
+    """
+    if self.rows and (time.time() - self._first_added) >= self.max_delay:
+      return self.flush()
+    return 0
+
+  def flush(self):
+    if not self.rows:
+      return 0
+    rows = self.rows
+    written = self.write(rows)
+    if written is None:
+      written = len(rows)
+    self.rows = []
+    self.rows_written += written
+    return written
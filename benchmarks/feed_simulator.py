@@ -0,0 +1,206 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+a stand-in for dump1090's basestation output: serves realistic SBS-1
+traffic from a number of simulated aircraft on a local tcp port.
+
+usage:
+    python benchmarks/feed_simulator.py [--port 30003] [--aircraft 200]
+        [--rate 2000] [--lines N] [--fragment 512]
+
+each aircraft keeps a consistent callsign, squawk and a position that
+moves along its track, and messages are drawn from a configurable mix of
+transmission types. lines are stamped with the current (utc) time, so a
+logger reading them can work out end-to-end latency.
+"""
+
+import argparse
+import datetime
+import math
+import random
+import socket
+import sys
+import time
+
+# relative frequency of each transmission type, roughly as seen from a
+# rooftop receiver. type 2 (surface position) is rare away from airports.
+MIX = {1: 2, 2: 1, 3: 30, 4: 25, 5: 15, 6: 3, 7: 15, 8: 9}
+
+# lines are generated and paced in slices of this many seconds
+TICK = 0.01
+
+
+def parse_mix(spec):
+  """
+  parse a `type:weight,...` transmission type mix
+  """
+  mix = {}
+  for part in spec.split(','):
+    (ttype, weight) = part.split(':')
+    mix[int(ttype)] = float(weight)
+  if not mix or any(t not in MIX for t in mix):
+    raise ValueError("expected type:weight pairs for types 1-8, got %r" % (spec,))
+  return mix
+
+
+class Aircraft(object):
+
+  def __init__(self, rnd):
+    self.icao = "%06X" % rnd.randint(0, 0xFFFFFF)
+    self.callsign = "%s%d" % (rnd.choice(("AAL", "DAL", "UAL", "JBU", "SWA", "N")), rnd.randint(1, 2999))
+    self.squawk = "%04o" % rnd.randint(0, 0o7777)
+    self.lat = rnd.uniform(39.0, 42.0)
+    self.lon = rnd.uniform(-75.0, -72.0)
+    self.altitude = rnd.randint(1000, 39000)
+    self.ground_speed = rnd.randint(120, 480)
+    self.track = rnd.randint(0, 359)
+    self.vertical_rate = rnd.choice((0, 0, 0, rnd.randint(-2000, 2000)))
+    self.is_on_ground = False
+
+  def move(self, seconds):
+    # good enough for a few hundred kilometers
+    distance = self.ground_speed * seconds / 3600.0 / 60.0
+    self.lat += distance * math.cos(math.radians(self.track))
+    self.lon += distance * math.sin(math.radians(self.track)) / math.cos(math.radians(self.lat))
+    self.altitude = max(0, self.altitude + int(self.vertical_rate * seconds / 60.0))
+
+
+class Simulator(object):
+  """
+  generates basestation lines from `aircraft` simulated aircraft
+  """
+
+  def __init__(self, aircraft=200, mix=MIX, seed=1090):
+    self.rnd = random.Random(seed)
+    self.aircraft = [Aircraft(self.rnd) for _ in range(aircraft)]
+    self.types = []
+    self.weights = []
+    total = 0.0
+    for (ttype, weight) in sorted(mix.items()):
+      total += weight
+      self.types.append(ttype)
+      self.weights.append(total)
+    self._last = time.time()
+
+  def _type(self):
+    x = self.rnd.random() * self.weights[-1]
+    for (ttype, weight) in zip(self.types, self.weights):
+      if x < weight:
+        return ttype
+    return self.types[-1]
+
+  def lines(self, count):
+    """
+    return `count` lines, as a single string
+    """
+    now = time.time()
+    elapsed = now - self._last
+    self._last = now
+    for a in self.aircraft:
+      a.move(elapsed)
+
+    stamp = datetime.datetime.utcfromtimestamp(now)
+    d = stamp.strftime('%Y/%m/%d')
+    t = stamp.strftime('%H:%M:%S.') + '%03d' % (stamp.microsecond // 1000)
+    out = []
+    for _ in range(count):
+      a = self.rnd.choice(self.aircraft)
+      ttype = self._type()
+      fields = [''] * 22
+      fields[0:10] = ['MSG', str(ttype), '111', '11111', a.icao, '111111', d, t, d, t]
+      if ttype == 1:
+        fields[10] = a.callsign
+      elif ttype in (2, 3):
+        fields[11] = str(a.altitude)
+        fields[14] = '%.5f' % a.lat
+        fields[15] = '%.5f' % a.lon
+        fields[18:22] = ['0', '0', '0', '-1' if a.is_on_ground else '0']
+      elif ttype == 4:
+        fields[12] = str(a.ground_speed)
+        fields[13] = str(a.track)
+        fields[16] = str(a.vertical_rate)
+      elif ttype in (5, 7):
+        fields[11] = str(a.altitude)
+        fields[18:22] = ['0', '', '0', '0']
+      elif ttype == 6:
+        fields[17] = a.squawk
+        fields[18:22] = ['0', '0', '0', '0']
+      elif ttype == 8:
+        fields[21] = '0'
+      out.append(",".join(fields))
+    return "\r\n".join(out) + "\r\n"
+
+
+def send(conn, data, fragment, rnd):
+  # with `fragment`, split writes at random points so lines straddle
+  # recv() calls the way they do on a real network
+  if not fragment:
+    conn.sendall(data)
+    return
+  i = 0
+  while i < len(data):
+    n = rnd.randint(1, fragment)
+    conn.sendall(data[i:i + n])
+    i += n
+
+
+def serve(port, aircraft=200, rate=2000, lines=None, fragment=0, mix=MIX, seed=1090, host="127.0.0.1", ready=None):
+  """
+  serve one client at a time on `port`, at `rate` lines/sec (0 for as
+  fast as possible). after `lines` lines the connection is closed and
+  serve() returns. `ready`, if given, is set once we're listening.
+  """
+  srv = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+  srv.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+  srv.bind((host, port))
+  srv.listen(1)
+  if ready is not None:
+    ready.set()
+  sim = Simulator(aircraft, mix, seed)
+  while True:
+    (conn, _) = srv.accept()
+    sent = 0
+    start = time.time()
+    try:
+      while lines is None or sent < lines:
+        if rate:
+          due = int((time.time() - start) * rate) - sent
+          if due <= 0:
+            time.sleep(TICK)
+            continue
+        else:
+          due = int(TICK * 100000)
+        if lines is not None:
+          due = min(due, lines - sent)
+        send(conn, sim.lines(due), fragment, sim.rnd)
+        sent += due
+    except socket.error:
+      # the client went away; wait for the next one
+      conn.close()
+      continue
+    conn.close()
+    srv.close()
+    return sent
+
+
+def main():
+  parser = argparse.ArgumentParser(description="Serve simulated dump1090 basestation traffic")
+  parser.add_argument("--port", type=int, default=30003, help="The port to listen on. Defaults to %(default)s")
+  parser.add_argument("--aircraft", type=int, default=200, help="Number of simulated aircraft. Defaults to %(default)s")
+  parser.add_argument("--rate", type=int, default=2000, help="Lines per second, or 0 for as fast as possible. Defaults to %(default)s")
+  parser.add_argument("--lines", type=int, default=None, help="Close the connection and exit after this many lines. By default, runs until interrupted.")
+  parser.add_argument("--fragment", type=int, default=0, help="Split writes at random points, into pieces of at most this many bytes. Defaults to whole lines.")
+  parser.add_argument("--mix", type=parse_mix, default=MIX, help="Relative frequency of each transmission type, as type:weight,... Defaults to %s" % (",".join("%s:%s" % kv for kv in sorted(MIX.items())),))
+  parser.add_argument("--seed", type=int, default=1090)
+  args = parser.parse_args()
+
+  sys.stdout.write("Serving %s aircraft on port %s...\n" % (args.aircraft, args.port))
+  try:
+    sent = serve(args.port, args.aircraft, args.rate, args.lines, args.fragment, args.mix, args.seed)
+  except KeyboardInterrupt:
+    return
+  sys.stdout.write("%s lines sent\n" % (sent,))
+
+
+if __name__ == '__main__':
+  main()
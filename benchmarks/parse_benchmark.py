@@ -0,0 +1,175 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+micro-benchmark of the per-line parse step: the original enumerate-based
+field loop versus sbs1.parse_line, sbs1.parse_line_compact and, with
+numpy, columnar.parse on reads of --read-size lines at a time.
+
+usage:
+    python benchmarks/parse_benchmark.py [capture.sbs] [--repeat N]
+        [--read-size N]
+
+the capture is a recorded basestation stream, e.g. from
+`nc localhost 30003 > capture.sbs`. without one, a synthetic capture is
+generated.
+"""
+
+import argparse
+import datetime
+import os
+import random
+import sys
+import time
+from decimal import Decimal
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import columnar
+import sbs1
+
+
+def legacy_parse_line(d):
+  # the parse loop from dump1090-stream-parser.py before sbs1 existed,
+  # kept here as the baseline.
+  line = d.split(",")
+  if len(line) != 22:
+    return None
+  for (idx, val) in enumerate(line):
+    v = val.strip()
+    if idx == 0:
+      line[idx] = v.strip("0123456789").strip()
+    if idx == 1:
+      if v == '':
+        line[idx] = None
+      else:
+        line[idx] = int(v)
+    elif idx in range(2,11):
+      if v == '':
+        line[idx] = None
+      elif idx in set([6,8]):
+        line[idx] = datetime.datetime.strptime(v, '%Y/%m/%d').date()
+      elif idx in set([7,9]):
+        line[idx] = datetime.datetime.strptime(v, '%H:%M:%S.%f').time()
+      else:
+        line[idx] = v
+    elif idx in range(11,14):
+      if v == '':
+        line[idx] = None
+      else:
+        line[idx] = int(v)
+    elif idx in range(14,16):
+      if v == '':
+        line[idx] = None
+      else:
+        line[idx] = Decimal(v)
+    elif idx == 16:
+      if v == '':
+        line[idx] = None
+      else:
+        line[idx] = int(v)
+    elif idx == 17:
+      if v == '':
+        line[idx] = None
+      else:
+        line[idx] = v
+    elif idx in range(18,22):
+      if v == '0':
+        line[idx] = False
+      elif v == '':
+        line[idx] = None
+      else:
+        line[idx] = True
+  if line[6] and line[7]:
+    line.append(datetime.datetime.combine(line[6], line[7]))
+  if line[8] and line[9]:
+    line.append(datetime.datetime.combine(line[8], line[9]))
+  return line
+
+
+def synthetic_capture(count, seed=1090):
+  rnd = random.Random(seed)
+  icaos = ["%06X" % rnd.randint(0, 0xFFFFFF) for _ in range(60)]
+  start = datetime.datetime(2019, 4, 16, 12, 0, 0)
+  lines = []
+  for i in range(count):
+    now = start + datetime.timedelta(milliseconds=i * 3)
+    d = now.strftime('%Y/%m/%d')
+    t = now.strftime('%H:%M:%S.') + '%03d' % (now.microsecond // 1000)
+    icao = rnd.choice(icaos)
+    ttype = rnd.choice((1, 3, 3, 4, 4, 5, 5, 6, 7, 8, 8))
+    fields = [''] * 22
+    fields[0:10] = ['MSG', str(ttype), '111', '11111', icao, '111111', d, t, d, t]
+    if ttype == 1:
+      fields[10] = 'AAL%d' % rnd.randint(1, 2999)
+    elif ttype == 3:
+      fields[11] = str(rnd.randint(1000, 39000))
+      fields[14] = '%.5f' % rnd.uniform(39.0, 42.0)
+      fields[15] = '%.5f' % rnd.uniform(-75.0, -72.0)
+      fields[18:22] = ['0', '0', '0', '0']
+    elif ttype == 4:
+      fields[12] = str(rnd.randint(120, 480))
+      fields[13] = str(rnd.randint(0, 359))
+      fields[16] = str(rnd.randint(-2000, 2000))
+    elif ttype in (5, 7):
+      fields[11] = str(rnd.randint(1000, 39000))
+      fields[18:22] = ['0', '', '0', '0']
+    elif ttype == 6:
+      fields[17] = '%04o' % rnd.randint(0, 0o7777)
+      fields[18:22] = ['0', '0', '0', '0']
+    lines.append(",".join(fields) + "\r\n")
+  return lines
+
+
+def run(fn, lines, repeat):
+  best = None
+  for _ in range(repeat):
+    start = time.time()
+    for l in lines:
+      fn(l)
+    elapsed = time.time() - start
+    if best is None or elapsed < best:
+      best = elapsed
+  return len(lines) / best
+
+
+def run_columnar(lines, repeat, read_size):
+  # the reader hands them over without their line endings
+  reads = [
+    [l.rstrip('\r\n') for l in lines[i:i + read_size]]
+    for i in range(0, len(lines), read_size)
+  ]
+  def parse_reads(_):
+    for read in reads:
+      columnar.parse(read)
+  return run(parse_reads, [None], repeat) * len(lines)
+
+
+def main():
+  parser = argparse.ArgumentParser(description="Benchmark the SBS-1 line parser")
+  parser.add_argument("capture", nargs="?", default=None, help="A recorded basestation capture file. Defaults to a synthetic capture.")
+  parser.add_argument("--lines", type=int, default=100000, help="Number of synthetic lines to generate when no capture is given. Defaults to %(default)s")
+  parser.add_argument("--repeat", type=int, default=3, help="Number of runs; the best one is reported. Defaults to %(default)s")
+  parser.add_argument("--read-size", type=int, default=1000, help="Lines per read for columnar.parse. Defaults to %(default)s")
+  args = parser.parse_args()
+
+  if args.capture:
+    with open(args.capture, 'rb') as f:
+      lines = f.readlines()
+    source = args.capture
+  else:
+    lines = synthetic_capture(args.lines)
+    source = "synthetic capture"
+
+  sys.stdout.write("%s: %d lines\n" % (source, len(lines)))
+  before = run(legacy_parse_line, lines, args.repeat)
+  sys.stdout.write("  legacy enumerate loop: %10.0f lines/sec\n" % (before,))
+  after = run(sbs1.parse_line, lines, args.repeat)
+  sys.stdout.write("  sbs1.parse_line:       %10.0f lines/sec (%.1fx)\n" % (after, after / before))
+  compact = run(sbs1.parse_line_compact, lines, args.repeat)
+  sys.stdout.write("  sbs1.parse_line_compact: %8.0f lines/sec (%.1fx)\n" % (compact, compact / before))
+  if columnar.numpy is not None:
+    vectorized = run_columnar(lines, args.repeat, args.read_size)
+    sys.stdout.write("  columnar.parse:        %10.0f lines/sec (%.1fx)\n" % (vectorized, vectorized / before))
+
+
+if __name__ == '__main__':
+  main()
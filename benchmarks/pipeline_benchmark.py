@@ -0,0 +1,267 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+end-to-end benchmark of the logging pipeline: simulated dump1090 traffic
+(see feed_simulator.py) over a local tcp connection, through
+stream.MultiReader, sbs1.parse_line, the dedup throttle and the writer
+thread, into a sink.
+
+usage:
+    python benchmarks/pipeline_benchmark.py [--sink null|sqlite|mysql|psql]
+        [--lines N] [--rate N] [--aircraft N] [--fragment N]
+        [--parse-workers N]
+
+sinks:
+    null    discards every batch, to measure everything but the database
+    sqlite  a squitters table in a sqlite database (in memory by default)
+    mysql   a local mysql
+    psql    a local postgis database set up with psql/create.sql, written
+            with INSERT (or COPY with --copy)
+
+the database sinks are the loggers' own backends (see backends.py).
+
+rows are written to the squitters table, so use a scratch database for
+mysql and psql.
+
+with --parse-workers, lines are parsed on worker processes as with the
+loggers' --parse-workers (see sharding.py). their cpu time is included.
+"""
+
+import argparse
+import datetime
+import multiprocessing
+import os
+import socket
+import sys
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+import backends
+import batching
+import pipeline
+import sbs1
+import sharding
+import stream
+import throttle
+
+import feed_simulator
+
+SINKS = ('null', 'sqlite', 'mysql', 'psql')
+
+# as in dump1090-stream-parser.py
+TRANSMISSION_TYPE_TTL = (
+  None,
+  datetime.timedelta(seconds=1),
+  datetime.timedelta(seconds=1),
+  None,
+  datetime.timedelta(seconds=5),
+  datetime.timedelta(seconds=10),
+  datetime.timedelta(seconds=1),
+  None,
+  None,
+)
+TRANSMISSION_TYPE_ALIAS = (0, 1, 2, 2, 4, 5, 6, 5, 2)
+ONLY_LOG_TYPES = backends.ONLY_LOG_TYPES
+
+
+def null_sink(args):
+  return (lambda rows: None, lambda: None)
+
+
+def _backend_sink(backend):
+  backend.open()
+  backend.ensure_schema()
+  return (backend.write, backend.close)
+
+
+def sqlite_sink(args):
+  return _backend_sink(backends.SQLite(args.sqlite_database))
+
+
+def mysql_sink(args):
+  return _backend_sink(backends.MySQL(
+    dict(
+      host=args.db_host,
+      user=args.db_user,
+      password=args.db_pass,
+      database=args.db_database,
+      auth_plugin='mysql_native_password',
+    ),
+    args.batch_size,
+    compress=False,
+  ))
+
+
+def psql_sink(args):
+  return _backend_sink(backends.PostgreSQL(
+    dict(
+      host=args.db_host,
+      user=args.db_user,
+      password=args.db_pass,
+      database=args.db_database,
+    ),
+    copy=args.copy,
+  ))
+
+
+class Meter(object):
+  """
+  wraps a sink's write(rows), recording how long after the simulator
+  generated each row it was committed
+  """
+
+  def __init__(self, write):
+    self.write = write
+    self.latencies = []
+
+  def __call__(self, rows):
+    self.write(rows)
+    now = datetime.datetime.utcnow()
+    for row in rows:
+      generated = row[sbs1.GENERATED_DATETIME]
+      if generated is not None:
+        self.latencies.append((now - generated).total_seconds())
+
+
+def percentile(values, p):
+  return values[int(round(p * (len(values) - 1)))]
+
+
+def free_port():
+  s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+  s.bind(("127.0.0.1", 0))
+  port = s.getsockname()[1]
+  s.close()
+  return port
+
+
+def run(args, write):
+  # start the feed in its own process, so its cpu time isn't counted
+  port = free_port()
+  ready = multiprocessing.Event()
+  feed = multiprocessing.Process(
+    target=feed_simulator.serve,
+    args=(port, args.aircraft, args.rate, args.lines, args.fragment, args.mix),
+    kwargs={'ready': ready},
+  )
+  feed.daemon = True
+  feed.start()
+  ready.wait(10)
+
+  # the same pipeline as main() in the loggers
+  meter = Meter(write)
+  rows = batching.RowBuffer(meter, args.batch_size, args.batch_delay / 1000.0)
+  queue = pipeline.RowQueue(args.queue_size)
+  writer = pipeline.Writer(queue, rows)
+  writer.start()
+  source = stream.Source("127.0.0.1", port)
+  feeds = stream.MultiReader([source], args.buffer_size)
+  ttls = throttle.Throttle(TRANSMISSION_TYPE_TTL, TRANSMISSION_TYPE_ALIAS)
+  if args.parse_workers:
+    workers = sharding.ShardedParser(
+      [source], args.parse_workers, sbs1.parse_line, ONLY_LOG_TYPES,
+      TRANSMISSION_TYPE_TTL, TRANSMISSION_TYPE_ALIAS, throttled=not args.no_throttle,
+    )
+  else:
+    workers = None
+
+  received = 0
+  start = None
+  cpu_start = os.times()
+  deadline = time.time() + args.timeout
+  while received < args.lines and time.time() < deadline:
+    received_lines = feeds.read(0.1)
+    if workers is not None:
+      if received_lines and start is None:
+        start = time.time()
+      received += sum(len(data) for (_, data) in received_lines)
+      workers.put(received_lines, datetime.datetime.utcnow())
+      for row in workers.rows():
+        queue.put(row)
+      continue
+    for (_, data) in received_lines:
+      if start is None:
+        start = time.time()
+      received += len(data)
+      cur_time = datetime.datetime.utcnow()
+      for d in data:
+        record = sbs1.parse_line(d)
+        if record is None:
+          continue
+        if record[sbs1.TRANSMISSION_TYPE] not in ONLY_LOG_TYPES:
+          continue
+        if not args.no_throttle and not ttls.allow(record[sbs1.ICAO_ADDR], record[sbs1.TRANSMISSION_TYPE]):
+          continue
+        queue.put(sbs1.make_row(record, cur_time, source.is_mlat, source.client_id))
+  if workers is not None:
+    for row in workers.rows(wait=True):
+      queue.put(row)
+  read_elapsed = time.time() - (start or time.time())
+  feeds.close()
+  writer.stop()
+  elapsed = time.time() - (start or time.time())
+  if workers is not None:
+    # once they've exited, the workers' cpu time is in os.times()
+    workers.close()
+  cpu_end = os.times()
+  feed.terminate()
+
+  cpu = sum(cpu_end[i] - cpu_start[i] for i in range(4))
+  return {
+    'lines': received,
+    'rows': rows.rows_written,
+    'read_elapsed': read_elapsed,
+    'elapsed': elapsed,
+    'cpu': cpu,
+    'latencies': sorted(meter.latencies),
+    'error': writer.error,
+  }
+
+
+def main():
+  parser = argparse.ArgumentParser(description="Benchmark the whole logging pipeline against a simulated dump1090 feed")
+  parser.add_argument("--sink", type=str, default='null', choices=SINKS, help="Where rows are written. Defaults to %(default)s")
+  parser.add_argument("--lines", type=int, default=200000, help="Number of lines to send. Defaults to %(default)s")
+  parser.add_argument("--rate", type=int, default=0, help="Lines per second to send, or 0 for as fast as possible. Defaults to %(default)s")
+  parser.add_argument("--aircraft", type=int, default=200, help="Number of simulated aircraft. Defaults to %(default)s")
+  parser.add_argument("--fragment", type=int, default=0, help="Split the feed's writes at random points, into pieces of at most this many bytes.")
+  parser.add_argument("--mix", type=feed_simulator.parse_mix, default=feed_simulator.MIX, help="Relative frequency of each transmission type, as type:weight,...")
+  parser.add_argument("--no-throttle", default=False, action='store_true', help="Write every message, instead of deduplicating them like the loggers do.")
+  parser.add_argument("--parse-workers", type=int, default=0, help="Parse lines on this many worker processes. Defaults to %(default)s")
+  parser.add_argument("--buffer-size", type=int, default=stream.BUFFER_SIZE)
+  parser.add_argument("--batch-size", type=int, default=1000, help="Defaults to %(default)s")
+  parser.add_argument("--batch-delay", type=int, default=batching.BATCH_DELAY)
+  parser.add_argument("--queue-size", type=int, default=pipeline.QUEUE_SIZE)
+  parser.add_argument("--timeout", type=float, default=300.0, help="Give up after this many seconds. Defaults to %(default)s")
+  parser.add_argument("--copy", default=False, action='store_true', help="Use COPY with the psql sink.")
+  parser.add_argument("--sqlite-database", type=str, default=":memory:")
+  parser.add_argument("--db-host", type=str, default="localhost")
+  parser.add_argument("--db-user", type=str, default="dump1090")
+  parser.add_argument("--db-pass", type=str, default="dump1090")
+  parser.add_argument("--db-database", type=str, default="dump1090")
+  args = parser.parse_args()
+
+  (write, close) = globals()["%s_sink" % (args.sink,)](args)
+  try:
+    result = run(args, write)
+  finally:
+    close()
+
+  sys.stdout.write("%s sink: %d lines from %d aircraft, %d rows written\n" % (args.sink, result['lines'], args.aircraft, result['rows']))
+  if result['error'] is not None:
+    sys.stdout.write("  writer failed: %r\n" % (result['error'],))
+  if not result['lines'] or not result['elapsed']:
+    return
+  sys.stdout.write("  %10.0f lines/sec read\n" % (result['lines'] / result['read_elapsed'],))
+  sys.stdout.write("  %10.0f rows/sec written\n" % (result['rows'] / result['elapsed'],))
+  sys.stdout.write("  %10.1f usec cpu per line\n" % (result['cpu'] * 1e6 / result['lines'],))
+  latencies = result['latencies']
+  if latencies:
+    sys.stdout.write("  latency (ms): p50 %.1f, p90 %.1f, p99 %.1f, max %.1f\n" % tuple(
+      1000 * percentile(latencies, p) for p in (0.5, 0.9, 0.99, 1.0)
+    ))
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,434 @@
+# encoding: utf-8
+"""
+parsing a whole read of basestation lines at once into numpy arrays, in
+the compact encoding (see sbs1.parse_line_compact), instead of line by
+line into python objects.
+
+the lines are joined into one buffer and split at its commas, and each
+field is then converted for every line at once. lines in the format
+dump1090 writes never leave numpy; anything else (a time without leading
+zeros, a float with an exponent, ...) is handed to
+sbs1.parse_line_compact, so the results are always the same as parsing
+line by line.
+"""
+
+import sbs1
+
+try:
+  import numpy
+except ImportError:
+  numpy = None
+
+_FIELDS = sbs1.FIELD_COUNT
+# ids longer than this don't fit in an int64
+_ID_WIDTH = 18
+# digits in a float that are sure to be exact in a float64 mantissa
+_FLOAT_DIGITS = 15
+
+_MESSAGE_TYPE_WIDTH = 4
+_TIME_WIDTH = 12
+
+_MONTH_DAYS = (0, 31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31)
+
+
+def _table(chars, values):
+  table = numpy.empty(256, numpy.uint8)
+  table.fill(255)
+  for (c, v) in zip(chars, values):
+    table[ord(c)] = v
+  return table
+
+if numpy is not None:
+  # as in str.strip()
+  _SPACE = numpy.zeros(256, bool)
+  _SPACE[[ord(c) for c in " \t\n\r\x0b\x0c"]] = True
+  _DIGITS = _table("0123456789", range(10))
+  _HEX = _table("0123456789abcdefABCDEF", list(range(16)) + list(range(10, 16)))
+  _LETTERS = numpy.zeros(256, bool)
+  _LETTERS[[ord(c) for c in "abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ"]] = True
+  _MONTH_DAYS_ARRAY = numpy.array(_MONTH_DAYS)
+
+
+def _split(lines):
+  # (buffer, lines with the right number of fields, and the start and end
+  # of each of their fields, as (lines, _FIELDS) arrays)
+  data = b"\n".join(lines) + b"\n"
+  buf = numpy.frombuffer(data, numpy.uint8)
+  line_ends = numpy.flatnonzero(buf == 10)
+  line_starts = numpy.empty_like(line_ends)
+  line_starts[0] = 0
+  line_starts[1:] = line_ends[:-1] + 1
+  is_comma = buf == 44
+  counts = numpy.add.reduceat(is_comma, line_starts, dtype=numpy.int64)
+  complete = counts == _FIELDS - 1
+  commas = numpy.flatnonzero(is_comma)[numpy.repeat(complete, counts)].reshape(-1, _FIELDS - 1)
+  starts = numpy.empty((len(commas), _FIELDS), numpy.int64)
+  starts[:, 0] = line_starts[complete]
+  starts[:, 1:] = commas + 1
+  ends = numpy.empty_like(starts)
+  ends[:, :-1] = commas
+  ends[:, -1] = line_ends[complete]
+  return (buf, complete, starts, ends)
+
+
+def _strip(buf, starts, ends):
+  # str.strip() every field, by moving its start and end
+  while True:
+    leading = (starts < ends) & _SPACE[buf[starts]]
+    if not leading.any():
+      break
+    starts[leading] += 1
+  while True:
+    trailing = (starts < ends) & _SPACE[buf[ends - 1]]
+    if not trailing.any():
+      break
+    ends[trailing] -= 1
+
+
+def _left(buf, starts, ends, width):
+  # the first `width` bytes of each field as a (fields, width) array,
+  # zero past the end of the field, and which of them are in the field
+  index = starts[:, None] + numpy.arange(width)
+  inside = index < ends[:, None]
+  chars = buf[numpy.minimum(index, len(buf) - 1)]
+  chars[~inside] = 0
+  return (chars, inside)
+
+
+def _right(buf, starts, ends, width):
+  # like _left(), but the last `width` bytes, lined up on the right
+  index = ends[:, None] + (numpy.arange(width) - width)
+  inside = index >= starts[:, None]
+  chars = buf[numpy.maximum(index, 0)]
+  chars[~inside] = 0
+  return (chars, inside)
+
+
+def _powers(base, width):
+  return base ** numpy.arange(width - 1, -1, -1, dtype=numpy.int64)
+
+
+def _nonempty(convert, buf, starts, ends, **kwargs):
+  """
+  (values, present, regular) for every field, where `convert` works out
+  those of the fields that aren't empty
+  """
+  n = len(starts)
+  index = numpy.flatnonzero(ends > starts)
+  (v, p, r) = convert(buf, starts[index], ends[index], **kwargs)
+  values = numpy.zeros(n, v.dtype)
+  values[index] = v
+  present = numpy.zeros(n, bool)
+  present[index] = p
+  regular = numpy.ones(n, bool)
+  regular[index] = r
+  return (values, present, regular)
+
+
+# the converters below are only given fields that aren't empty, and
+# return (values, present, regular). fields that aren't regular are left
+# to sbs1's converters.
+
+def _integer(buf, starts, ends, table=None, base=10, width=10, signed=True):
+  # like int(v, base), for (a minus sign and) digits
+  if table is None:
+    table = _DIGITS
+  if signed:
+    negative = buf[starts] == 45
+  else:
+    negative = numpy.zeros(len(starts), bool)
+  first = starts + negative
+  (chars, inside) = _right(buf, first, ends, width)
+  digits = table[chars]
+  regular = (ends > first) & (ends - first <= width) & ((digits < base) | ~inside).all(axis=1)
+  values = numpy.where(inside, digits, 0).astype(numpy.int64).dot(_powers(base, width))
+  return (numpy.where(negative, -values, values), numpy.ones(len(starts), bool), regular)
+
+
+def _id(buf, starts, ends):
+  # like sbs1._id: digits, or None
+  (values, _, digits) = _integer(buf, starts, ends, width=_ID_WIDTH, signed=False)
+  return (values, digits, ends - starts <= _ID_WIDTH)
+
+
+def _scaled(buf, starts, ends):
+  # like sbs1._scaled: a float in units of 1/LATLON_SCALE
+  negative = buf[starts] == 45
+  first = starts + negative
+  width = _FLOAT_DIGITS + 1
+  (chars, inside) = _right(buf, first, ends, width)
+  digits = _DIGITS[chars]
+  is_digit = inside & (digits < 10)
+  dot = inside & (chars == 46)
+  count = is_digit.sum(axis=1)
+  regular = (
+    (ends - first <= width) & (dot.sum(axis=1) <= 1) & (count >= 1) & (count <= _FLOAT_DIGITS) &
+    ((is_digit | dot) == inside).all(axis=1)
+  )
+  # read with the dot as a 0, an integer part I and k decimals F are
+  # I * 10^(k + 1) + F
+  values = numpy.where(is_digit, digits, 0).astype(numpy.int64).dot(_powers(10, width))
+  has_dot = dot.any(axis=1)
+  decimals = numpy.where(has_dot, width - 1 - dot.argmax(axis=1), 0)
+  fraction = values % (10 ** decimals)
+  mantissa = numpy.where(has_dot, (values - fraction) // 10 + fraction, values)
+  # both are exact, so this is the correctly rounded float(v)
+  values = mantissa / (10.0 ** decimals)
+  values = numpy.where(negative, -values, values) * sbs1.LATLON_SCALE
+  # round() in python 2 rounds halves away from zero
+  magnitude = numpy.abs(values)
+  rounded = numpy.floor(magnitude)
+  rounded += (magnitude - rounded) >= 0.5
+  return (numpy.where(values < 0, -rounded, rounded).astype(numpy.int64), numpy.ones(len(starts), bool), regular)
+
+
+def _days_from_civil(y, m, d):
+  # days since 1970-01-01 of a proleptic gregorian date
+  y = y - (m <= 2)
+  era = y // 400
+  yoe = y - era * 400
+  doy = (153 * numpy.where(m > 2, m - 3, m + 9) + 2) // 5 + d - 1
+  doe = yoe * 365 + yoe // 4 - yoe // 100 + doy
+  return era * 146097 + doe - 719468
+
+
+def _day_ms(buf, starts, ends):
+  # like sbs1._day_ms, for "YYYY/MM/DD"
+  (chars, inside) = _left(buf, starts, ends, 10)
+  d = _DIGITS[chars].astype(numpy.int64)
+  shaped = (
+    (ends - starts == 10) & (chars[:, 4] == 47) & (chars[:, 7] == 47) &
+    (d[:, [0, 1, 2, 3, 5, 6, 8, 9]] < 10).all(axis=1)
+  )
+  year = d[:, 0] * 1000 + d[:, 1] * 100 + d[:, 2] * 10 + d[:, 3]
+  month = d[:, 5] * 10 + d[:, 6]
+  day = d[:, 8] * 10 + d[:, 9]
+  valid_month = (month >= 1) & (month <= 12)
+  leap = (year % 4 == 0) & ((year % 100 != 0) | (year % 400 == 0))
+  month_days = _MONTH_DAYS_ARRAY[numpy.where(valid_month, month, 0)] + (leap & (month == 2))
+  # anything strptime() would reject is left to it
+  regular = shaped & (year >= 1) & valid_month & (day >= 1) & (day <= month_days)
+  return (_days_from_civil(year, month, day) * 86400000, numpy.ones(len(starts), bool), regular)
+
+
+def _ms_of_day(buf, starts, ends):
+  # like sbs1._ms_of_day, for "HH:MM:SS" or "HH:MM:SS.f" to "HH:MM:SS.fff"
+  (chars, inside) = _left(buf, starts, ends, _TIME_WIDTH)
+  d = _DIGITS[chars].astype(numpy.int64)
+  length = ends - starts
+  fraction = inside.copy()
+  fraction[:, :9] = False
+  shaped = (
+    ((length == 8) | ((length >= 10) & (length <= _TIME_WIDTH) & (chars[:, 8] == 46))) &
+    (chars[:, 2] == 58) & (chars[:, 5] == 58) &
+    (d[:, [0, 1, 3, 4, 6, 7]] < 10).all(axis=1) &
+    ((d < 10) | ~fraction).all(axis=1)
+  )
+  h = d[:, 0] * 10 + d[:, 1]
+  m = d[:, 3] * 10 + d[:, 4]
+  s = d[:, 6] * 10 + d[:, 7]
+  # milliseconds, from the first three digits of the fraction
+  ms = numpy.where(fraction & (d < 10), d, 0)[:, 9:].dot(_powers(10, 3))
+  values = ((h * 60 + m) * 60 + s) * 1000 + ms
+  exists = (h <= 23) & (m <= 59) & (s <= 59)
+  return (values, exists, shaped)
+
+
+def _strings(buf, starts, ends, width):
+  # the first `width` characters, as sbs1._callsign
+  (chars, inside) = _left(buf, starts, ends, width)
+  values = numpy.ascontiguousarray(chars).view('S%d' % (width,)).ravel().astype(object)
+  return (values, numpy.ones(len(starts), bool), numpy.ones(len(starts), bool))
+
+
+def _message_type(buf, starts, ends):
+  # like sbs1._message_type, for a few letters
+  (chars, inside) = _left(buf, starts, ends, _MESSAGE_TYPE_WIDTH)
+  regular = (ends - starts <= _MESSAGE_TYPE_WIDTH) & (_LETTERS[chars] | ~inside).all(axis=1)
+  (values, present, _) = _strings(buf, starts, ends, _MESSAGE_TYPE_WIDTH)
+  return (values, present, regular)
+
+
+def _bool(buf, starts, ends):
+  # like sbs1._bool
+  values = ~((ends - starts == 1) & (buf[starts] == 48))
+  return (values, numpy.ones(len(starts), bool), numpy.ones(len(starts), bool))
+
+
+def _ones(buf, starts, ends, length):
+  # fields that are `length` '1's
+  out = ends - starts == length
+  index = numpy.flatnonzero(out)
+  (chars, inside) = _left(buf, starts[index], ends[index], length)
+  out[index] = (chars == 49).all(axis=1)
+  return out
+
+
+class Records(object):
+  """
+  parsed lines as numpy arrays. `values[i]` and `present[i]` are the
+  values of sbs1.RECORD_COLUMNS[i] in the compact encoding, and whether
+  each line had one. `parsed` is whether each line was a well-formed
+  message at all, and `lines` is the index of each in the lines given to
+  parse(); lines without the right number of fields are left out, and
+  counted in `errors` along with the rest that weren't parsed.
+  """
+
+  def __init__(self, lines, values, present, parsed, errors):
+    self.lines = lines
+    self.values = values
+    self.present = present
+    self.parsed = parsed
+    self.errors = errors
+
+  def __len__(self):
+    return len(self.parsed)
+
+  def rows(self, index, parsed_time, is_mlat, client_id):
+    """
+    sbs1.make_row() of the records at `index`, where `parsed_time` is a
+    value or an array of values for them
+    """
+    columns = [self.column(i, index) for i in range(len(self.values))]
+    if isinstance(parsed_time, numpy.ndarray):
+      columns.append(parsed_time.tolist())
+    else:
+      columns.append([parsed_time] * len(index))
+    columns.append([is_mlat] * len(index))
+    columns.append([client_id] * len(index))
+    return list(zip(*columns))
+
+  def column(self, i, index):
+    """
+    the values of sbs1.RECORD_COLUMNS[i] of the records at `index`, as a
+    list with None where they're missing
+    """
+    column = self.values[i][index].astype(object)
+    column[~self.present[i][index]] = None
+    return column.tolist()
+
+
+def parse(lines):
+  """
+  parse a list of basestation lines (without their line endings) into
+  Records
+  """
+  if not lines:
+    empty = numpy.zeros(0, numpy.int64)
+    return Records(empty, [empty] * len(sbs1.RECORD_COLUMNS), [empty.astype(bool)] * len(sbs1.RECORD_COLUMNS), empty.astype(bool), 0)
+  (buf, complete, starts, ends) = _split(lines)
+  _strip(buf, starts, ends)
+
+  def field(i):
+    return (buf, starts[:, i], ends[:, i])
+
+  # session_id, aircraft_id, flight_id are sometimes censored with '11111'?
+  censored = (
+    (_ones(*field(2), length=3) & _ones(*field(3), length=5) & _ones(*field(5), length=6)) |
+    (_ones(*field(2), length=1) & _ones(*field(3), length=1) & _ones(*field(5), length=1))
+  )
+  converted = [
+    _nonempty(_message_type, *field(0)),
+    _nonempty(_integer, *field(1)),
+    _nonempty(_id, *field(2)),
+    _nonempty(_id, *field(3)),
+    _nonempty(_integer, *field(4), table=_HEX, base=16, width=8, signed=False),
+    _nonempty(_id, *field(5)),
+    _nonempty(_strings, *field(10), width=sbs1.CALLSIGN_LENGTH),
+    _nonempty(_integer, *field(11)),
+    _nonempty(_integer, *field(12)),
+    _nonempty(_integer, *field(13)),
+    _nonempty(_scaled, *field(14)),
+    _nonempty(_scaled, *field(15)),
+    _nonempty(_integer, *field(16)),
+    _nonempty(_integer, *field(17), base=8, width=8, signed=False),
+    _nonempty(_bool, *field(18)),
+    _nonempty(_bool, *field(19)),
+    _nonempty(_bool, *field(20)),
+    _nonempty(_bool, *field(21)),
+  ]
+  for (date, time) in ((6, 7), (8, 9)):
+    (day, time) = (_nonempty(_day_ms, *field(date)), _nonempty(_ms_of_day, *field(time)))
+    converted.append((day[0] + time[0], day[1] & time[1], day[2] & time[2]))
+
+  values = [c[0] for c in converted]
+  present = [c[1] for c in converted]
+  for i in (sbs1.SESSION_ID, sbs1.AIRCRAFT_ID, sbs1.FLIGHT_ID):
+    present[i] = present[i] & ~censored
+  regular = numpy.ones(len(starts), bool)
+  for c in converted:
+    regular &= c[2]
+  parsed = numpy.ones(len(starts), bool)
+
+  # everything else goes through the line by line parser
+  index = numpy.flatnonzero(complete)
+  for j in numpy.flatnonzero(~regular):
+    record = sbs1.parse_line_compact(lines[index[j]])
+    if record is None:
+      parsed[j] = False
+      continue
+    for (i, v) in enumerate(record):
+      present[i][j] = v is not None
+      if v is not None:
+        values[i][j] = v
+
+  errors = (len(lines) - len(index)) + int((~parsed).sum())
+  return Records(index, values, present, parsed, errors)
+
+
+def squitters(lines, only_log_types, ttls, cur_time, is_mlat, client_id, record_time=False, ingest=None, live_state=None):
+  """
+  the compact rows that the loggers' main loop would queue for `lines`
+  from one source, and the number that weren't well-formed messages.
+
+  rows of transmission types that aren't in `only_log_types` are
+  skipped, and unless `is_mlat`, the rest are throttled by `ttls`, a
+  throttle.ArrayThrottle. with `record_time`, rows are stamped and
+  throttled with the time in the line, as when reading a capture. with
+  a filters.IngestFilter as `ingest`, rows it turns away are skipped
+  before they're throttled. with a live.LiveState as `live_state`, every
+  row of a logged type is merged into it first.
+  """
+  records = parse(lines)
+  transmission_type = records.values[sbs1.TRANSMISSION_TYPE]
+  keep = records.parsed & records.present[sbs1.TRANSMISSION_TYPE] & numpy.in1d(transmission_type, list(only_log_types))
+  index = numpy.flatnonzero(keep)
+
+  if record_time:
+    # the time logged, or generated, or else that of the line before
+    times = numpy.zeros(len(index), numpy.int64)
+    has_time = numpy.zeros(len(index), bool)
+    for i in (sbs1.GENERATED_DATETIME, sbs1.LOGGED_DATETIME):
+      own = records.present[i][index] & (records.values[i][index] != 0)
+      times = numpy.where(own, records.values[i][index], times)
+      has_time |= own
+    last = numpy.maximum.accumulate(numpy.where(has_time, numpy.arange(len(index)), -1)) if len(index) else index
+    parsed_time = numpy.where(last >= 0, times[numpy.maximum(last, 0)], cur_time)
+  else:
+    parsed_time = cur_time
+
+  if live_state is not None:
+    # every message, throttled or not, so the state is current
+    for row in records.rows(index, parsed_time, is_mlat, client_id):
+      live_state.update(row, row[-3], is_mlat, client_id)
+
+  if ingest is not None and len(index):
+    # record by record, since an aircraft's position carries over to its
+    # records without one
+    fields = [records.column(i, index) for i in (sbs1.ICAO_ADDR, sbs1.LAT, sbs1.LON, sbs1.ALTITUDE)]
+    allowed = numpy.fromiter((ingest.allow_fields(*f) for f in zip(*fields)), bool, len(index))
+    index = index[allowed]
+    if record_time:
+      parsed_time = parsed_time[allowed]
+
+  if not is_mlat:
+    allowed = ttls.allow_many(
+      records.values[sbs1.ICAO_ADDR][index],
+      transmission_type[index],
+      parsed_time / 1000.0 if record_time else None,
+    )
+    index = index[allowed]
+    if record_time:
+      parsed_time = parsed_time[allowed]
+
+  return (records.rows(index, parsed_time, is_mlat, client_id), records.errors)
@@ -1,21 +1,60 @@
 #!/usr/bin/env python
 # encoding: utf-8
 
-import socket
-from decimal import Decimal
 import datetime
-import mysql.connector
 import argparse
-import time
-import traceback
 import sys
+import functools
+import traceback
+
+import archive
+import backends
+import batching
+import columnar
+import filters
+import indexes
+import live
+import metrics
+import partitions
+import pipeline
+import relay
+import retry
+import sbs1
+import sharding
+import spool
+import stream
+import throttle
+import tracks
 
 #defaults
 HOST = "localhost"
 PORT = 30003
-BUFFER_SIZE = 50
+BUFFER_SIZE = stream.BUFFER_SIZE
 BATCH_SIZE = 20
+BATCH_DELAY = batching.BATCH_DELAY
+QUEUE_SIZE = pipeline.QUEUE_SIZE
+QUEUE_POLICY = pipeline.QUEUE_POLICY
+SPILL_FILE = pipeline.SPILL_FILE
+SPILL_MAX_SIZE = pipeline.SPILL_MAX_SIZE // (1024 * 1024)
+SPOOL_MAX_SIZE = spool.MAX_SIZE // (1024 * 1024)
+SPOOL_RETRY_DELAY = spool.RETRY_DELAY
+THROTTLE_MAX_ENTRIES = throttle.MAX_ENTRIES
+DEDUP = 'ttl'
+HEARTBEAT = throttle.HEARTBEAT
+POSITION_DELTA = throttle.POSITION_DELTA
+ALTITUDE_DELTA = throttle.ALTITUDE_DELTA
+TRACK_DELTA = throttle.TRACK_DELTA
+SPEED_DELTA = throttle.SPEED_DELTA
+VERTICAL_RATE_DELTA = throttle.VERTICAL_RATE_DELTA
+PARTITIONS_AHEAD = partitions.AHEAD
+ARCHIVE_COMPRESSION = archive.COMPRESSION
+ARCHIVE_FLUSH_INTERVAL = archive.FLUSH_INTERVAL
+PARSE_WORKERS = 0
 CONNECT_ATTEMPT_DELAY = 1.0
+CONNECT_TIMEOUT = stream.CONNECT_TIMEOUT
+IDLE_TIMEOUT = stream.IDLE_TIMEOUT
+DB_RETRY_DELAY = 1.0
+RELAY_BUFFER_SIZE = relay.MAX_BUFFER
 
 #
 TRANSMISSION_TYPE_TTL = (
@@ -41,372 +80,541 @@ TRANSMISSION_TYPE_ALIAS = (
   2, # 8 -> 2
 )
 
-# we'll discard any rows with `transmission_type` not in this set.
-# 8 (all call reply) is very frequent but does not normally carry data
-# for us. 7 (air to air) is also common but only contains altitude.
-# your mileage may vary. see the following:
-#    http://woodair.net/SBS/Article/Barebones42_Socket_Data.htm
-#    https://github.com/wiseman/node-sbs1
-ONLY_LOG_TYPES = frozenset({1,2,3,4,5,6,7,8})
 
-def main():
+def main(default_backend=backends.BACKEND):
   #set up command line options
   parser = argparse.ArgumentParser(description="A program to process dump1090 messages then insert them into a database")
   parser.add_argument("-l", "--location", type=str, default=HOST, help="This is the network location of your dump1090 broadcast. Defaults to %s" % (HOST,))
   parser.add_argument("-p", "--port", type=int, default=PORT, help="The port broadcasting in SBS-1 BaseStation format. Defaults to %s" % (PORT,))
   parser.add_argument("-c", "--client-id", type=int, default=0, help="A custom identifier to tag rows from different input sources.")
-
-  parser.add_argument("--mysql-host", type=str, default="localhost")
-  parser.add_argument("--mysql-port", type=int, default=3306)
-  parser.add_argument("--mysql-user", type=str, default="dump1090")
-  parser.add_argument("--mysql-pass", type=str, default="dump1090")
-  parser.add_argument("--mysql-database", type=str, default="dump1090")
-
-  parser.add_argument('--no-compress', default=False, action='store_true')
-
-  parser.add_argument("--buffer-size", type=int, default=BUFFER_SIZE, help="An integer of the number of bytes to read at a time from the stream. Defaults to %s" % (BUFFER_SIZE,))
-  parser.add_argument("--batch-size", type=int, default=BATCH_SIZE, help="An integer of the number of rows to write to the database at a time. If you turn off WAL mode, a lower number makes it more likely that your database will be locked when you try to query it. Defaults to %s" % (BATCH_SIZE,))
-  parser.add_argument("--connect-attempt-delay", type=float, default=CONNECT_ATTEMPT_DELAY, help="The number of seconds to wait after a failed connection attempt before trying again. Defaults to %s" % (CONNECT_ATTEMPT_DELAY,))
+  parser.add_argument("--file", type=str, action="append", default=None, metavar="PATH", help="Read a recorded capture (plain, .gz or .zst) instead of a dump1090 broadcast, or - for standard input. Can be given several times to read captures one after another. Rows are stamped with the time logged in the capture.")
+  parser.add_argument("--realtime", default=False, action='store_true', help="Replay --file captures at the pace they were recorded instead of as fast as possible.")
+  parser.add_argument("--source", type=stream.Source.parse, action="append", default=None, metavar="HOST:PORT:CLIENT_ID[:mlat]", help="Read from this dump1090 broadcast instead, tagging its rows with CLIENT_ID. Can be given several times to read from many sources at once. Sources on port %s, or ending in :mlat, are marked as mlat results." % (stream.MLAT_PORT,))
+
+  parser.add_argument("--backend", type=str, default=None, choices=[b.name for b in backends.BACKENDS], help="The database to write to. Defaults to sqlite if -d is given, and %s otherwise." % (default_backend,))
+
+  parser.add_argument("--buffer-size", type=int, default=BUFFER_SIZE, help="The size of the receive buffer, i.e. the most bytes to read from the stream at a time. Defaults to %s" % (BUFFER_SIZE,))
+  parser.add_argument("--batch-size", type=int, default=BATCH_SIZE, help="An integer of the number of rows to write to the database at a time, as a single INSERT. If you turn off WAL mode, a lower number makes it more likely that your database will be locked when you try to query it. Defaults to %s" % (BATCH_SIZE,))
+  parser.add_argument("--batch-delay", type=int, default=BATCH_DELAY, help="The most milliseconds to hold on to a partial batch before writing it anyway. Defaults to %s" % (BATCH_DELAY,))
+  parser.add_argument("--queue-size", type=int, default=QUEUE_SIZE, help="The most rows to hold in memory while waiting for the database. Defaults to %s" % (QUEUE_SIZE,))
+  parser.add_argument("--queue-policy", type=str, default=QUEUE_POLICY, choices=pipeline.QUEUE_POLICIES, help="What to do with new rows when the queue is full: wait for the database, drop the oldest queued row, or spill rows to --spill-file until the database catches up. Defaults to %s" % (QUEUE_POLICY,))
+  parser.add_argument("--spill-file", type=str, default=SPILL_FILE, help="Where to spill rows with --queue-policy=spill. Defaults to %s" % (SPILL_FILE,))
+  parser.add_argument("--spill-max-size", type=int, default=SPILL_MAX_SIZE, help="The most megabytes of rows to keep waiting in --spill-file; beyond that the oldest spilled rows are dropped. Defaults to %s" % (SPILL_MAX_SIZE,))
+  parser.add_argument("--spool-dir", type=str, default=None, help="A directory to spool rows to while the database is unreachable. They're written to the database once it's back, even after a restart. By default, the batch being written is retried until the database is back, while new rows wait in the queue (see --queue-policy).")
+  parser.add_argument("--spool-max-size", type=int, default=SPOOL_MAX_SIZE, help="The most megabytes to keep in --spool-dir; beyond that the oldest spooled rows are discarded. Defaults to %s" % (SPOOL_MAX_SIZE,))
+  parser.add_argument("--spool-retry-delay", type=float, default=SPOOL_RETRY_DELAY, help="The number of seconds to wait before trying the database again after a failed write. Defaults to %s" % (SPOOL_RETRY_DELAY,))
+  parser.add_argument("--throttle-max-entries", type=int, default=THROTTLE_MAX_ENTRIES, help="The maximum number of (aircraft, message type) timers to keep per source for deduplication. Older ones are forgotten first. Defaults to %s" % (THROTTLE_MAX_ENTRIES,))
+  parser.add_argument("--dedup", type=str, default=DEDUP, choices=('ttl', 'change'), help="How to skip duplicate rows: store each message type of an aircraft at most once per its TRANSMISSION_TYPE_TTL (ttl), or only when it has changed by more than the --*-delta options, and at least every --heartbeat seconds (change). Defaults to %s" % (DEDUP,))
+  parser.add_argument("--heartbeat", type=float, default=HEARTBEAT, help="With --dedup change, the most seconds between rows of a message type for an aircraft. Defaults to %s" % (HEARTBEAT,))
+  parser.add_argument("--position-delta", type=float, default=POSITION_DELTA, metavar="METERS", help="With --dedup change, store a position once it's this far from where the aircraft would be at its last reported speed and track. Defaults to %s" % (POSITION_DELTA,))
+  parser.add_argument("--altitude-delta", type=int, default=ALTITUDE_DELTA, metavar="FEET", help="With --dedup change, store an altitude that has changed by this much. Defaults to %s" % (ALTITUDE_DELTA,))
+  parser.add_argument("--track-delta", type=float, default=TRACK_DELTA, metavar="DEGREES", help="With --dedup change, store a track that has changed by this much. Defaults to %s" % (TRACK_DELTA,))
+  parser.add_argument("--speed-delta", type=int, default=SPEED_DELTA, metavar="KNOTS", help="With --dedup change, store a ground speed that has changed by this much. Defaults to %s" % (SPEED_DELTA,))
+  parser.add_argument("--vertical-rate-delta", type=int, default=VERTICAL_RATE_DELTA, metavar="FPM", help="With --dedup change, store a vertical rate that has changed by this much. Defaults to %s" % (VERTICAL_RATE_DELTA,))
+  parser.add_argument("--aggregate", type=float, default=None, metavar="SECONDS", help="Instead of raw squitters, merge the messages from each aircraft and write one fully-populated row per aircraft at most every SECONDS seconds to the track_points table.")
+  parser.add_argument("--compact", default=False, action='store_true', help="Write to the squitters_compact table instead, where lat/lon are integers in units of 1/%s degree, times are milliseconds since the epoch, ids are integers and callsigns are CHAR(%s). Rows are much smaller, and cheaper to parse and write." % (sbs1.LATLON_SCALE, sbs1.CALLSIGN_LENGTH))
+  parser.add_argument("--index-profile", type=str, default=None, choices=indexes.PROFILES, help="Secondary indexes for the squitters table: the original single-column ones (full), or a composite (icao_addr, parsed_time) and a parsed_time index, which are much cheaper to maintain (lean). Any that are missing are added at startup, which can take a long time on a large table.")
+  parser.add_argument("--drop-unlisted-indexes", default=False, action='store_true', help="With --index-profile, also drop the table's indexes that aren't in the profile, e.g. the single-column indexes of full when switching to lean.")
+  parser.add_argument("--bulk-load", default=False, action='store_true', help="Drop the table's secondary indexes while loading, and rebuild them once at the end. Much faster for large backfills with --file, but queries are slow until it's done.")
+  parser.add_argument("--partition", type=str, default=None, choices=partitions.INTERVALS, help="Keep daily or monthly partitions of the squitters table on parsed_time, creating upcoming ones as needed.")
+  parser.add_argument("--partitions-ahead", type=int, default=PARTITIONS_AHEAD, help="How many partitions past the current one to keep created with --partition. Defaults to %s" % (PARTITIONS_AHEAD,))
+  parser.add_argument("--retention", type=int, default=None, metavar="DAYS", help="With --partition, drop partitions that only hold rows older than DAYS days. By default, nothing is dropped.")
+  parser.add_argument("--parse-workers", type=int, default=PARSE_WORKERS, metavar="N", help="Parse and deduplicate lines on N worker processes instead of the main one, for feeds that keep a core busy. Lines are shared out by aircraft, so each aircraft's messages are throttled exactly as they would be otherwise. Defaults to %s" % (PARSE_WORKERS,))
+  parser.add_argument("--vectorize", default=False, action='store_true', help="With --compact, parse, filter and throttle each read of lines at once with numpy arrays instead of line by line. Much less work per line for busy feeds and captures. Needs the numpy package.")
+  parser.add_argument("--archive-dir", type=str, default=None, help="Also write squitters to hourly parquet files in this directory, in date=YYYY-MM-DD/client_id=N subdirectories, for long-term storage and analytics. Needs the pyarrow package.")
+  parser.add_argument("--archive-compression", type=str, default=ARCHIVE_COMPRESSION, choices=archive.COMPRESSIONS, help="How --archive-dir files are compressed. Defaults to %s" % (ARCHIVE_COMPRESSION,))
+  parser.add_argument("--archive-flush-interval", type=float, default=ARCHIVE_FLUSH_INTERVAL, help="The most seconds to hold --archive-dir rows in memory before writing them to the hour's file. Defaults to %s" % (ARCHIVE_FLUSH_INTERVAL,))
+  parser.add_argument("--metrics-port", type=int, default=None, help="Serve prometheus metrics (lines, parse failures, bytes and reconnects per source, throttled rows, commit times, queue depth) at http://<host>:<port>/metrics.")
+  parser.add_argument("--allow-icao", type=filters.parse_icaos, action="append", default=None, metavar="HEX[,HEX...]", help="Only store these icao addresses. Can be given several times.")
+  parser.add_argument("--deny-icao", type=filters.parse_icaos, action="append", default=None, metavar="HEX[,HEX...]", help="Never store these icao addresses. Can be given several times.")
+  parser.add_argument("--geofence", type=filters.Circle.parse, action="append", default=None, metavar="LAT,LON,KM", help="Only store aircraft last seen within KM km of LAT,LON, or inside another --geofence or --geofence-file. Can be given several times. An aircraft isn't stored until its position has been seen.")
+  parser.add_argument("--geofence-file", type=str, action="append", default=None, metavar="PATH", help="Only store aircraft last seen inside the polygons of this GeoJSON file, or inside another --geofence or --geofence-file. Can be given several times.")
+  parser.add_argument("--altitude-band", type=filters.parse_band, action="append", default=None, metavar="MIN:MAX", help="Only store aircraft last seen between MIN and MAX feet, or in another --altitude-band; either can be left out. Can be given several times. An aircraft isn't stored until its altitude has been seen.")
+  parser.add_argument("--live-port", type=int, default=None, help="Keep the current state of every aircraft in memory and serve it at http://<host>:<port>/data/aircraft.json (in the format of dump1090's own) and as server-sent events at /stream, so maps and alerting don't have to query the database.")
+  parser.add_argument("--relay-port", type=int, default=None, help="Re-serve the basestation lines we receive on this port, so other tools can connect here instead of to dump1090.")
+  parser.add_argument("--relay-filtered", default=False, action='store_true', help="With --relay-port, only relay the lines that are stored: well-formed, of a logged transmission type, and not throttled.")
+  parser.add_argument("--relay-buffer-size", type=int, default=RELAY_BUFFER_SIZE, help="The most bytes to hold for a --relay-port client that isn't keeping up; lines beyond that are dropped for that client. Defaults to %s" % (RELAY_BUFFER_SIZE,))
+  parser.add_argument("--connect-attempt-delay", type=float, default=CONNECT_ATTEMPT_DELAY, help="The number of seconds to wait after a failed connection attempt before trying again. The wait doubles after each further failure, up to a minute, less a random amount so sources don't all retry at once. Defaults to %s" % (CONNECT_ATTEMPT_DELAY,))
+  parser.add_argument("--connect-timeout", type=float, default=CONNECT_TIMEOUT, help="The number of seconds to wait for dump1090, or the database, to accept a connection before trying again. Defaults to %s" % (CONNECT_TIMEOUT,))
+  parser.add_argument("--idle-timeout", type=float, default=IDLE_TIMEOUT, help="Reconnect to a source that hasn't sent anything for this many seconds, or 0 to never. Connections are also checked with tcp keepalive, which notices a peer that's gone away within a minute. Defaults to %s" % (IDLE_TIMEOUT,))
+  parser.add_argument("--db-retry-delay", type=float, default=DB_RETRY_DELAY, help="The number of seconds to wait before reconnecting to the database after it couldn't be reached, at startup or while logging. The wait doubles after each further failure, up to a minute. Defaults to %s" % (DB_RETRY_DELAY,))
+
+  # each backend's own options
+  for backend_class in backends.BACKENDS:
+    backend_class.add_arguments(parser)
 
   # parse command line options
   args = parser.parse_args()
+  if args.backend is None:
+    args.backend = backends.SQLite.name if args.database else default_backend
+  backend_class = backends.by_name(args.backend)
+  if not backend_class.available():
+    parser.error("--backend %s needs the %s package" % (args.backend, backend_class.package))
+  if backend_class is backends.SQLite and args.database is None:
+    parser.error("--backend sqlite needs a database file, given with -d")
+  if args.retention is not None and args.partition is None:
+    parser.error("--retention needs --partition")
+  if args.drop_unlisted_indexes and args.index_profile is None:
+    parser.error("--drop-unlisted-indexes needs --index-profile")
+  if args.partition is not None and args.aggregate is not None:
+    parser.error("--partition and --retention are for the squitters table, which isn't written with --aggregate")
+  if args.index_profile is not None and args.aggregate is not None:
+    parser.error("--index-profile is for the squitters table, which isn't written with --aggregate")
+  if args.archive_dir is not None and args.aggregate is not None:
+    parser.error("--archive-dir archives squitters, which aren't written with --aggregate")
+  if args.archive_dir is not None and archive.pyarrow is None:
+    parser.error("--archive-dir needs the pyarrow package")
+  if args.parse_workers < 0:
+    parser.error("--parse-workers can't be negative")
+  if args.vectorize and not args.compact:
+    parser.error("--vectorize parses to the compact encoding, so it needs --compact")
+  if args.vectorize and args.parse_workers:
+    parser.error("--vectorize and --parse-workers can't be used together")
+  if args.vectorize and columnar.numpy is None:
+    parser.error("--vectorize needs the numpy package")
+  if args.dedup == 'change' and args.vectorize:
+    parser.error("--dedup change can't be used with --vectorize")
+  if args.dedup == 'change' and args.aggregate is not None:
+    parser.error("--aggregate doesn't deduplicate, so --dedup change has no effect with it")
+  if args.relay_filtered and args.relay_port is None:
+    parser.error("--relay-filtered needs --relay-port")
+  if args.relay_filtered and (args.aggregate is not None or args.parse_workers or args.vectorize):
+    parser.error("--relay-filtered can't be used with --aggregate, --parse-workers or --vectorize")
+  if args.compact and args.aggregate is not None:
+    parser.error("--compact is for the squitters table, which isn't written with --aggregate")
+  if args.compact and not backend_class.supports_compact:
+    parser.error("--compact isn't supported with --backend %s" % (args.backend,))
+  if args.partition is not None and not backend_class.supports_partitions:
+    parser.error("--partition isn't supported with --backend %s" % (args.backend,))
+
+  shapes = list(args.geofence or [])
+  for path in args.geofence_file or ():
+    try:
+      shapes += filters.load_polygons(path)
+    except (IOError, ValueError, KeyError) as e:
+      parser.error("--geofence-file %s: %s" % (path, e))
+  if args.allow_icao or args.deny_icao or shapes or args.altitude_band:
+    ingest = filters.IngestFilter(
+      allow=sum(args.allow_icao or [], []),
+      deny=sum(args.deny_icao or [], []),
+      geofence=filters.Geofence(shapes) if shapes else None,
+      bands=args.altitude_band,
+      compact=args.compact,
+    )
+  else:
+    ingest = None
 
-  # Are we receiving data from the flightaware mlat client?
-  is_mlat = (args.port == 31003)
-
-  # print args.accumulate(args.in)
-  count_since_commit = 0
-  count_total = 0
-
-  print "%s: Connecting to mysql..." % args.client_id
-  conn = mysql.connector.connect(
-    host=args.mysql_host,
-    port=args.mysql_port,
-    user=args.mysql_user,
-    password=args.mysql_pass,
-    database=args.mysql_database,
-    auth_plugin='mysql_native_password',
-  )
-  cur = conn.cursor()
+  if args.file:
+    sources = [stream.FileSource(path, args.client_id) for path in args.file]
+  elif args.source:
+    sources = args.source
+  else:
+    # a stream.Source works out if we're receiving data from the
+    # flightaware mlat client
+    sources = [stream.Source(args.location, args.port, args.client_id)]
+  label = ", ".join("%s: %s" % (source.client_id, source) for source in sources)
+
+  backend = backend_class.from_args(args)
+  print "%s: Connecting to %s..." % (args.client_id, backend)
+  # the database may still be starting up, e.g. after a power cut
+  retry.forever(backend.open, backend.errors, retry.Backoff(args.db_retry_delay), "connect to %s" % (backend,))
   print "%s: Connected." % args.client_id
 
   # set up the table if neccassary
-  if args.no_compress:
-      compress = False
+  backend.ensure_schema(args.aggregate is not None, args.compact, args.index_profile, args.partition, args.partitions_ahead)
+  table = backend.table
+
+  if args.index_profile:
+    listed = backend.profile_indexes(args.index_profile)
+    unlisted = indexes.unlisted(backend.secondary_indexes(), listed)
+    if unlisted and args.drop_unlisted_indexes:
+      backend.drop_indexes([name for (name, _) in unlisted])
+      print "Dropped indexes %s of %s, which aren't in the %s profile" % (", ".join(name for (name, _) in unlisted), table, args.index_profile)
+    elif unlisted:
+      # they're still maintained for every row, which is what a lean
+      # profile is meant to save
+      print "WARNING: %s has indexes that aren't in the %s profile, which still slow down every write: %s" % (table, args.index_profile, ", ".join(name for (name, _) in unlisted))
+      print "WARNING: run with --drop-unlisted-indexes to drop them"
+    if not args.bulk_load:
+      added = backend.restore_indexes(listed)
+      if added:
+        print "Added indexes %s to %s" % (", ".join(added), table)
+
+  if args.partition:
+    # on its own thread and connection, so the writer isn't involved
+    maintainer = partitions.Maintainer(functools.partial(
+      backend.maintain_partitions, args.partition, args.partitions_ahead, args.retention,
+    ))
+    maintainer.start()
+
+  # the icao address and squawk are parsed to integers by sbs1.parse_line,
+  # so rows go straight into their native columns. with --compact, so is
+  # everything else.
+  if args.compact:
+    parse_line = sbs1.parse_line_compact
   else:
-      compress = True
-  table_setup(cur, compress)
+    parse_line = sbs1.parse_line
+  only_log_types = backend.only_log_types
+  batch_delay = args.batch_delay / 1000.0
+  write = backend.write
+  # how long each batch takes to commit, for --metrics-port
+  commit_seconds = metrics.Histogram()
+  write = metrics.timed(write, commit_seconds)
+  if args.spool_dir:
+    # database errors spool rows to disk instead of stopping us
+    spooler = spool.SpoolingWriter(
+      write,
+      spool.Spool(args.spool_dir, max_size=args.spool_max_size * 1024 * 1024),
+      backend.errors,
+      reconnect=backend.reconnect,
+      retry_delay=args.spool_retry_delay,
+    )
+    write = spooler
+    retrier = None
+  else:
+    spooler = None
+    # a lost connection is reopened and the batch written again
+    retrier = retry.RetryingWriter(write, backend.errors, backend.reconnect, retry.Backoff(args.db_retry_delay))
+    write = retrier
+  rows = batching.RowBuffer(write, args.batch_size, batch_delay)
+
+  if args.aggregate is not None:
+    aggregator = tracks.Aggregator(args.aggregate)
+    what = "track points"
+  else:
+    aggregator = None
+    what = "squitters"
 
   # log {(icao, msgtype): timestamp} pairs to eliminate some duplicate
   # entries. based on a timestamp here, we throttle based on
-  # the value of TRANSMISSION_TYPE_TTL[msgtype]
-  aircraft_msg_ttls = {}
+  # the value of TRANSMISSION_TYPE_TTL[msgtype], or with --dedup change,
+  # on what's changed since. each source gets its own, as if it were
+  # being logged by a separate process.
+  if args.dedup == 'change':
+    new_throttle = functools.partial(
+      throttle.ChangeThrottle, TRANSMISSION_TYPE_ALIAS, args.heartbeat,
+      args.position_delta, args.altitude_delta, args.track_delta, args.speed_delta, args.vertical_rate_delta,
+      compact=args.compact, max_entries=args.throttle_max_entries,
+    )
+  else:
+    new_throttle = functools.partial(
+      throttle.ArrayThrottle if args.vectorize else throttle.Throttle,
+      TRANSMISSION_TYPE_TTL, TRANSMISSION_TYPE_ALIAS, args.throttle_max_entries,
+    )
+  if args.live_port:
+    live_state = live.LiveState(args.compact)
+  else:
+    live_state = None
+
+  if args.parse_workers:
+    # each worker keeps the throttles of the aircraft it's given
+    workers = sharding.ShardedParser(
+      sources, args.parse_workers, parse_line, only_log_types,
+      TRANSMISSION_TYPE_TTL, TRANSMISSION_TYPE_ALIAS, args.throttle_max_entries,
+      record_time=bool(args.file), throttled=aggregator is None, ingest=ingest, new_throttle=new_throttle, live_state=live_state,
+    )
+    throttles = workers.throttles
+    # the workers have copies of the filters, and count what they drop
+    filtered = workers.filters
+    print "Parsing on %s worker processes" % (args.parse_workers,)
+  else:
+    workers = None
+    filtered = ingest
+    throttles = dict((source, new_throttle()) for source in sources)
 
   start_time = datetime.datetime.utcnow()
 
-  # open a socket connection
-  print "%s: Connecting to dump1090..." % args.client_id
-  s = connect_to_socket(args.location, args.port)
+  # rows are handed to the database on a separate thread, so a slow
+  # commit doesn't hold up reading from dump1090.
+  if args.queue_policy == 'spill':
+    spill = pipeline.SpillFile(args.spill_file, max_size=args.spill_max_size * 1024 * 1024)
+  else:
+    spill = None
+  queue = pipeline.RowQueue(args.queue_size, args.queue_policy, spill)
+  writer = pipeline.Writer(queue, rows, functools.partial(print_stats, label, start_time, rows, queue, spooler, throttles.values(), aggregator, filtered), spooler)
+
+  if args.relay_port:
+    relayer = relay.Relay(args.relay_port, max_buffer=args.relay_buffer_size)
+    print "Relaying %s at localhost:%s" % ("stored lines" if args.relay_filtered else "everything received", args.relay_port)
+  else:
+    relayer = None
+  relay_filtered = relayer is not None and args.relay_filtered
 
-  # listen to socket for data
-  data_str = ""
+  if args.metrics_port:
+    metrics.serve(
+      metrics.logger_metrics(sources, throttles, rows, queue, commit_seconds, spooler, aggregator, retrier, relayer, filtered),
+      args.metrics_port,
+    )
+    print "Serving metrics at http://localhost:%s/metrics" % (args.metrics_port,)
+
+  if args.archive_dir:
+    # the archive has a queue and thread of its own, so it and the
+    # database don't hold each other up
+    archiver = archive.Archive(args.archive_dir, args.compact, args.archive_compression, flush_interval=args.archive_flush_interval)
+    archive_queue = pipeline.RowQueue(args.queue_size)
+    archive_writer = pipeline.Writer(archive_queue, batching.RowBuffer(archiver.write, archive.BATCH_SIZE, batch_delay), on_poll=archiver.poll)
+    archive_writer.start()
+  else:
+    archive_queue = None
+    archive_writer = None
+
+  if live_state is not None:
+    live_server = live.serve(live_state, args.live_port)
+    print "Serving live aircraft at http://localhost:%s/data/aircraft.json" % (args.live_port,)
+
+  def store(lines, read_time):
+    # the rows of a read parsed by the workers, which have already
+    # throttled them (and updated live_state)
+    if aggregator is not None:
+      for line in lines:
+        (parsed_time, is_mlat, client_id) = line[-3:]
+        aggregator.update(line, parsed_time, is_mlat, client_id)
+      # reads can come back a while after they were read, so they're
+      # polled for track points as they do, at the time they were read
+      if read_time is not None:
+        for point in aggregator.poll(read_time):
+          queue.put(point)
+      return
+    queue.put_many(lines)
+    if archive_queue is not None:
+      to_archive(lines)
+
+  def to_archive(lines):
+    # the archive is optional: if its writer has given up, the lines are
+    # left out of it and the database carries on (see below)
+    try:
+      archive_queue.put_many(lines)
+    except pipeline.QueueClosed:
+      pass
+
+  def close_inputs():
+    feeds.close()
+    if live_state is not None:
+      live.close(live_server)
+    if relayer is not None:
+      relayer.close()
+
+  def close_outputs():
+    # write out everything that's been queued
+    if retrier is not None:
+      # give up on the database if it's down
+      retrier.stop()
+    try:
+      writer.stop()
+      if archive_writer is not None:
+        archive_writer.stop()
+        # what it has buffered is still written, if it can be
+        try:
+          archiver.close()
+        except Exception:
+          traceback.print_exc()
+        if archive_writer.error is not None:
+          print ts, "The archive stopped early, after an error"
+        print ts, "%s squitters archived to %s files in %s" % (archiver.rows, archiver.files, args.archive_dir)
+    finally:
+      if args.bulk_load:
+        rebuild_indexes()
+    if writer.error is None:
+      if args.partition:
+        # rows from before today's partition, as with --file, aren't
+        # reported by the maintainer until its next run, if there is one
+        try:
+          backend.check_partitions()
+        except Exception:
+          traceback.print_exc()
+      backend.close()
+    if spill is not None:
+      spill.close()
+    if spooler is not None:
+      spooler.spool.close()
+    print ts, "%s %s added to your database" % (rows.rows_written, what)
+    if spooler is not None and len(spooler.spool):
+      print ts, "%s rows spooled and %s replayed; %s segments in %s are left for when the database is back" % (spooler.spool.spooled, spooler.replayed, len(spooler.spool), args.spool_dir)
+
+  def rebuild_indexes():
+    # the writer has stopped, so the connection is ours again; if the
+    # writer failed, it's opened afresh first
+    print ts, "Rebuilding the indexes of %s..." % (table,)
+    try:
+      if writer.error is not None:
+        backend.reconnect()
+      backend.restore_indexes(deferred_indexes)
+    except Exception:
+      traceback.print_exc()
+      print "The indexes of %s weren't rebuilt after --bulk-load; run with --index-profile to add them" % (table,)
+
+  # all sources are read on this thread; each one connects, and
+  # reconnects, in the background.
+  if args.file:
+    feeds = stream.FileReader(sources, args.buffer_size, args.realtime, sbs1.line_timestamp)
+  else:
+    print "Connecting to dump1090 at %s..." % (label,)
+    feeds = stream.MultiReader(sources, args.buffer_size, args.connect_attempt_delay, args.connect_timeout, args.idle_timeout)
+
+  if args.bulk_load:
+    # building each index once at the end is much cheaper than
+    # maintaining all of them for every row. this is left until nothing
+    # else can fail before we start, as every way out of the loop below
+    # rebuilds them.
+    deferred_indexes = backend.drop_indexes()
+    print "Dropped the indexes of %s until we're done: %s" % (table, ", ".join(name for (name, _) in deferred_indexes))
+    if args.index_profile:
+      deferred_indexes += listed
+  writer.start()
+  ts = start_time.strftime("%H:%M:%S")
   try:
     #loop until an exception
     while True:
+      # receive as many complete lines as a single read gives us, from
+      # every source that has something for us
+      received = feeds.read(batch_delay)
+      if relayer is not None and not relay_filtered:
+        relayer.send([line for (_, data) in received for line in data])
+
       #get current time
       cur_time = datetime.datetime.utcnow()
       ts = cur_time.strftime("%H:%M:%S")
-
-      # receive a stream message
-      try:
-        message = ""
-        message = s.recv(args.buffer_size)
-        data_str += message.strip("\n")
-      except socket.error:
-        # this happens if there is no connection and is delt with below
-        pass
-
-      if len(message) == 0:
-        print ts, "No broadcast received. Attempting to reconnect"
-        time.sleep(args.connect_attempt_delay)
-        s.close()
-        s = connect_to_socket(args.location, args.port)
-        continue
-
-      # it is possible that more than one line has been received
-      # so split it then loop through the parts and validate
-
-      data = data_str.split("\n")
-
-      for d in data:
-        line = d.split(",")
-
-        #if the line has 22 items, it's valid
-        if len(line) == 22:
-
-          # clean up some values first
-          for (idx, val) in enumerate(line):
-            v = val.strip()
-            # 0 message type is 2-3 char
-            if idx == 0:
-              line[idx] = v.strip("0123456789").strip()
-            # 1 transmission type is int or null
-            if idx == 1:
-              if v == '':
-                line[idx] = None
-              else:
-                line[idx] = int(v)
-            # 2-10 string
-            elif idx in range(2,11):
-              if v == '':
-                line[idx] = None
-              elif idx in set([6,8]): # generated_date, logged_date
-                line[idx] = datetime.datetime.strptime(v, '%Y/%m/%d').date()
-              elif idx in set([7,9]): # generated_time, logged_time
-                line[idx] = datetime.datetime.strptime(v, '%H:%M:%S.%f').time()
-              else:
-                line[idx] = v
-            # 11-13 is int or null
-            elif idx in range(11,14):
-              if v == '':
-                line[idx] = None
-              else:
-                line[idx] = int(v)
-            # 14,15 is float-ish or null
-            elif idx in range(14,16):
-              if v == '':
-                line[idx] = None
-              else:
-                line[idx] = Decimal(v)
-            # 16 is int or null
-            elif idx == 16:
-              if v == '':
-                line[idx] = None
-              else:
-                line[idx] = int(v)
-            # 17 string
-            elif idx == 17:
-              if v == '':
-                line[idx] = None
-              else:
-                line[idx] = v
-            # 18-21 bool or null
-            elif idx in range(18,22):
-              if v == '0':
-                line[idx] = False
-              elif v == '':
-                line[idx] = None
-              else:
-                line[idx] = True
-
-          # transmission types; skip if it's a type that we
-          # don't care to log in the database.
-          if line[1] not in ONLY_LOG_TYPES:
-            continue
-
-          # Decide whether or not to skip recording datapoint based on
-          # a TTL (based on transmission_type).
-          msgtype_timeout_alias = TRANSMISSION_TYPE_ALIAS[line[1]]
-          msgtype_key = (line[4], msgtype_timeout_alias)
-          msgtype_ttl = TRANSMISSION_TYPE_TTL[msgtype_timeout_alias]
-          existing_timestamp = aircraft_msg_ttls.get(msgtype_key, datetime.datetime(1970,1,1))
-          #print msgtype_key, existing_timestamp
-          if (not is_mlat) and (cur_time - existing_timestamp) <= msgtype_ttl:
-            # too soon.
-            #print "\ttoo soon"
-            continue
-          #print "\tok"
-
-          # Reset TTL timer now that we're storing data for this packet
-          aircraft_msg_ttls[msgtype_key] = cur_time
-
-          # session_id, aircraft_id, flight_id are sometimes censored with '11111'?
-          if (line[2] == '111' and line[3] == '11111' and line[5] == '111111') \
-          or (line[2] == '1' and line[3] == '1' and line[5] == '1'):
-            line[2] = None
-            line[3] = None
-            line[5] = None
-
-          # "parsed_time"
-          line.append(cur_time)
-
-          # "generated_datetime"
-          if (line[6] and line[7]):
-            generated_datetime = datetime.datetime.combine(line[6], line[7])
-          else:
-            generated_datetime = None
-          line.append(generated_datetime)
-
-          # "logged_datetime"
-          if (line[8] and line[9]):
-            logged_datetime = datetime.datetime.combine(line[8], line[9])
-          else:
-            logged_datetime = None
-          line.append(logged_datetime)
-
-          # store whether we got this from the piaware mlat output basestation
-          # (otherwise, we got it directly from dump1090)
-          line.append(is_mlat)
-
-          line.append(args.client_id)
-
-          # remove the generated & logged date/time fields. we'll just
-          # store the combined value that we just calculated
-          line.pop(6)
-          line.pop(6)
-          line.pop(6)
-          line.pop(6)
-
-          # move squawk from line[13] to line[0]
-          line = [line.pop(13)] + line
-          # move icao address from line[5] (originally 4) to line[0]
-          line = [line.pop(5)] + line
-
-          try:
-            # add row to database
-            qry = """INSERT INTO squitters (
-                icao_addr,
-                decimal_squawk,
-                message_type,
-                transmission_type,
-                session_id,
-                aircraft_id,
-                flight_id,
-                callsign,
-                altitude,
-                ground_speed,
-                track,
-                lat,
-                lon,
-                vertical_rate,
-                alert,
-                emergency,
-                spi,
-                is_on_ground,
-                parsed_time,
-                generated_datetime,
-                logged_datetime,
-                is_mlat,
-                client_id
-              )
-              VALUES (
-                CONV(%s, 16, 10),
-                CONV(%s, 8, 10),
-                """ + ", ".join(["%s"] * (len(line)-2)) + ")"
-            cur.executemany(qry, [line])
-
-            # increment counts
-            count_total += 1
-            count_since_commit += 1
-
-            # commit the new rows to the database in batches
-            if count_since_commit % args.batch_size == 0:
-              conn.commit()
-              print "%s: %s:%s - avg %.1f rows/sec" % (args.client_id, args.location, args.port, float(count_total) / (cur_time - start_time).total_seconds(),)
-              if count_since_commit > args.batch_size:
-                print ts, "All caught up, %s rows, successfully written to database" % (count_since_commit)
-              count_since_commit = 0
-
-          except mysql.connector.Error:
-            print
-            print ts, "Could not write to database"
-            print line
-            traceback.print_exc()
-            raise
-            sys.exit(1)
-
-
-          # since everything was valid we reset the stream message
-          data_str = ""
-        else:
-          # the stream message is too short, prepend to the next stream message
-          data_str = d
+      if args.compact:
+        cur_time = sbs1.epoch_ms(cur_time)
+
+      if queue.closed:
+        # the writer gave up
+        raise pipeline.QueueClosed()
+      if archive_queue is not None and archive_queue.closed:
+        # so did the archive's, but the database is what matters
+        print ts, "Could not write to the archive in %s, carrying on without it" % (args.archive_dir,)
+        archive_queue = None
+
+      if workers is not None:
+        for (source, data) in received:
+          source.lines += len(data)
+        workers.put(received, cur_time)
+        for (lines, read_time) in workers.reads():
+          store(lines, read_time)
+        if args.file or len(workers):
+          # store() has polled for track points after each read, as the
+          # loop below would have. a capture is only polled at its own
+          # time, and a live feed at the current time only when it's
+          # gone quiet, once the workers are done with what it sent.
           continue
-
-  except KeyboardInterrupt:
+      elif args.vectorize:
+        for (source, data) in received:
+          source.lines += len(data)
+          (squitters, errors) = columnar.squitters(
+            data, only_log_types, throttles[source], cur_time,
+            source.is_mlat, source.client_id, record_time=bool(args.file), ingest=ingest, live_state=live_state,
+          )
+          source.parse_errors += errors
+          queue.put_many(squitters)
+          if archive_queue is not None:
+            to_archive(squitters)
+      else:
+        relayed = []
+        for (source, data) in received:
+          ttls = throttles[source]
+          source.lines += len(data)
+          for d in data:
+            record = parse_line(d)
+
+            if record is None:
+              # not a well-formed basestation message
+              source.parse_errors += 1
+              continue
+
+            # transmission types; skip if it's a type that we
+            # don't care to log in the database.
+            if record[sbs1.TRANSMISSION_TYPE] not in only_log_types:
+              continue
+
+            if args.file:
+              # rows from a capture are stamped (and throttled) with the
+              # time they were logged, not the time we read them
+              cur_time = record[sbs1.LOGGED_DATETIME] or record[sbs1.GENERATED_DATETIME] or cur_time
+
+            if live_state is not None:
+              # every message, throttled or not, so the state is current
+              live_state.update(record, cur_time, source.is_mlat, source.client_id)
+
+            if ingest is not None and not ingest.allow(record):
+              # outside the icao lists, geofences or altitude bands
+              continue
+
+            if aggregator is not None:
+              # every message goes into the aircraft's state; track
+              # points are taken from that below.
+              aggregator.update(record, cur_time, source.is_mlat, source.client_id)
+              continue
+
+            # Decide whether or not to skip recording datapoint based on
+            # a TTL (based on transmission_type). this also resets the TTL
+            # timer if we're storing data for this packet.
+            if (not source.is_mlat) and not ttls.allow(record[sbs1.ICAO_ADDR], record[sbs1.TRANSMISSION_TYPE], sbs1.timestamp(cur_time) if args.file else None, record):
+              # too soon.
+              continue
+
+            # store whether we got this from the piaware mlat output basestation
+            # (otherwise, we got it directly from dump1090)
+            line = sbs1.make_row(record, cur_time, source.is_mlat, source.client_id)
+
+            queue.put(line)
+            if archive_queue is not None:
+              to_archive([line])
+            if relay_filtered:
+              relayed.append(d)
+
+        if relay_filtered:
+          relayer.send(relayed)
+
+      if aggregator is not None:
+        for point in aggregator.poll(cur_time):
+          queue.put(point)
+
+  except (KeyboardInterrupt, stream.EndOfStream):
     print "\n%s Closing connection" % (ts,)
-    s.close()
-    conn.commit()
-    conn.close()
-    print ts, "%s squitters added to your database" % (count_total,)
+    close_inputs()
+    if workers is not None:
+      # the lines we've read are still parsed and written
+      for (lines, read_time) in workers.reads(wait=True):
+        store(lines, read_time)
+      workers.close()
+    if aggregator is not None:
+      for point in aggregator.poll(datetime.datetime.utcnow(), force=True):
+        queue.put(point)
+    close_outputs()
     sys.exit(0)
 
+  except pipeline.QueueClosed:
+    print ts, "Could not write to database, exiting"
+    close_inputs()
+    if workers is not None:
+      workers.close()
+    # the archive, spill file and spool are still finished, and if the
+    # database writer hasn't given up, what's queued is written
+    close_outputs()
+    sys.exit(1)
 
-  except mysql.connector.Error as err:
-    print "Error with ", line
+  except Exception:
+    # anything else stops us reading, but what's been queued is still
+    # written before we go
     traceback.print_exc()
-    raise
+    print ts, "Stopping after an unexpected error"
+    close_inputs()
+    if workers is not None:
+      workers.close()
+    close_outputs()
     sys.exit(1)
 
-def connect_to_socket(loc,port):
-  s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-  s.connect((loc, port))
-  return s
-
-
-def table_setup(dbcursor, compress=True):
-  # data format info:
-  #    http://woodair.net/SBS/Article/Barebones42_Socket_Data.htm
-  #    https://github.com/wiseman/node-sbs1
-  #dbcursor.execute("DROP TABLE IF EXISTS squitters")
-  if compress:
-      compress_arg = "ROW_FORMAT=COMPRESSED KEY_BLOCK_SIZE=4"
-  else:
-      compress_arg = ""
-  dbcursor.execute("""CREATE TABLE IF NOT EXISTS
-    squitters(
-      message_type      VARCHAR(3) NOT NULL,
-      transmission_type TINYINT(1) UNSIGNED NOT NULL,
-      session_id        TEXT,
-      aircraft_id       TEXT,
-      icao_addr         MEDIUMINT UNSIGNED NOT NULL,
-      flight_id         TEXT,
-      callsign          TEXT,
-      altitude          MEDIUMINT,
-      ground_speed      SMALLINT,
-      track             INT,
-      lat               DECIMAL(8,5),
-      lon               DECIMAL(8,5),
-      vertical_rate     INT,
-      decimal_squawk    SMALLINT UNSIGNED,
-      alert             BOOLEAN,
-      emergency         BOOLEAN,
-      spi               BOOLEAN,
-      is_on_ground      BOOLEAN,
-      parsed_time       DATETIME NOT NULL,
-      generated_datetime DATETIME,
-      logged_datetime   DATETIME,
-      is_mlat           BOOLEAN,
-      client_id         TINYINT UNSIGNED NOT NULL DEFAULT 0,
-      INDEX idx_parsed_time(parsed_time),
-      INDEX idx_message_type(message_type),
-      INDEX idx_transmission_type(transmission_type),
-      INDEX idx_icao_addr(icao_addr),
-      INDEX idx_is_mlat(is_mlat),
-      INDEX idx_client_id(client_id)
-    )
-    ENGINE=InnoDB
-    {compress_arg}
-    CHARACTER SET utf8
-    COLLATE utf8_general_ci
-  """.format(compress_arg=compress_arg))
-  #dbcursor.execute("""CREATE TABLE IF NOT EXISTS
-  #  callsigns(
-  #    icao_addr         MEDIUMINT UNSIGNED NOT NULL,
-  #    callsign          TEXT,
-  #    parsed_time       DATETIME NOT NULL,
-  #    INDEX idx_parsed_time(parsed_time),
-  #    INDEX idx_icao_addr(icao_addr),
-  #    PRIMARY KEY (icao_addr, parsed_time)
-  #  )
-  #  ENGINE=InnoDB
-  #  ROW_FORMAT=COMPRESSED KEY_BLOCK_SIZE=4
-  #  CHARACTER SET utf8
-  #  COLLATE utf8_general_ci
-  #""")
-
-
-
+def print_stats(label, start_time, rows, queue, spooler, throttles, aggregator, ingest, written):
+  elapsed = (datetime.datetime.utcnow() - start_time).total_seconds()
+  print "%s - avg %.1f rows/sec, %s queued (max %s), %s dropped, %s spilled, %s throttled" % (label, float(rows.rows_written) / elapsed, len(queue), queue.high_water, queue.dropped, queue.spilled, sum(t.suppressed for t in throttles))
+  if queue.spill is not None and queue.spill.pending:
+    print "%s - %s spilled rows (%.1f MB) waiting to be written" % (label, queue.spill.pending, queue.spill.size / (1024.0 * 1024.0))
+  if spooler is not None and (spooler.outage or len(spooler.spool)):
+    print "%s - %s rows spooled, %s replayed, %s segments (%.1f MB) pending" % (label, spooler.spool.spooled, spooler.replayed, len(spooler.spool), spooler.spool.size / (1024.0 * 1024.0))
+  if ingest is not None:
+    print "%s - %s rows filtered out (%s)" % (label, ingest.filtered, ", ".join("%s: %s" % item for item in ingest.dropped.items()))
+  if aggregator is not None:
+    print "%s - %s aircraft tracked, %s squitters merged into %s track points" % (label, len(aggregator), aggregator.merged, aggregator.points)
 
 
 if __name__ == '__main__':
@@ -19,5 +19,5 @@ cd /home/pi/dump1090-stream-parser
 while true
   do
     sleep 20
-    python dump1090-stream-parser.py -p 30003 --batch-size 20 --mysql-host 192.168.1.101 -c 0
+    python dump1090-stream-parser.py -p 30003 --batch-size 20 --mysql-host 192.168.1.101 -c 0 --spool-dir /home/pi/dump1090-spool
   done
@@ -0,0 +1,297 @@
+# encoding: utf-8
+"""
+filters for the rows worth storing, applied as lines are read: icao
+address allow and deny lists, altitude bands, and geofences made of
+circles and polygons.
+
+most messages carry no position (or altitude), so each aircraft's
+latest verdict is kept and applied to its other messages. an aircraft
+isn't stored until its position (or altitude) has been seen.
+
+geofences are looked up in a grid of `grid_size` degree cells. each
+cell is worked out once, the first time a position falls in it, to be
+wholly inside a fence, wholly outside all of them, or on the edge of
+some; only positions in edge cells are tested against those fences.
+"""
+
+import collections
+import json
+import math
+
+import sbs1
+
+# degrees
+GRID_SIZE = 0.1
+# aircraft whose verdicts are kept; past this they're all forgotten, and
+# worked out again from their next positions
+MAX_AIRCRAFT = 100000
+# km
+EARTH_RADIUS = 6371.0
+
+FILTERS = ('icao', 'geofence', 'altitude')
+
+(INSIDE, OUTSIDE, EDGE) = range(3)
+
+
+def distance(lat1, lon1, lat2, lon2):
+  """
+  great circle distance in km
+  """
+  (lat1, lon1, lat2, lon2) = (math.radians(lat1), math.radians(lon1), math.radians(lat2), math.radians(lon2))
+  a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+  return 2 * EARTH_RADIUS * math.asin(min(1.0, math.sqrt(a)))
+
+
+def _corners(south, west, north, east):
+  return ((south, west), (south, east), (north, west), (north, east))
+
+
+class Circle(object):
+  """
+  the positions within `radius` km of (`lat`, `lon`)
+  """
+
+  def __init__(self, lat, lon, radius):
+    self.lat = lat
+    self.lon = lon
+    self.radius = radius
+
+  @classmethod
+  def parse(cls, spec):
+    """
+    parse a `lat,lon,km` spec
+    """
+    parts = spec.split(',')
+    if len(parts) != 3:
+      raise ValueError("expected lat,lon,km, got %r" % (spec,))
+    return cls(*[float(p) for p in parts])
+
+  def contains(self, lat, lon):
+    return distance(self.lat, self.lon, lat, lon) <= self.radius
+
+  def classify(self, south, west, north, east):
+    lat = (south + north) / 2.0
+    lon = (west + east) / 2.0
+    # every point of the cell is within `reach` of its center, so the
+    # triangle inequality bounds their distances from ours
+    reach = max(distance(lat, lon, y, x) for (y, x) in _corners(south, west, north, east)) * 1.01
+    d = distance(self.lat, self.lon, lat, lon)
+    if d + reach <= self.radius:
+      return INSIDE
+    if d - reach > self.radius:
+      return OUTSIDE
+    return EDGE
+
+
+def _crosses(y1, x1, y2, x2, south, west, north, east):
+  # whether the segment (y1, x1)-(y2, x2) touches the rectangle
+  # (liang-barsky clipping)
+  (t0, t1) = (0.0, 1.0)
+  (dx, dy) = (x2 - x1, y2 - y1)
+  for (p, q) in ((-dx, x1 - west), (dx, east - x1), (-dy, y1 - south), (dy, north - y1)):
+    if p == 0:
+      if q < 0:
+        return False
+      continue
+    t = q / float(p)
+    if p < 0:
+      t0 = max(t0, t)
+    else:
+      t1 = min(t1, t)
+    if t0 > t1:
+      return False
+  return True
+
+
+class Polygon(object):
+  """
+  the positions inside `rings` of (lat, lon) points, by the even-odd
+  rule, so inner rings are holes. edges are straight in lat/lon, which
+  is close enough for regional fences away from the poles and the
+  antimeridian.
+  """
+
+  def __init__(self, rings):
+    self.rings = [[(float(lat), float(lon)) for (lat, lon) in ring] for ring in rings]
+    self._edges = [
+      (ring[i - 1], ring[i])
+      for ring in self.rings
+      for i in range(len(ring))
+    ]
+
+  def contains(self, lat, lon):
+    inside = False
+    for ((y1, x1), (y2, x2)) in self._edges:
+      if (y1 > lat) != (y2 > lat) and lon < x1 + (lat - y1) * (x2 - x1) / (y2 - y1):
+        inside = not inside
+    return inside
+
+  def classify(self, south, west, north, east):
+    for ((y1, x1), (y2, x2)) in self._edges:
+      if _crosses(y1, x1, y2, x2, south, west, north, east):
+        return EDGE
+    # no edge goes through the cell, so it's all on one side
+    if self.contains((south + north) / 2.0, (west + east) / 2.0):
+      return INSIDE
+    return OUTSIDE
+
+
+def load_polygons(path):
+  """
+  the Polygons of a GeoJSON file: a Polygon or MultiPolygon geometry,
+  or Features or a FeatureCollection of them
+  """
+  with open(path) as f:
+    data = json.load(f)
+  polygons = []
+
+  def add(obj):
+    kind = obj.get('type')
+    if kind == 'FeatureCollection':
+      for feature in obj['features']:
+        add(feature)
+    elif kind == 'Feature':
+      if obj.get('geometry'):
+        add(obj['geometry'])
+    elif kind == 'GeometryCollection':
+      for geometry in obj['geometries']:
+        add(geometry)
+    elif kind == 'Polygon':
+      polygons.append(Polygon([[(p[1], p[0]) for p in ring] for ring in obj['coordinates']]))
+    elif kind == 'MultiPolygon':
+      for rings in obj['coordinates']:
+        polygons.append(Polygon([[(p[1], p[0]) for p in ring] for ring in rings]))
+    else:
+      raise ValueError("%s: can't use a %s as a geofence" % (path, kind))
+
+  add(data)
+  return polygons
+
+
+class Geofence(object):
+  """
+  the positions inside any of `shapes` (Circles and Polygons)
+  """
+
+  def __init__(self, shapes, grid_size=GRID_SIZE):
+    self.shapes = list(shapes)
+    self.grid_size = grid_size
+    # {(row, column): True, False, or the shapes whose edges cross it}
+    self._cells = {}
+
+  def _classify(self, key):
+    south = key[0] * self.grid_size
+    west = key[1] * self.grid_size
+    (north, east) = (south + self.grid_size, west + self.grid_size)
+    edges = []
+    for shape in self.shapes:
+      where = shape.classify(south, west, north, east)
+      if where == INSIDE:
+        return True
+      if where == EDGE:
+        edges.append(shape)
+    return edges or False
+
+  def contains(self, lat, lon):
+    key = (int(math.floor(lat / self.grid_size)), int(math.floor(lon / self.grid_size)))
+    cell = self._cells.get(key)
+    if cell is None:
+      cell = self._cells[key] = self._classify(key)
+    if cell is True or cell is False:
+      return cell
+    for shape in cell:
+      if shape.contains(lat, lon):
+        return True
+    return False
+
+
+def parse_band(spec):
+  """
+  parse a `min:max` altitude band, in feet; either can be left out
+  """
+  parts = spec.split(':')
+  if len(parts) != 2:
+    raise ValueError("expected min:max, got %r" % (spec,))
+  return tuple(int(p) if p.strip() else None for p in parts)
+
+
+def parse_icaos(spec):
+  """
+  parse a comma-separated list of hex icao addresses
+  """
+  return [int(icao, 16) for icao in spec.split(',') if icao.strip()]
+
+
+def _remember(verdicts, icao_addr, verdict):
+  if len(verdicts) >= MAX_AIRCRAFT and icao_addr not in verdicts:
+    verdicts.clear()
+  verdicts[icao_addr] = verdict
+
+
+class IngestFilter(object):
+  """
+  decides which records (see sbs1.parse_line, or sbs1.parse_line_compact
+  with `compact`), or rows made from them, to store:
+
+  - with `allow`, only those icao addresses, and never those in `deny`
+  - with a `geofence`, only aircraft whose last position was inside it
+  - with altitude `bands` of (min, max) feet, only aircraft whose last
+    altitude was in one of them
+
+  `dropped` counts the records each filter turned away.
+  """
+
+  def __init__(self, allow=None, deny=None, geofence=None, bands=None, compact=False):
+    self.allow_icaos = frozenset(allow) if allow else None
+    self.deny_icaos = frozenset(deny or ())
+    self.geofence = geofence
+    self.bands = [(low if low is not None else -float('inf'), high if high is not None else float('inf')) for (low, high) in bands or ()]
+    self.scale = float(sbs1.LATLON_SCALE) if compact else None
+    self.dropped = collections.OrderedDict((name, 0) for name in FILTERS)
+    # {icao_addr: whether it's inside the geofence / in a band}
+    self._inside = {}
+    self._in_band = {}
+
+  @property
+  def filtered(self):
+    return sum(self.dropped.values())
+
+  def allow(self, record):
+    return self.allow_fields(record[sbs1.ICAO_ADDR], record[sbs1.LAT], record[sbs1.LON], record[sbs1.ALTITUDE])
+
+  def allow_fields(self, icao_addr, lat, lon, altitude):
+    """
+    allow() for a record's fields, where those it didn't have are None
+    """
+    if (self.allow_icaos is not None and icao_addr not in self.allow_icaos) or icao_addr in self.deny_icaos:
+      self.dropped['icao'] += 1
+      return False
+
+    if self.geofence is not None:
+      if lat is not None and lon is not None:
+        if self.scale is not None:
+          inside = self.geofence.contains(lat / self.scale, lon / self.scale)
+        else:
+          inside = self.geofence.contains(float(lat), float(lon))
+        _remember(self._inside, icao_addr, inside)
+      else:
+        inside = self._inside.get(icao_addr, False)
+      if not inside:
+        self.dropped['geofence'] += 1
+        return False
+
+    if self.bands:
+      if altitude is not None:
+        in_band = False
+        for (low, high) in self.bands:
+          if low <= altitude <= high:
+            in_band = True
+            break
+        _remember(self._in_band, icao_addr, in_band)
+      else:
+        in_band = self._in_band.get(icao_addr, False)
+      if not in_band:
+        self.dropped['altitude'] += 1
+        return False
+
+    return True
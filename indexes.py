@@ -0,0 +1,237 @@
+# encoding: utf-8
+"""
+secondary index profiles for the squitters table, and dropping/rebuilding
+a table's secondary indexes around a bulk load. sqlite uses the same
+profiles as mysql.
+
+`full` is the original set of single-column indexes. `lean` is meant for
+write-heavy loggers: most queries are "this aircraft over this time" or
+"everything in this time range", which a composite (icao_addr,
+parsed_time) index and a parsed_time index answer without maintaining an
+index per low-cardinality column. on postgresql the parsed_time index is
+BRIN, which is tiny because rows arrive in time order.
+
+switching an existing table to a profile only adds the indexes it's
+missing; unlisted() finds the ones left over from another profile, so
+they can be dropped.
+"""
+
+import collections
+
+PROFILES = ('full', 'lean')
+PROFILE = 'full'
+
+# (name, columns)
+MYSQL_INDEXES = {
+  'full': (
+    ("idx_parsed_time", "parsed_time"),
+    ("idx_message_type", "message_type"),
+    ("idx_transmission_type", "transmission_type"),
+    ("idx_icao_addr", "icao_addr"),
+    ("idx_is_mlat", "is_mlat"),
+    ("idx_client_id", "client_id"),
+  ),
+  'lean': (
+    ("idx_parsed_time", "parsed_time"),
+    ("idx_icao_addr_parsed_time", "icao_addr, parsed_time"),
+  ),
+}
+
+# (name, method and columns), as in psql/create.sql
+PSQL_INDEXES = {
+  'full': (
+    ("idx_parsed_time", "(parsed_time)"),
+    ("idx_message_type", "(message_type)"),
+    ("idx_aircraft_id", "(aircraft_id)"),
+    ("idx_flight_id", "(flight_id)"),
+    ("idx_callsign", "(callsign)"),
+    ("idx_transmission_type", "(transmission_type)"),
+    ("idx_icao_addr", "(icao_addr)"),
+    ("idx_is_mlat", "(is_mlat)"),
+    ("idx_client_id", "(client_id)"),
+    ("idx_latlon", "(latlon)"),
+    ("idx_decimal_squawk", "(decimal_squawk)"),
+  ),
+  'lean': (
+    ("idx_icao_addr_parsed_time", "(icao_addr, parsed_time)"),
+    ("idx_parsed_time_brin", "USING BRIN (parsed_time)"),
+    ("idx_latlon_gist", "USING GIST (latlon)"),
+  ),
+}
+
+
+def _missing(indexes, existing):
+  # the indexes whose names aren't in `existing`, without duplicates
+  seen = set(name for (name, _) in existing)
+  missing = []
+  for (name, definition) in indexes:
+    if name not in seen:
+      seen.add(name)
+      missing.append((name, definition))
+  return missing
+
+
+def unlisted(existing, listed):
+  """
+  the (name, definition) indexes of `existing` that aren't in `listed`
+  (a profile's), leaving out unique ones, which are constraints rather
+  than a profile's to drop
+  """
+  names = set(name for (name, _) in listed)
+  return [
+    (name, definition) for (name, definition) in existing
+    if name not in names and "UNIQUE" not in definition.split("(", 1)[0].upper()
+  ]
+
+
+def _named(indexes, names):
+  if names is None:
+    return indexes
+  names = set(names)
+  return [(name, definition) for (name, definition) in indexes if name in names]
+
+
+# mysql
+
+def mysql_index_clauses(profile):
+  """
+  the INDEX lines of a CREATE TABLE
+  """
+  return ",\n".join("INDEX %s(%s)" % index for index in MYSQL_INDEXES[profile])
+
+
+def mysql_indexes(cur, table):
+  """
+  [(name, definition)] of the secondary indexes of `table`, where the
+  definition can be given to ALTER TABLE ... ADD
+  """
+  cur.execute(
+    "SELECT index_name, non_unique, column_name FROM information_schema.statistics "
+    "WHERE table_schema = DATABASE() AND table_name = %s AND index_name != 'PRIMARY' "
+    "ORDER BY index_name, seq_in_index",
+    (table,)
+  )
+  columns = collections.OrderedDict()
+  unique = {}
+  for (name, non_unique, column) in cur.fetchall():
+    columns.setdefault(name, []).append(column)
+    unique[name] = not int(non_unique)
+  return [
+    (name, "%sINDEX %s (%s)" % ("UNIQUE " if unique[name] else "", name, ", ".join(cols)))
+    for (name, cols) in columns.items()
+  ]
+
+
+def mysql_drop(cur, table, names=None):
+  """
+  drop every secondary index of `table` (or those in `names`) in one
+  ALTER TABLE, returning what mysql_restore() needs to put them back
+  """
+  indexes = _named(mysql_indexes(cur, table), names)
+  if indexes:
+    cur.execute("ALTER TABLE %s %s" % (table, ", ".join("DROP INDEX %s" % (name,) for (name, _) in indexes)))
+  return indexes
+
+
+def mysql_restore(cur, table, indexes):
+  """
+  add the (name, definition) indexes that `table` doesn't have yet, in
+  one ALTER TABLE so the table is only scanned once. returns the names
+  of the indexes added.
+  """
+  missing = _missing(indexes, mysql_indexes(cur, table))
+  if missing:
+    cur.execute("ALTER TABLE %s %s" % (table, ", ".join("ADD %s" % (definition,) for (_, definition) in missing)))
+  return [name for (name, _) in missing]
+
+
+def mysql_profile(profile):
+  return [(name, "INDEX %s (%s)" % (name, columns)) for (name, columns) in MYSQL_INDEXES[profile]]
+
+
+# postgresql
+
+def psql_indexes(cur, table):
+  """
+  [(name, CREATE INDEX statement)] of the secondary indexes of `table`
+  """
+  cur.execute(
+    "SELECT i.indexname, i.indexdef FROM pg_indexes i "
+    "JOIN pg_index x ON x.indexrelid = (quote_ident(i.schemaname) || '.' || quote_ident(i.indexname))::regclass "
+    "WHERE i.schemaname = current_schema() AND i.tablename = %s AND NOT x.indisprimary",
+    (table,)
+  )
+  # an index on a partitioned table is listed as ON ONLY the parent,
+  # which wouldn't build it on the partitions
+  return [(name, definition.replace(" ON ONLY ", " ON ")) for (name, definition) in cur.fetchall()]
+
+
+def psql_drop(cur, table, names=None):
+  """
+  drop every secondary index of `table` (or those in `names`), returning
+  what psql_restore() needs to put them back
+  """
+  indexes = _named(psql_indexes(cur, table), names)
+  for (name, _) in indexes:
+    cur.execute("DROP INDEX IF EXISTS %s" % (name,))
+  return indexes
+
+
+def psql_restore(cur, table, indexes):
+  """
+  create the (name, CREATE INDEX statement) indexes that `table` doesn't
+  have yet. returns the names of the indexes created.
+  """
+  missing = _missing(indexes, psql_indexes(cur, table))
+  for (_, definition) in missing:
+    cur.execute(definition)
+  return [name for (name, _) in missing]
+
+
+def psql_profile(table, profile):
+  return [
+    (name, "CREATE INDEX IF NOT EXISTS %s ON %s %s" % (name, table, spec))
+    for (name, spec) in PSQL_INDEXES[profile]
+  ]
+
+
+# sqlite
+
+def sqlite_indexes(cur, table):
+  """
+  [(name, CREATE INDEX statement)] of the secondary indexes of `table`
+  """
+  # the automatic indexes behind UNIQUE constraints have no sql
+  cur.execute("SELECT name, sql FROM sqlite_master WHERE type = 'index' AND tbl_name = ? AND sql IS NOT NULL", (table,))
+  return [(name, definition) for (name, definition) in cur.fetchall()]
+
+
+def sqlite_drop(cur, table, names=None):
+  """
+  drop every secondary index of `table` (or those in `names`), returning
+  what sqlite_restore() needs to put them back
+  """
+  indexes = _named(sqlite_indexes(cur, table), names)
+  for (name, _) in indexes:
+    cur.execute("DROP INDEX IF EXISTS %s" % (name,))
+  return indexes
+
+
+def sqlite_restore(cur, table, indexes):
+  """
+  create the (name, CREATE INDEX statement) indexes that `table` doesn't
+  have yet. returns the names of the indexes created.
+  """
+  missing = _missing(indexes, sqlite_indexes(cur, table))
+  for (_, definition) in missing:
+    cur.execute(definition)
+  return [name for (name, _) in missing]
+
+
+def sqlite_profile(table, profile):
+  # index names are shared by every table in a sqlite database, so
+  # they're prefixed with the table's
+  return [
+    ("%s_%s" % (table, name), "CREATE INDEX IF NOT EXISTS %s_%s ON %s (%s)" % (table, name, table, columns))
+    for (name, columns) in MYSQL_INDEXES[profile]
+  ]
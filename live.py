@@ -0,0 +1,310 @@
+# encoding: utf-8
+"""
+the current state of every aircraft, kept in memory and served over
+http, so maps and alerting don't have to poll the squitters table.
+
+    /data/aircraft.json   a snapshot, in the format of dump1090's own
+                          aircraft.json, so tools made for that work
+    /stream               server-sent events: a snapshot, then every
+                          PUSH_INTERVAL seconds the aircraft that changed
+
+like metrics, the state is updated on the thread reading dump1090
+without a lock; the http threads only take copies of it. worker
+processes (see sharding) send it Updates instead, one per aircraft for
+each read they parse.
+"""
+
+import BaseHTTPServer
+import datetime
+import json
+import SocketServer
+import threading
+import time
+
+import sbs1
+
+# forget aircraft we haven't heard from in this many seconds
+MAX_AGE = 300.0
+# seconds between pushes to /stream clients
+PUSH_INTERVAL = 1.0
+# seconds between expiring old aircraft
+_SWEEP_INTERVAL = 10.0
+
+# (record field, aircraft.json key) of the state
+_STATE_FIELDS = (
+  (sbs1.CALLSIGN, 'flight'),
+  (sbs1.ALTITUDE, 'altitude'),
+  (sbs1.GROUND_SPEED, 'speed'),
+  (sbs1.TRACK, 'track'),
+  (sbs1.LAT, 'lat'),
+  (sbs1.LON, 'lon'),
+  (sbs1.VERTICAL_RATE, 'vert_rate'),
+  (sbs1.DECIMAL_SQUAWK, 'squawk'),
+  (sbs1.ALERT, 'alert'),
+  (sbs1.EMERGENCY, 'emergency'),
+  (sbs1.SPI, 'spi'),
+  (sbs1.IS_ON_GROUND, 'ground'),
+)
+_FIELDS = tuple(field for (field, _) in _STATE_FIELDS)
+_KEYS = tuple(key for (_, key) in _STATE_FIELDS)
+_LAT = _KEYS.index('lat')
+_LON = _KEYS.index('lon')
+_SQUAWK = _KEYS.index('squawk')
+
+
+class _Aircraft(object):
+  __slots__ = ('state', 'messages', 'last_seen', 'position_time', 'is_mlat', 'client_id', 'seq')
+
+  def __init__(self):
+    self.state = [None] * len(_STATE_FIELDS)
+    self.messages = 0
+    self.last_seen = None
+    self.position_time = None
+    self.is_mlat = False
+    self.client_id = None
+    # LiveState._seq when it was last updated
+    self.seq = 0
+
+
+class LiveState(object):
+  """
+  the latest known value of every state field for each icao address,
+  from any source. `update()` takes records (see sbs1.parse_line, or
+  sbs1.parse_line_compact with `compact`) or the rows made from them.
+
+  aircraft are kept until nothing has been heard from them for `max_age`
+  seconds, by the times they're updated with, so captures age out
+  aircraft by their own clock.
+  """
+
+  def __init__(self, compact=False, max_age=MAX_AGE):
+    self.compact = compact
+    if compact:
+      self._max_age = int(max_age * 1000)
+      self._sweep_interval = int(_SWEEP_INTERVAL * 1000)
+    else:
+      self._max_age = datetime.timedelta(seconds=max_age)
+      self._sweep_interval = datetime.timedelta(seconds=_SWEEP_INTERVAL)
+    self._aircraft = {}
+    self._seq = 0
+    self._latest = None
+    self._next_sweep = None
+    # stats
+    self.updates = 0
+    self.expired = 0
+
+  def __len__(self):
+    return len(self._aircraft)
+
+  def update(self, record, parsed_time, is_mlat, client_id):
+    """
+    merge a record into its aircraft's state
+    """
+    icao_addr = record[sbs1.ICAO_ADDR]
+    aircraft = self._aircraft.get(icao_addr)
+    if aircraft is None:
+      aircraft = self._aircraft[icao_addr] = _Aircraft()
+    state = aircraft.state
+    for (i, field) in enumerate(_FIELDS):
+      value = record[field]
+      if value is not None:
+        state[i] = value
+    if record[sbs1.LAT] is not None and record[sbs1.LON] is not None:
+      aircraft.position_time = parsed_time
+    aircraft.messages += 1
+    aircraft.last_seen = parsed_time
+    aircraft.is_mlat = is_mlat
+    aircraft.client_id = client_id
+    self._seq += 1
+    aircraft.seq = self._seq
+    self.updates += 1
+    self._seen(parsed_time)
+
+  def merge(self, updates, is_mlat, client_id):
+    """
+    merge the items() of an Updates into the state
+    """
+    for (icao_addr, values, messages, last_seen, position_time) in updates:
+      aircraft = self._aircraft.get(icao_addr)
+      if aircraft is None:
+        aircraft = self._aircraft[icao_addr] = _Aircraft()
+      state = aircraft.state
+      for (i, value) in enumerate(values):
+        if value is not None:
+          state[i] = value
+      if position_time is not None:
+        aircraft.position_time = position_time
+      aircraft.messages += messages
+      aircraft.last_seen = last_seen
+      aircraft.is_mlat = is_mlat
+      aircraft.client_id = client_id
+      self._seq += 1
+      aircraft.seq = self._seq
+      self.updates += messages
+      self._seen(last_seen)
+
+  def _seen(self, parsed_time):
+    if self._latest is None or parsed_time > self._latest:
+      self._latest = parsed_time
+      if self._next_sweep is None:
+        self._next_sweep = parsed_time + self._sweep_interval
+      elif parsed_time >= self._next_sweep:
+        self._sweep(parsed_time)
+
+  def _sweep(self, now):
+    self._next_sweep = now + self._sweep_interval
+    expired = [
+      icao_addr for (icao_addr, aircraft) in self._aircraft.iteritems()
+      if now - aircraft.last_seen > self._max_age
+    ]
+    for icao_addr in expired:
+      del self._aircraft[icao_addr]
+    self.expired += len(expired)
+
+  def _json(self, icao_addr, aircraft, now):
+    state = list(aircraft.state)
+    if state[_LAT] is not None and state[_LON] is not None:
+      if self.compact:
+        (state[_LAT], state[_LON]) = (state[_LAT] / float(sbs1.LATLON_SCALE), state[_LON] / float(sbs1.LATLON_SCALE))
+      else:
+        (state[_LAT], state[_LON]) = (float(state[_LAT]), float(state[_LON]))
+    if state[_SQUAWK] is not None:
+      state[_SQUAWK] = "%04o" % (state[_SQUAWK],)
+    a = dict((key, value) for (key, value) in zip(_KEYS, state) if value is not None)
+    if 'flight' in a:
+      a['flight'] = a['flight'].strip()
+    a['hex'] = "%06x" % (icao_addr,)
+    a['messages'] = aircraft.messages
+    a['seen'] = round(now - sbs1.timestamp(aircraft.last_seen), 1)
+    if aircraft.position_time is not None:
+      a['seen_pos'] = round(now - sbs1.timestamp(aircraft.position_time), 1)
+    a['mlat'] = bool(aircraft.is_mlat)
+    a['client_id'] = aircraft.client_id
+    return a
+
+  def snapshot(self, since=0):
+    """
+    (seq, {aircraft.json}) of the aircraft updated after `since`, a seq
+    from an earlier snapshot
+    """
+    # items() is copied in one go, so the reading thread can carry on
+    seq = self._seq
+    aircraft = self._aircraft.items()
+    latest = self._latest
+    now = sbs1.timestamp(latest) if latest is not None else time.time()
+    return (seq, {
+      'now': now,
+      'messages': self.updates,
+      'aircraft': [
+        self._json(icao_addr, a, now)
+        for (icao_addr, a) in aircraft
+        if a.seq > since
+      ],
+    })
+
+
+class Updates(object):
+  """
+  what a run of records from one source changes in each aircraft's
+  state, merged, so it can be sent to LiveState.merge() from another
+  process in one go
+  """
+
+  def __init__(self):
+    # {icao_addr: [state, messages, last_seen, position_time]}
+    self._aircraft = {}
+
+  def __len__(self):
+    return len(self._aircraft)
+
+  def add(self, record, parsed_time):
+    icao_addr = record[sbs1.ICAO_ADDR]
+    aircraft = self._aircraft.get(icao_addr)
+    if aircraft is None:
+      aircraft = self._aircraft[icao_addr] = [[None] * len(_STATE_FIELDS), 0, None, None]
+    state = aircraft[0]
+    for (i, field) in enumerate(_FIELDS):
+      value = record[field]
+      if value is not None:
+        state[i] = value
+    if record[sbs1.LAT] is not None and record[sbs1.LON] is not None:
+      aircraft[3] = parsed_time
+    aircraft[1] += 1
+    aircraft[2] = parsed_time
+
+  def items(self):
+    return [
+      (icao_addr, tuple(state), messages, last_seen, position_time)
+      for (icao_addr, (state, messages, last_seen, position_time)) in self._aircraft.iteritems()
+    ]
+
+
+class _Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+  daemon_threads = True
+
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+  def do_GET(self):
+    path = self.path.split('?', 1)[0]
+    if path in ('/data/aircraft.json', '/aircraft.json'):
+      (_, snapshot) = self.server.live.snapshot()
+      body = json.dumps(snapshot, separators=(',', ':'))
+      self.send_response(200)
+      self.send_header("Content-Type", "application/json")
+      self.send_header("Content-Length", str(len(body)))
+      self.send_header("Cache-Control", "no-cache")
+      self.end_headers()
+      self.wfile.write(body)
+    elif path == '/stream':
+      self._stream()
+    else:
+      self.send_error(404)
+
+  def _stream(self):
+    self.send_response(200)
+    self.send_header("Content-Type", "text/event-stream")
+    self.send_header("Cache-Control", "no-cache")
+    self.end_headers()
+    seq = 0
+    closing = self.server.closing
+    try:
+      while not closing.is_set():
+        (seq, changed) = self.server.live.snapshot(seq)
+        if changed['aircraft']:
+          self.wfile.write("data: %s\n\n" % (json.dumps(changed, separators=(',', ':')),))
+        else:
+          # a comment, so a client that's gone away is noticed
+          self.wfile.write(":\n\n")
+        self.wfile.flush()
+        closing.wait(self.server.push_interval)
+    except IOError:
+      # the client went away
+      pass
+
+  def log_message(self, format, *args):
+    pass
+
+
+def serve(live, port, host="", push_interval=PUSH_INTERVAL):
+  """
+  serve `live` at http://host:port/ from background threads, one for
+  each /stream client
+  """
+  server = _Server((host, port), _Handler)
+  server.live = live
+  server.push_interval = push_interval
+  server.closing = threading.Event()
+  thread = threading.Thread(target=server.serve_forever, name="live")
+  thread.daemon = True
+  thread.start()
+  return server
+
+
+def close(server):
+  """
+  stop serving, and end the /stream responses
+  """
+  server.closing.set()
+  server.shutdown()
+  server.server_close()
@@ -0,0 +1,183 @@
+# encoding: utf-8
+"""
+a prometheus-style (text format) http metrics endpoint.
+
+most of what we report is already counted by the objects doing the work
+(RowQueue.dropped, Throttle.suppressed_by_type, Source.lines, ...), so
+metrics are read from them when they're scraped instead of being kept up
+to date on the hot path.
+"""
+
+import BaseHTTPServer
+import bisect
+import threading
+import time
+
+# commit latency buckets, in seconds
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _labels(labels):
+  if not labels:
+    return ""
+  return "{%s}" % (",".join(
+    '%s="%s"' % (k, str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+    for (k, v) in sorted(labels.items())
+  ),)
+
+
+class Histogram(object):
+  """
+  a cumulative histogram of observed values, e.g. commit times
+  """
+
+  def __init__(self, buckets=BUCKETS):
+    self.buckets = tuple(buckets)
+    self.counts = [0] * (len(self.buckets) + 1)
+    self.sum = 0.0
+    self.count = 0
+
+  def observe(self, value):
+    self.counts[bisect.bisect_left(self.buckets, value)] += 1
+    self.sum += value
+    self.count += 1
+
+  def samples(self, name):
+    total = 0
+    for (bound, count) in zip(self.buckets + ("+Inf",), self.counts):
+      total += count
+      yield "%s_bucket%s %s" % (name, _labels({'le': bound}), total)
+    yield "%s_sum %r" % (name, self.sum)
+    yield "%s_count %s" % (name, self.count)
+
+
+def timed(fn, histogram):
+  """
+  wrap `fn` so the duration of every call (failed ones included) goes
+  into `histogram`
+  """
+  def wrapper(*args, **kwargs):
+    start = time.time()
+    try:
+      return fn(*args, **kwargs)
+    finally:
+      histogram.observe(time.time() - start)
+  return wrapper
+
+
+class Metrics(object):
+  """
+  a set of named metrics. `collect` returns the current value, or a list
+  of (labels, value) pairs for a metric with labels.
+  """
+
+  def __init__(self):
+    self._metrics = []
+
+  def add(self, name, kind, help, collect):
+    self._metrics.append((name, kind, help, collect))
+
+  def add_histogram(self, name, help, histogram):
+    self._metrics.append((name, 'histogram', help, histogram))
+
+  def render(self):
+    out = []
+    for (name, kind, help, collect) in self._metrics:
+      out.append("# HELP %s %s" % (name, help))
+      out.append("# TYPE %s %s" % (name, kind))
+      if kind == 'histogram':
+        out.extend(collect.samples(name))
+        continue
+      values = collect()
+      if not isinstance(values, list):
+        values = [({}, values)]
+      for (labels, value) in values:
+        out.append("%s%s %s" % (name, _labels(labels), value))
+    return "\n".join(out) + "\n"
+
+
+def logger_metrics(sources, throttles, rows, queue, commit_seconds, spooler=None, aggregator=None, retrier=None, relay=None, ingest=None):
+  """
+  the metrics for one of the loggers' pipelines. `throttles` is the
+  {source: throttle.Throttle} dict.
+  """
+  def per_source(attr):
+    return lambda: [
+      ({'source': str(s), 'client_id': s.client_id}, getattr(s, attr))
+      for s in sources
+    ]
+
+  m = Metrics()
+  m.add("dump1090_lines_received_total", "counter", "Lines received from each source.", per_source('lines'))
+  m.add("dump1090_parse_failures_total", "counter", "Lines from each source that weren't well-formed basestation messages.", per_source('parse_errors'))
+  m.add("dump1090_bytes_read_total", "counter", "Bytes read from each source.", per_source('bytes_read'))
+  m.add("dump1090_reconnects_total", "counter", "Failed connection attempts and dropped connections for each source.", per_source('reconnects'))
+  m.add("dump1090_rows_throttled_total", "counter", "Rows not stored because another of the same type came too recently, by transmission type.", lambda: [
+    ({'source': str(s), 'client_id': s.client_id, 'transmission_type': ttype}, count)
+    for (s, t) in throttles.items()
+    for (ttype, count) in enumerate(t.suppressed_by_type)
+    if ttype
+  ])
+  if ingest is not None:
+    m.add("dump1090_rows_filtered_total", "counter", "Rows not stored because of --allow-icao/--deny-icao, geofences or altitude bands, by filter.", lambda: [
+      ({'filter': name}, count)
+      for (name, count) in ingest.dropped.items()
+    ])
+  m.add("dump1090_throttle_entries", "gauge", "Aircraft/message type timers kept for deduplication.", lambda: sum(len(t) for t in throttles.values()))
+  m.add("dump1090_rows_written_total", "counter", "Rows written to the database.", lambda: rows.rows_written)
+  m.add_histogram("dump1090_commit_seconds", "Time taken to write and commit each batch.", commit_seconds)
+  m.add("dump1090_queue_depth", "gauge", "Rows waiting to be written.", lambda: len(queue))
+  m.add("dump1090_queue_high_water", "gauge", "The most rows that have been waiting to be written at once.", lambda: queue.high_water)
+  m.add("dump1090_queue_dropped_total", "counter", "Rows dropped because the queue (or the spill file) was full.", lambda: queue.dropped)
+  m.add("dump1090_queue_spilled_total", "counter", "Rows spilled to disk because the queue was full.", lambda: queue.spilled)
+  if queue.spill is not None:
+    m.add("dump1090_spill_rows", "gauge", "Spilled rows waiting to be written.", lambda: queue.spill.pending)
+    m.add("dump1090_spill_bytes", "gauge", "Size of the spilled rows waiting to be written.", lambda: queue.spill.size)
+  if spooler is not None:
+    m.add("dump1090_spooled_rows_total", "counter", "Rows spooled to disk while the database was unreachable.", lambda: spooler.spool.spooled)
+    m.add("dump1090_replayed_rows_total", "counter", "Spooled rows written to the database.", lambda: spooler.replayed)
+    m.add("dump1090_spool_bytes", "gauge", "Size of the spool waiting to be replayed.", lambda: spooler.spool.size)
+    m.add("dump1090_database_outage", "gauge", "1 while database writes are failing.", lambda: int(spooler.outage))
+  if retrier is not None:
+    m.add("dump1090_database_retries_total", "counter", "Failed attempts to write a batch, each followed by reconnecting to the database.", lambda: retrier.retries)
+    m.add("dump1090_database_outage", "gauge", "1 while database writes are failing.", lambda: int(retrier.outage))
+  if relay is not None:
+    m.add("dump1090_relay_clients", "gauge", "Clients connected to --relay-port.", lambda: len(relay))
+    m.add("dump1090_relay_lines_total", "counter", "Lines queued for --relay-port clients, summed over clients.", lambda: relay.relayed)
+    m.add("dump1090_relay_dropped_lines_total", "counter", "Lines not relayed to a client because its buffer was full, summed over clients.", lambda: relay.dropped)
+  if aggregator is not None:
+    m.add("dump1090_aircraft_tracked", "gauge", "Aircraft with state kept for --aggregate.", lambda: len(aggregator))
+    m.add("dump1090_track_points_total", "counter", "Track points made with --aggregate.", lambda: aggregator.points)
+  return m
+
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+  def do_GET(self):
+    if self.path not in ('/', '/metrics'):
+      self.send_error(404)
+      return
+    body = self.server.metrics.render()
+    self.send_response(200)
+    self.send_header("Content-Type", CONTENT_TYPE)
+    self.send_header("Content-Length", str(len(body)))
+    self.end_headers()
+    self.wfile.write(body)
+
+  def log_message(self, format, *args):
+    # don't print a line for every scrape
+    pass
+
+
+def serve(metrics, port, host=""):
+  """
+  serve `metrics` at http://host:port/metrics from a background thread
+  """
+  server = BaseHTTPServer.HTTPServer((host, port), _Handler)
+  server.metrics = metrics
+  thread = threading.Thread(target=server.serve_forever, name="metrics")
+  thread.daemon = True
+  thread.start()
+  return server
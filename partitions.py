@@ -0,0 +1,235 @@
+# encoding: utf-8
+"""
+daily or monthly RANGE partitions of the squitters table on
+`parsed_time`. upcoming partitions are created ahead of time, and with a
+retention period old ones are dropped, which is a cheap metadata change
+instead of a massive DELETE. each insert also only has to maintain the
+(much smaller) indexes of the current partition.
+
+partitions are named after the first day they hold: `p20190416` for a
+day, `p201904` for a month (prefixed with the table name in postgresql,
+where partitions are tables of their own).
+"""
+
+import datetime
+import threading
+import traceback
+
+INTERVALS = ('day', 'month')
+AHEAD = 3
+# seconds between maintenance runs
+MAINTENANCE_INTERVAL = 3600.0
+
+# mysql catch-all for rows past the last partition. it's always empty in
+# practice, so splitting new partitions off it is cheap.
+MAXVALUE_PARTITION = "pfuture"
+
+_NAME_FORMATS = {'day': "p%Y%m%d", 'month': "p%Y%m"}
+
+
+def _first_day(day, interval):
+  if interval == 'month':
+    return day.replace(day=1)
+  return day
+
+def _next_start(start, interval):
+  if interval == 'month':
+    if start.month == 12:
+      return start.replace(year=start.year + 1, month=1)
+    return start.replace(month=start.month + 1)
+  return start + datetime.timedelta(days=1)
+
+def partition_name(start, interval):
+  return start.strftime(_NAME_FORMATS[interval])
+
+def _partition_start(name, interval):
+  # the first day of a partition we named, or None for any other
+  try:
+    return datetime.datetime.strptime(name, _NAME_FORMATS[interval]).date()
+  except ValueError:
+    return None
+
+
+def wanted(today, interval, ahead=AHEAD):
+  """
+  (name, start, end) of the partition that holds `today` and of the
+  `ahead` partitions after it
+  """
+  start = _first_day(today, interval)
+  out = []
+  for _ in range(ahead + 1):
+    end = _next_start(start, interval)
+    out.append((partition_name(start, interval), start, end))
+    start = end
+  return out
+
+
+def _cutoff(today, retention):
+  # rows from before this day are past `retention` days
+  if retention is None:
+    return None
+  return today - datetime.timedelta(days=retention)
+
+
+def _plan(names, today, interval, ahead, retention):
+  """
+  given the names of the existing partitions, return the (name, start,
+  end) of those to create and the names of those to drop
+  """
+  ends = [_next_start(s, interval) for s in (_partition_start(n, interval) for n in names) if s is not None]
+  last_end = max(ends) if ends else None
+  # a partition can only be added past the last one
+  create = [p for p in wanted(today, interval, ahead) if last_end is None or p[1] >= last_end]
+  drop = []
+  cutoff = _cutoff(today, retention)
+  if cutoff is not None:
+    for name in names:
+      start = _partition_start(name, interval)
+      if start is not None and _next_start(start, interval) <= cutoff:
+        drop.append(name)
+  return (create, drop)
+
+
+# mysql
+
+_EPOCH = datetime.date(1970, 1, 1)
+
+def _mysql_bound(day, compact):
+  if compact:
+    # parsed_time is in epoch milliseconds (see sbs1.parse_line_compact)
+    return "%d" % ((day - _EPOCH).days * 86400000,)
+  return "TO_DAYS('%s')" % (day,)
+
+
+def mysql_partition_clause(today, interval, ahead=AHEAD, compact=False):
+  """
+  the PARTITION BY clause for a new table
+  """
+  return "PARTITION BY RANGE (%s) (%s)" % ("parsed_time" if compact else "TO_DAYS(parsed_time)", ", ".join(
+    ["PARTITION %s VALUES LESS THAN (%s)" % (name, _mysql_bound(end, compact)) for (name, start, end) in wanted(today, interval, ahead)] +
+    ["PARTITION %s VALUES LESS THAN MAXVALUE" % (MAXVALUE_PARTITION,)]
+  ),)
+
+
+def mysql_maintain(cur, table, today, interval, ahead=AHEAD, retention=None, compact=False):
+  """
+  create the upcoming partitions of `table` and drop the ones past
+  `retention` days. returns the names of the (created, dropped) ones.
+  """
+  cur.execute(
+    "SELECT partition_name FROM information_schema.partitions "
+    "WHERE table_schema = DATABASE() AND table_name = %s AND partition_name IS NOT NULL",
+    (table,)
+  )
+  names = [row[0] for row in cur.fetchall()]
+  if not names:
+    print "%s is not partitioned, so its partitions can't be maintained. partitioning an existing table rewrites it; to do it anyway, run:" % (table,)
+    print "  ALTER TABLE %s %s" % (table, mysql_partition_clause(today, interval, ahead, compact))
+    return ([], [])
+
+  (create, drop) = _plan(names, today, interval, ahead, retention)
+  if create:
+    cur.execute("ALTER TABLE %s REORGANIZE PARTITION %s INTO (%s)" % (table, MAXVALUE_PARTITION, ", ".join(
+      ["PARTITION %s VALUES LESS THAN (%s)" % (name, _mysql_bound(end, compact)) for (name, start, end) in create] +
+      ["PARTITION %s VALUES LESS THAN MAXVALUE" % (MAXVALUE_PARTITION,)]
+    )))
+  if drop:
+    cur.execute("ALTER TABLE %s DROP PARTITION %s" % (table, ", ".join(drop)))
+  return ([name for (name, start, end) in create], drop)
+
+
+# postgresql
+
+def psql_maintain(cur, table, today, interval, ahead=AHEAD, retention=None, timezone="UTC"):
+  """
+  create the upcoming partitions of `table` (see psql/create-partitioned.sql)
+  and drop the ones past `retention` days. returns the names of the
+  (created, dropped) ones.
+  """
+  cur.execute(
+    "SELECT 1 FROM pg_partitioned_table pt JOIN pg_class c ON c.oid = pt.partrelid WHERE c.relname = %s",
+    (table,)
+  )
+  if cur.fetchone() is None:
+    print "%s is not partitioned, so its partitions can't be maintained. see psql/create-partitioned.sql" % (table,)
+    return ([], [])
+  cur.execute(
+    "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+    "JOIN pg_class p ON p.oid = i.inhparent WHERE p.relname = %s",
+    (table,)
+  )
+  prefix = table + "_"
+  names = [row[0][len(prefix):] for row in cur.fetchall() if row[0].startswith(prefix)]
+
+  (create, drop) = _plan(names, today, interval, ahead, retention)
+  for (name, start, end) in create:
+    cur.execute(
+      "CREATE TABLE IF NOT EXISTS %s%s PARTITION OF %s FOR VALUES FROM (%%s) TO (%%s)" % (prefix, name, table),
+      ("%s %s" % (start, timezone), "%s %s" % (end, timezone))
+    )
+  for name in drop:
+    cur.execute("DROP TABLE IF EXISTS %s%s" % (prefix, name))
+  psql_check_default(cur, table, _cutoff(today, retention), timezone)
+  return ([name for (name, start, end) in create], drop)
+
+
+def psql_default_partition(cur, table):
+  """
+  the name of the default partition of `table`, or None if it has none
+  """
+  cur.execute(
+    "SELECT d.relname FROM pg_partitioned_table pt JOIN pg_class p ON p.oid = pt.partrelid "
+    "JOIN pg_class d ON d.oid = pt.partdefid WHERE p.relname = %s",
+    (table,)
+  )
+  row = cur.fetchone()
+  return row[0] if row is not None else None
+
+
+def psql_check_default(cur, table, cutoff=None, timezone="UTC"):
+  """
+  rows from before the first partition of `table` (or after the last), like
+  older ones loaded with --file, end up in its default partition. they
+  aren't in a partition --retention drops, so those from before `cutoff`
+  are deleted here, and no partition can be created over the days the
+  rest are in, so they're reported. returns the number of rows left.
+  """
+  default = psql_default_partition(cur, table)
+  if default is None:
+    return 0
+  if cutoff is not None:
+    cur.execute("DELETE FROM %s WHERE parsed_time < %%s" % (default,), ("%s %s" % (cutoff, timezone),))
+    if cur.rowcount > 0:
+      print "Deleted %s rows from before %s from %s" % (cur.rowcount, cutoff, default)
+  cur.execute("SELECT count(*), min(parsed_time), max(parsed_time) FROM %s" % (default,))
+  (count, first, last) = cur.fetchone()
+  if count:
+    print "WARNING: %s rows of %s, from %s to %s, are in its default partition %s. no partition can be created for those days while they're there; to give them one, move them out (see the Readme)" % (count, table, first, last, default)
+  return count
+
+
+class Maintainer(threading.Thread):
+  """
+  calls `maintain()` straight away and then every `interval` seconds, on
+  its own thread. it should use its own database connection. errors are
+  printed, and we try again next time.
+  """
+
+  def __init__(self, maintain, interval=MAINTENANCE_INTERVAL):
+    threading.Thread.__init__(self, name="partitions")
+    self.daemon = True
+    self.maintain = maintain
+    self.interval = interval
+    self._stopping = threading.Event()
+
+  def run(self):
+    while not self._stopping.is_set():
+      try:
+        self.maintain()
+      except Exception:
+        traceback.print_exc()
+        print "Could not maintain partitions, trying again in %.0f seconds" % (self.interval,)
+      self._stopping.wait(self.interval)
+
+  def stop(self):
+    self._stopping.set()
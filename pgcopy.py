@@ -0,0 +1,66 @@
+# encoding: utf-8
+"""
+helpers for bulk loading rows into postgresql with `COPY ... FROM STDIN`
+(text format).
+"""
+
+import binascii
+import datetime
+import io
+import struct
+
+# little-endian EWKB point with an srid: byte order, geometry type
+# (1 = point, with the 0x20000000 "has srid" flag), srid, x, y.
+_EWKB_POINT = struct.Struct('<BIIdd')
+_EWKB_POINT_SRID = 0x20000001
+
+
+def ewkb_point_hex(lon, lat, srid=4326):
+  """
+  hex-encoded EWKB for a point, which postgis reads straight into a
+  geometry column without parsing any WKT. returns None if either
+  coordinate is missing.
+  """
+  if lon is None or lat is None:
+    return None
+  h = binascii.hexlify(_EWKB_POINT.pack(1, _EWKB_POINT_SRID, srid, lon, lat))
+  if not isinstance(h, str):
+    h = h.decode('ascii')
+  return h
+
+
+def _escape(v):
+  return v.replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
+def _copy_value(v):
+  if v is None:
+    return '\\N'
+  t = type(v)
+  if t is bool:
+    return 't' if v else 'f'
+  if t is int:
+    return str(v)
+  if t is float:
+    return repr(v)
+  if t is datetime.datetime:
+    return str(v)
+  return _escape(str(v))
+
+
+def copy_text(rows):
+  """
+  encode rows as the body of a text-format COPY.
+  """
+  return "".join([
+    "\t".join([_copy_value(v) for v in row]) + "\n"
+    for row in rows
+  ])
+
+
+def copy_rows(cur, table, columns, rows):
+  data = copy_text(rows)
+  if isinstance(data, bytes):
+    f = io.BytesIO(data)
+  else:
+    f = io.StringIO(data)
+  cur.copy_expert("COPY %s (%s) FROM STDIN" % (table, ", ".join(columns)), f)
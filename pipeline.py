@@ -0,0 +1,281 @@
+# encoding: utf-8
+"""
+a bounded queue and a writer thread that decouple reading the dump1090
+stream from writing to the database, so a slow commit doesn't stall the
+socket (and get us disconnected by dump1090).
+"""
+
+import collections
+import os
+import pickle
+import sys
+import threading
+import traceback
+
+QUEUE_SIZE = 10000
+
+# what to do with a new row when the queue is full:
+#   block        wait for the writer to catch up (the original behaviour)
+#   drop-oldest  discard the oldest queued row to make room
+#   spill        append the row to a file on disk, to be written once the
+#                queue has drained
+QUEUE_POLICIES = ('block', 'drop-oldest', 'spill')
+QUEUE_POLICY = 'block'
+
+SPILL_FILE = "dump1090-spill.dat"
+# bytes of rows waiting in the spill file before the oldest are dropped
+SPILL_MAX_SIZE = 256 * 1024 * 1024
+
+
+class QueueClosed(Exception):
+  pass
+
+
+class SpillFile(object):
+  """
+  an overflow area for rows that didn't fit in the queue. rows are
+  appended by the reader and read back in order by the writer; the file
+  is truncated whenever it's been fully read.
+
+  at most `max_size` bytes of rows wait in the file; past that, the
+  oldest are dropped. rows that have been read or dropped are cut off
+  the front of the file once they take up `max_size` bytes, so it stays
+  within about twice that on disk, even when nothing is reading it (as
+  while the database is down).
+  """
+
+  def __init__(self, path, max_size=SPILL_MAX_SIZE):
+    self.path = path
+    self.max_size = max_size
+    self.pending = 0
+    self._lock = threading.Lock()
+    self._file = open(path, 'w+b')
+    self._read_pos = 0
+    self._end = 0
+
+  @property
+  def size(self):
+    # bytes of rows waiting to be read
+    return self._end - self._read_pos
+
+  def append(self, row):
+    """
+    spill a row, returning the number of older rows dropped to make room
+    """
+    with self._lock:
+      self._file.seek(self._end)
+      pickle.dump(row, self._file, 2)
+      self._end = self._file.tell()
+      self.pending += 1
+      dropped = 0
+      if self._end - self._read_pos > self.max_size:
+        self._file.seek(self._read_pos)
+        while self.pending > 1 and self._end - self._read_pos > self.max_size:
+          pickle.load(self._file)
+          self._read_pos = self._file.tell()
+          self.pending -= 1
+          dropped += 1
+        if self._read_pos >= self.max_size:
+          self._compact()
+      return dropped
+
+  def read(self, max_rows):
+    with self._lock:
+      if not self.pending:
+        return []
+      self._file.flush()
+      self._file.seek(self._read_pos)
+      rows = []
+      while self.pending and len(rows) < max_rows:
+        rows.append(pickle.load(self._file))
+        self.pending -= 1
+      if self.pending:
+        self._read_pos = self._file.tell()
+        if self._read_pos >= self.max_size:
+          self._compact()
+      else:
+        self._file.seek(0)
+        self._file.truncate()
+        self._read_pos = 0
+        self._end = 0
+      return rows
+
+  def _compact(self):
+    # move the rows still to be read to the start of the file
+    (read, write) = (self._read_pos, 0)
+    while read < self._end:
+      self._file.seek(read)
+      data = self._file.read(min(1024 * 1024, self._end - read))
+      self._file.seek(write)
+      self._file.write(data)
+      read += len(data)
+      write += len(data)
+    self._file.truncate(write)
+    self._read_pos = 0
+    self._end = write
+
+  def close(self):
+    with self._lock:
+      self._file.close()
+    if not self.pending:
+      os.remove(self.path)
+
+
+class RowQueue(object):
+  """
+  a bounded fifo of rows between the reader and the writer, with a
+  configurable policy for when it's full (see QUEUE_POLICIES).
+
+  once a row has been spilled, new rows are spilled after it until the
+  spill file has been read back, so rows are written in the order they
+  were put.
+  """
+
+  def __init__(self, maxsize=QUEUE_SIZE, policy=QUEUE_POLICY, spill=None):
+    if policy not in QUEUE_POLICIES:
+      raise ValueError("unknown queue policy %r" % (policy,))
+    if policy == 'spill' and spill is None:
+      raise ValueError("the spill policy needs a spill file")
+    self.maxsize = maxsize
+    self.policy = policy
+    self.spill = spill
+    self.closed = False
+    # counters
+    self.high_water = 0
+    self.dropped = 0
+    self.spilled = 0
+    self._rows = collections.deque()
+    self._cond = threading.Condition()
+
+  def __len__(self):
+    return len(self._rows)
+
+  def put(self, row):
+    with self._cond:
+      if self.closed:
+        raise QueueClosed()
+      if self.spill is not None and self.spill.pending:
+        self._spill(row)
+        return
+      if len(self._rows) >= self.maxsize:
+        if self.policy == 'drop-oldest':
+          self._rows.popleft()
+          self.dropped += 1
+        elif self.policy == 'spill':
+          self._spill(row)
+          return
+        else:
+          # wake up periodically so ^C still works on python 2
+          while len(self._rows) >= self.maxsize and not self.closed:
+            self._cond.wait(1.0)
+          if self.closed:
+            raise QueueClosed()
+      self._rows.append(row)
+      if len(self._rows) > self.high_water:
+        self.high_water = len(self._rows)
+      self._cond.notify_all()
+
+  def _spill(self, row):
+    self.dropped += self.spill.append(row)
+    self.spilled += 1
+    self._cond.notify_all()
+
+  def put_many(self, rows):
+    """
+    put() every row, taking the lock once if there's room for all of them
+    """
+    with self._cond:
+      if self.closed:
+        raise QueueClosed()
+      if len(self._rows) + len(rows) <= self.maxsize and not (self.spill is not None and self.spill.pending):
+        self._rows.extend(rows)
+        if len(self._rows) > self.high_water:
+          self.high_water = len(self._rows)
+        self._cond.notify_all()
+        return
+    for row in rows:
+      self.put(row)
+
+  def get_batch(self, max_rows, timeout):
+    """
+    take up to `max_rows` rows, waiting at most `timeout` seconds for the
+    first one. spilled rows are handed out once the rows queued before
+    them have been.
+    """
+    spill = self.spill
+    with self._cond:
+      if not self._rows and not self.closed and not (spill is not None and spill.pending):
+        self._cond.wait(timeout)
+      batch = [self._rows.popleft() for _ in range(min(max_rows, len(self._rows)))]
+      if batch:
+        self._cond.notify_all()
+    if len(batch) < max_rows and spill is not None and spill.pending:
+      batch += spill.read(max_rows - len(batch))
+    return batch
+
+  def close(self):
+    with self._cond:
+      self.closed = True
+      self._cond.notify_all()
+
+
+class Writer(threading.Thread):
+  """
+  drains a RowQueue into a batching.RowBuffer on its own thread.
+  `on_flush(count)` is called after each batch is written. if writing
+  fails the queue is closed and the exception is kept in `error`.
+
+  with a spool.SpoolingWriter as `spooler` (which should also be the
+  RowBuffer's write function), spooled rows are replayed in between
+  batches from the queue.
+
+  `on_poll()`, if given, is called each time around, which is at least
+  every `max_delay` seconds of the RowBuffer even when no rows arrive,
+  for whatever `write` buffers on its own.
+  """
+
+  def __init__(self, queue, rows, on_flush=None, spooler=None, on_poll=None):
+    threading.Thread.__init__(self, name="writer")
+    self.daemon = True
+    self.queue = queue
+    self.rows = rows
+    self.on_flush = on_flush
+    self.spooler = spooler
+    self.on_poll = on_poll
+    self.error = None
+    self._stopping = threading.Event()
+
+  def run(self):
+    try:
+      while True:
+        batch = self.queue.get_batch(self.rows.batch_size, self.rows.max_delay)
+        written = 0
+        for row in batch:
+          written += self.rows.add(row)
+        written += self.rows.poll()
+        if self.on_poll is not None:
+          self.on_poll()
+        if self.spooler is not None:
+          replayed = self.spooler.replay()
+          # spooled rows only count as written once they've been replayed
+          self.rows.rows_written += replayed
+          written += replayed
+        if written and self.on_flush is not None:
+          self.on_flush(written)
+        if not batch and self._stopping.is_set():
+          break
+      written = self.rows.flush()
+      if written and self.on_flush is not None:
+        self.on_flush(written)
+    except Exception:
+      self.error = sys.exc_info()[1]
+      traceback.print_exc()
+      self.queue.close()
+
+  def stop(self):
+    """
+    write out everything that's been queued, then stop.
+    """
+    self._stopping.set()
+    self.queue.close()
+    self.join()
@@ -33,5 +33,28 @@ CREATE INDEX IF NOT EXISTS idx_icao_addr ON squitters(icao_addr);
 CREATE INDEX IF NOT EXISTS idx_is_mlat ON squitters(is_mlat);
 CREATE INDEX IF NOT EXISTS idx_client_id ON squitters(client_id);
 CREATE INDEX IF NOT EXISTS idx_latlon ON squitters(latlon);
-CREATE INDEX IF NOT EXISTS idx_latlon ON squitters(latlon);
 CREATE INDEX IF NOT EXISTS idx_decimal_squawk ON squitters(decimal_squawk);
+
+-- only used with --aggregate
+CREATE TABLE IF NOT EXISTS
+  track_points(
+    icao_addr         INTEGER NOT NULL,
+    callsign          TEXT NOT NULL DEFAULT '',
+    altitude          INTEGER,
+    ground_speed      SMALLINT,
+    track             INTEGER,
+    vertical_rate     INTEGER,
+    decimal_squawk    INTEGER,
+    alert             BOOLEAN,
+    emergency         BOOLEAN,
+    spi               BOOLEAN,
+    is_on_ground      BOOLEAN,
+    messages          INTEGER NOT NULL,
+    parsed_time       TIMESTAMP WITH TIME ZONE NOT NULL,
+    is_mlat           BOOLEAN,
+    client_id         SMALLINT NOT NULL DEFAULT 0
+  );
+SELECT AddGeometryColumn ('public','track_points','latlon',4326,'POINT',2);
+CREATE INDEX IF NOT EXISTS idx_track_points_parsed_time ON track_points(parsed_time);
+CREATE INDEX IF NOT EXISTS idx_track_points_icao_addr ON track_points(icao_addr);
+CREATE INDEX IF NOT EXISTS idx_track_points_latlon ON track_points USING GIST (latlon);
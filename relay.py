@@ -0,0 +1,105 @@
+# encoding: utf-8
+"""
+re-serving the basestation stream to other clients, so tools that want
+port 30003 can connect here instead of each opening a connection of
+their own to the receiver.
+
+everything happens on the thread reading dump1090, with non-blocking
+sockets. each client has a buffer of at most `max_buffer` bytes; lines
+that don't fit in a slow client's buffer are dropped for that client
+alone, so it can't hold up reading or the other clients.
+"""
+
+import errno
+import socket
+
+# bytes waiting to be sent to a client before its lines are dropped,
+# a few seconds of a busy feed
+MAX_BUFFER = 262144
+
+_WOULD_BLOCK = (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR)
+
+
+class _Client(object):
+
+  def __init__(self, sock, address):
+    self.sock = sock
+    self.address = address
+    # whole lines; only the first can have been partly sent
+    self.pending = bytearray()
+
+
+class Relay(object):
+  """
+  accepts basestation clients on `port` and sends them the lines given
+  to `send()`, with "\\r\\n" line endings as dump1090 does.
+  """
+
+  def __init__(self, port, host="", max_buffer=MAX_BUFFER):
+    self.max_buffer = max_buffer
+    self._listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    self._listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    self._listener.bind((host, port))
+    self._listener.listen(16)
+    self._listener.setblocking(0)
+    self._clients = []
+    # counters
+    self.connections = 0
+    self.relayed = 0
+    self.dropped = 0
+
+  def __len__(self):
+    return len(self._clients)
+
+  def _accept(self):
+    while True:
+      try:
+        (sock, address) = self._listener.accept()
+      except socket.error as e:
+        if e.args[0] in _WOULD_BLOCK:
+          return
+        raise
+      sock.setblocking(0)
+      self._clients.append(_Client(sock, address))
+      self.connections += 1
+      print "Relaying to %s:%s" % address
+
+  def _drop(self, client, reason):
+    print "Stopped relaying to %s:%s (%s)" % (client.address + (reason,))
+    client.sock.close()
+    self._clients.remove(client)
+
+  def send(self, lines):
+    """
+    queue `lines` for every client and send what they'll take right
+    now. should be called regularly, even without lines, to accept new
+    clients and keep sending to slow ones.
+    """
+    self._accept()
+    if lines:
+      data = b"\r\n".join(lines) + b"\r\n"
+    else:
+      data = None
+    for client in list(self._clients):
+      if data is not None:
+        if len(client.pending) + len(data) > self.max_buffer:
+          self.dropped += len(lines)
+        else:
+          client.pending += data
+          self.relayed += len(lines)
+      if not client.pending:
+        continue
+      try:
+        n = client.sock.send(client.pending)
+      except socket.error as e:
+        if e.args[0] in _WOULD_BLOCK:
+          continue
+        self._drop(client, e.args[-1])
+        continue
+      del client.pending[:n]
+
+  def close(self):
+    for client in self._clients:
+      client.sock.close()
+    self._clients = []
+    self._listener.close()
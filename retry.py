@@ -0,0 +1,113 @@
+# encoding: utf-8
+"""
+exponential backoff with jitter, and retrying database writes through
+an outage instead of exiting.
+
+a network blip drops every connection at once; without jitter, every
+logger (and every source of one) would come back in lockstep and retry
+at exactly the same moments.
+"""
+
+import random
+import threading
+import time
+
+# seconds
+MAX_DELAY = 60.0
+# each delay is up to this fraction shorter, at random
+JITTER = 0.5
+
+
+class Backoff(object):
+  """
+  the waits between attempts: `initial` seconds, doubling after each
+  further failure up to `max_delay`, less a random `jitter` fraction.
+  reset() once an attempt succeeds.
+  """
+
+  def __init__(self, initial, max_delay=MAX_DELAY, jitter=JITTER):
+    self.initial = initial
+    self.max_delay = max_delay
+    self.jitter = jitter
+    self._next = initial
+
+  def delay(self):
+    """
+    the wait before the next attempt
+    """
+    delay = self._next
+    self._next = min(delay * 2, self.max_delay)
+    return delay * (1.0 - self.jitter * random.random())
+
+  def reset(self):
+    self._next = self.initial
+
+
+def forever(fn, errors, backoff, what):
+  """
+  call fn() until it doesn't raise one of `errors`, returning what it
+  returns
+  """
+  while True:
+    try:
+      result = fn()
+    except errors as e:
+      delay = backoff.delay()
+      print "Could not %s (%s). Trying again in %.1f seconds" % (what, e, delay)
+      time.sleep(delay)
+      continue
+    backoff.reset()
+    return result
+
+
+class RetryingWriter(object):
+  """
+  wraps a `write(rows)` function (for a batching.RowBuffer). a batch
+  that fails with one of `errors` is retried, calling `reconnect()`
+  first, with a `backoff` between attempts, until it's written. new rows
+  wait in the pipeline.RowQueue meanwhile, so the queue's policy decides
+  what happens to them in a long outage.
+
+  after stop(), a failing batch isn't waited for any more: the error is
+  raised, so the program can exit.
+  """
+
+  def __init__(self, write, errors, reconnect, backoff):
+    self.write = write
+    self.errors = errors
+    self.reconnect = reconnect
+    self.backoff = backoff
+    # counters
+    self.retries = 0
+    self._failing = False
+    self._stopping = threading.Event()
+
+  @property
+  def outage(self):
+    return self._failing
+
+  def __call__(self, rows):
+    attempts = 0
+    while True:
+      try:
+        if self._failing:
+          self.reconnect()
+        self.write(rows)
+      except self.errors as e:
+        if self._stopping.is_set():
+          raise
+        self._failing = True
+        self.retries += 1
+        attempts += 1
+        delay = self.backoff.delay()
+        print "Lost the database (%s). Reconnecting in %.1f seconds" % (e, delay)
+        self._stopping.wait(delay)
+        continue
+      if self._failing:
+        print "Reconnected to the database after %s attempts" % (attempts,)
+        self._failing = False
+        self.backoff.reset()
+      return
+
+  def stop(self):
+    self._stopping.set()
@@ -0,0 +1,351 @@
+# encoding: utf-8
+"""
+shared SBS-1 (BaseStation) line parser used by both the mysql and the
+postgresql loggers.
+
+data format info:
+   http://woodair.net/SBS/Article/Barebones42_Socket_Data.htm
+   https://github.com/wiseman/node-sbs1
+"""
+
+import datetime
+
+# number of comma-separated fields in a valid basestation line
+FIELD_COUNT = 22
+
+EPOCH = datetime.datetime(1970, 1, 1)
+
+# columns of a parsed record, in order. the four generated/logged date &
+# time fields of the raw line are folded into `generated_datetime` and
+# `logged_datetime`.
+RECORD_COLUMNS = (
+  'message_type',
+  'transmission_type',
+  'session_id',
+  'aircraft_id',
+  'icao_addr',
+  'flight_id',
+  'callsign',
+  'altitude',
+  'ground_speed',
+  'track',
+  'lat',
+  'lon',
+  'vertical_rate',
+  'decimal_squawk',
+  'alert',
+  'emergency',
+  'spi',
+  'is_on_ground',
+  'generated_datetime',
+  'logged_datetime',
+)
+(
+  MESSAGE_TYPE,
+  TRANSMISSION_TYPE,
+  SESSION_ID,
+  AIRCRAFT_ID,
+  ICAO_ADDR,
+  FLIGHT_ID,
+  CALLSIGN,
+  ALTITUDE,
+  GROUND_SPEED,
+  TRACK,
+  LAT,
+  LON,
+  VERTICAL_RATE,
+  DECIMAL_SQUAWK,
+  ALERT,
+  EMERGENCY,
+  SPI,
+  IS_ON_GROUND,
+  GENERATED_DATETIME,
+  LOGGED_DATETIME,
+) = range(len(RECORD_COLUMNS))
+
+# columns of a row as written to the `squitters` table: the record plus
+# the values that the logger tags it with.
+SQUITTER_COLUMNS = RECORD_COLUMNS + (
+  'parsed_time',
+  'is_mlat',
+  'client_id',
+)
+
+
+# converters for a single stripped field value. empty values are turned
+# into None before these are ever called.
+
+def _message_type(v):
+  # 2-3 char, sometimes with trailing digits
+  return v.strip("0123456789").strip()
+
+def _string(v):
+  return v
+
+def _hex_int(v):
+  return int(v, 16)
+
+def _octal_int(v):
+  return int(v, 8)
+
+def _bool(v):
+  return v != '0'
+
+# "2016/03/07" -> (2016, 3, 7). the date only changes once a day, so
+# these are cached instead of being reparsed for every row.
+_date_cache = {}
+_DATE_CACHE_LIMIT = 16
+
+def _date(v):
+  d = _date_cache.get(v)
+  if d is None:
+    if len(_date_cache) >= _DATE_CACHE_LIMIT:
+      _date_cache.clear()
+    parsed = datetime.datetime.strptime(v, '%Y/%m/%d')
+    d = _date_cache[v] = (parsed.year, parsed.month, parsed.day)
+  return d
+
+# "18:45:01.123" -> (18, 45, 1, 123000), without going through strptime
+def _time(v):
+  hms, _, frac = v.partition('.')
+  h, m, s = hms.split(':')
+  if frac:
+    usec = int((frac + '000000')[:6])
+  else:
+    usec = 0
+  return (int(h), int(m), int(s), usec)
+
+
+# one converter per raw field, in raw field order
+FIELD_CONVERTERS = (
+  _message_type,  #0 message type
+  int,            #1 transmission type
+  _string,        #2 session id
+  _string,        #3 aircraft id
+  _hex_int,       #4 icao address (hex)
+  _string,        #5 flight id
+  _date,          #6 generated date
+  _time,          #7 generated time
+  _date,          #8 logged date
+  _time,          #9 logged time
+  _string,        #10 callsign
+  int,            #11 altitude
+  int,            #12 ground speed
+  int,            #13 track
+  float,          #14 lat
+  float,          #15 lon
+  int,            #16 vertical rate
+  _octal_int,     #17 squawk (octal)
+  _bool,          #18 alert
+  _bool,          #19 emergency
+  _bool,          #20 spi
+  _bool,          #21 is on ground
+)
+
+
+def _combine(date, time):
+  if date is None or time is None:
+    return None
+  try:
+    return datetime.datetime(*(date + time))
+  except ValueError:
+    return None
+
+
+def _convert(line, converters):
+  # split a line and convert its fields, or return None if it isn't a
+  # complete, well-formed message
+  if not isinstance(line, str):
+    line = line.decode('ascii', 'replace')
+  fields = line.split(',')
+  if len(fields) != FIELD_COUNT:
+    return None
+  fields = [f.strip() for f in fields]
+
+  # session_id, aircraft_id, flight_id are sometimes censored with '11111'?
+  if (fields[2] == '111' and fields[3] == '11111' and fields[5] == '111111') \
+  or (fields[2] == '1' and fields[3] == '1' and fields[5] == '1'):
+    fields[2] = ''
+    fields[3] = ''
+    fields[5] = ''
+
+  try:
+    return [conv(v) if v else None for (conv, v) in zip(converters, fields)]
+  except ValueError:
+    return None
+
+
+def parse_line(line):
+  """
+  parse a single basestation line (with or without its line ending) into
+  a record list ordered like `RECORD_COLUMNS`. returns None if the line
+  is not a complete, well-formed message.
+  """
+  values = _convert(line, FIELD_CONVERTERS)
+  if values is None:
+    return None
+  return [
+    values[0],
+    values[1],
+    values[2],
+    values[3],
+    values[4],
+    values[5],
+    values[10],
+    values[11],
+    values[12],
+    values[13],
+    values[14],
+    values[15],
+    values[16],
+    values[17],
+    values[18],
+    values[19],
+    values[20],
+    values[21],
+    _combine(values[6], values[7]),
+    _combine(values[8], values[9]),
+  ]
+
+
+# the compact encoding: lat/lon as integers in units of LATLON_SCALE,
+# times as integer milliseconds since the epoch, session/aircraft/flight
+# ids as integers and callsigns of at most 8 characters. nothing but
+# ints, bools and short strings is allocated for a row.
+LATLON_SCALE = 100000
+CALLSIGN_LENGTH = 8
+
+def _id(v):
+  # these are numbers from dump1090, but not from every decoder
+  if v.isdigit():
+    return int(v)
+  return None
+
+def _callsign(v):
+  return v[:CALLSIGN_LENGTH]
+
+def _scaled(v):
+  return int(round(float(v) * LATLON_SCALE))
+
+# "2016/03/07" -> milliseconds since the epoch at the start of that day
+_day_ms_cache = {}
+
+def _day_ms(v):
+  ms = _day_ms_cache.get(v)
+  if ms is None:
+    if len(_day_ms_cache) >= _DATE_CACHE_LIMIT:
+      _day_ms_cache.clear()
+    days = (datetime.datetime.strptime(v, '%Y/%m/%d') - EPOCH).days
+    ms = _day_ms_cache[v] = days * 86400000
+  return ms
+
+# "18:45:01.123" -> milliseconds since midnight, or None for a time that
+# doesn't exist (like parse_line, which doesn't reject the line for it)
+def _ms_of_day(v):
+  (h, m, s, usec) = _time(v)
+  if h > 23 or m > 59 or s > 59:
+    return None
+  return ((h * 60 + m) * 60 + s) * 1000 + usec // 1000
+
+COMPACT_CONVERTERS = (
+  _message_type,  #0 message type
+  int,            #1 transmission type
+  _id,            #2 session id
+  _id,            #3 aircraft id
+  _hex_int,       #4 icao address (hex)
+  _id,            #5 flight id
+  _day_ms,        #6 generated date
+  _ms_of_day,     #7 generated time
+  _day_ms,        #8 logged date
+  _ms_of_day,     #9 logged time
+  _callsign,      #10 callsign
+  int,            #11 altitude
+  int,            #12 ground speed
+  int,            #13 track
+  _scaled,        #14 lat
+  _scaled,        #15 lon
+  int,            #16 vertical rate
+  _octal_int,     #17 squawk (octal)
+  _bool,          #18 alert
+  _bool,          #19 emergency
+  _bool,          #20 spi
+  _bool,          #21 is on ground
+)
+
+
+def parse_line_compact(line):
+  """
+  like parse_line, but with values in the compact encoding
+  """
+  values = _convert(line, COMPACT_CONVERTERS)
+  if values is None:
+    return None
+  return [
+    values[0],
+    values[1],
+    values[2],
+    values[3],
+    values[4],
+    values[5],
+    values[10],
+    values[11],
+    values[12],
+    values[13],
+    values[14],
+    values[15],
+    values[16],
+    values[17],
+    values[18],
+    values[19],
+    values[20],
+    values[21],
+    values[6] + values[7] if values[6] is not None and values[7] is not None else None,
+    values[8] + values[9] if values[8] is not None and values[9] is not None else None,
+  ]
+
+
+def timestamp(t):
+  """
+  seconds since the epoch for a record's time: a naive datetime, or
+  milliseconds since the epoch in the compact encoding
+  """
+  if isinstance(t, datetime.datetime):
+    return (t - EPOCH).total_seconds()
+  return t / 1000.0
+
+
+def epoch_ms(dt):
+  """
+  a naive datetime in the compact encoding
+  """
+  return int((dt - EPOCH).total_seconds() * 1000)
+
+
+def line_timestamp(line):
+  """
+  seconds since the epoch at which a raw basestation line was logged (or
+  generated, if it has no logged time), without parsing the rest of it.
+  returns None if it has neither.
+  """
+  fields = line.split(',', 10)
+  if len(fields) < 11:
+    return None
+  for (d, t) in ((fields[8], fields[9]), (fields[6], fields[7])):
+    d = d.strip()
+    t = t.strip()
+    if d and t:
+      try:
+        dt = _combine(_date(d), _time(t))
+      except ValueError:
+        continue
+      if dt is not None:
+        return timestamp(dt)
+  return None
+
+
+def make_row(record, parsed_time, is_mlat, client_id):
+  """
+  tag a parsed record with the values that the logger adds to each row,
+  returning a tuple ordered like `SQUITTER_COLUMNS`.
+  """
+  return tuple(record) + (parsed_time, is_mlat, client_id)
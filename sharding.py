@@ -0,0 +1,288 @@
+# encoding: utf-8
+"""
+parsing and throttling lines on a pool of worker processes, for feeds
+that keep one core busy, like an aggregator merging dozens of receivers.
+
+lines are sharded by icao address, so every message from an aircraft
+goes to the same worker, and its throttle sees all of them just as it
+would in a single process. workers send back the rows the main loop
+would have queued, along with their parse failure and throttle counts,
+and if it's wanted, what every message did to the live state.
+"""
+
+import collections
+import functools
+import multiprocessing
+import operator
+import Queue
+import signal
+
+import filters
+import live
+import sbs1
+import throttle
+
+# reads that can be waiting to be parsed before reading stops to let the
+# workers catch up
+MAX_PENDING = 8
+
+_ICAO_FIELD = 4
+
+
+def _work(tasks, results, worker, parse_line, only_log_types, new_throttle, record_time, throttled, ingest, track_live):
+  # ^C goes to the whole process group; the parent tells us when to stop
+  signal.signal(signal.SIGINT, signal.SIG_IGN)
+  throttles = {}
+  while True:
+    task = tasks.get()
+    if task is None:
+      break
+    (batch, cur_time, chunks) = task
+    rows = []
+    # where in the read each row's line was
+    positions = []
+    # (position, parsed_time) of the last line of a logged type
+    latest = None
+    counts = []
+    live_updates = []
+    # like the main loop's cur_time, a line without a time of its own
+    # takes that of the line before
+    parsed_time = cur_time
+    for (index, is_mlat, client_id, lines, line_positions) in chunks:
+      ttl = throttles.get(index)
+      if ttl is None:
+        ttl = throttles[index] = new_throttle()
+      errors = 0
+      updates = live.Updates() if track_live else None
+      # the same steps as the main loop of dump1090-stream-parser.py
+      for (line, position) in zip(lines, line_positions):
+        record = parse_line(line)
+        if record is None:
+          errors += 1
+          continue
+        if record[sbs1.TRANSMISSION_TYPE] not in only_log_types:
+          continue
+        if record_time:
+          parsed_time = record[sbs1.LOGGED_DATETIME] or record[sbs1.GENERATED_DATETIME] or parsed_time
+        latest = (position, parsed_time)
+        if updates is not None:
+          # every message, throttled or not, so the state is current
+          updates.add(record, parsed_time)
+        if ingest is not None and not ingest.allow(record):
+          continue
+        if throttled and (not is_mlat) and not ttl.allow(record[sbs1.ICAO_ADDR], record[sbs1.TRANSMISSION_TYPE], sbs1.timestamp(parsed_time) if record_time else None, record):
+          continue
+        rows.append(sbs1.make_row(record, parsed_time, is_mlat, client_id))
+        positions.append(position)
+      counts.append((index, errors, list(ttl.suppressed_by_type), len(ttl)))
+      if updates:
+        live_updates.append((index, updates.items()))
+    dropped = list(ingest.dropped.values()) if ingest is not None else None
+    results.put((batch, worker, rows, positions, latest, counts, dropped, live_updates))
+
+
+class ThrottleTotals(object):
+  """
+  the counters of a source's throttles in every worker, summed, so they
+  can stand in for a throttle.Throttle in stats and metrics
+  """
+
+  def __init__(self, workers):
+    self._suppressed_by_type = [[] for _ in range(workers)]
+    self._entries = [0] * workers
+
+  def __len__(self):
+    return sum(self._entries)
+
+  @property
+  def suppressed_by_type(self):
+    return [sum(counts) for counts in zip(*[c for c in self._suppressed_by_type if c])]
+
+  @property
+  def suppressed(self):
+    return sum(sum(counts) for counts in self._suppressed_by_type)
+
+  def _update(self, worker, suppressed_by_type, entries):
+    self._suppressed_by_type[worker] = suppressed_by_type
+    self._entries[worker] = entries
+
+
+class FilterTotals(object):
+  """
+  the counters of the filters.IngestFilter in every worker, summed, so
+  they can stand in for it in stats and metrics
+  """
+
+  def __init__(self, workers):
+    self._dropped = [[0] * len(filters.FILTERS) for _ in range(workers)]
+
+  @property
+  def dropped(self):
+    return collections.OrderedDict(zip(filters.FILTERS, [sum(counts) for counts in zip(*self._dropped)]))
+
+  @property
+  def filtered(self):
+    return sum(sum(counts) for counts in self._dropped)
+
+  def _update(self, worker, dropped):
+    self._dropped[worker] = dropped
+
+
+def _shard(icao):
+  # by the address the parser will make of it, so every way of writing
+  # an aircraft's address (in either case, with or without spaces) goes
+  # to the same worker and its throttle
+  try:
+    return int(icao, 16)
+  except ValueError:
+    return hash(icao.strip().upper())
+
+
+class ShardedParser(object):
+  """
+  parses the lines from `sources` on `workers` processes, with
+  `parse_line` (sbs1.parse_line or sbs1.parse_line_compact), skipping
+  transmission types that aren't in `only_log_types` and throttling each
+  source like a throttle.Throttle(ttls, aliases, max_entries) would.
+
+  with `record_time`, rows are stamped and throttled with the time in
+  the line, as when reading a capture. without `throttled`, every row is
+  passed on, e.g. for tracks.Aggregator. with a filters.IngestFilter as
+  `ingest`, each worker filters its aircraft with a copy of it before
+  throttling them, and `filters` is a FilterTotals of their counters.
+  `new_throttle()`, if it's given, makes the throttles instead, e.g. a
+  throttle.ChangeThrottle. with a live.LiveState as `live_state`, every
+  message parsed is merged into it, throttled or not, as the rows of its
+  read are collected.
+
+  `put()` hands out what a reader returned; `reads()` collects the rows
+  of the reads that have been parsed, in the order they were read.
+  `throttles` is a {source: ThrottleTotals} dict.
+  """
+
+  def __init__(self, sources, workers, parse_line, only_log_types, ttls, aliases, max_entries=throttle.MAX_ENTRIES, record_time=False, throttled=True, ingest=None, new_throttle=None, live_state=None):
+    self.sources = list(sources)
+    self._index = dict((source, i) for (i, source) in enumerate(self.sources))
+    self.throttles = dict((source, ThrottleTotals(workers)) for source in self.sources)
+    self.filters = FilterTotals(workers) if ingest is not None else None
+    self.live_state = live_state
+    self.record_time = record_time
+    if new_throttle is None:
+      new_throttle = functools.partial(throttle.Throttle, ttls, aliases, max_entries)
+    # {read: [shards not back yet, rows]}, in the order they were read
+    self._batches = collections.OrderedDict()
+    self._next_batch = 0
+    self._tasks = [multiprocessing.Queue() for _ in range(workers)]
+    self._results = multiprocessing.Queue()
+    self._workers = []
+    for (worker, tasks) in enumerate(self._tasks):
+      process = multiprocessing.Process(
+        target=_work,
+        name="parser-%d" % (worker,),
+        args=(tasks, self._results, worker, parse_line, only_log_types, new_throttle, record_time, throttled, ingest, live_state is not None),
+      )
+      process.daemon = True
+      process.start()
+      self._workers.append(process)
+
+  def put(self, received, cur_time):
+    """
+    shard the (source, lines) pairs of a read between the workers
+    """
+    workers = len(self._workers)
+    shards = [[] for _ in range(workers)]
+    # lines are numbered through the read, so their rows can be put back
+    # in order
+    position = 0
+    for (source, data) in received:
+      split = [([], []) for _ in range(workers)]
+      for line in data:
+        fields = line.split(',', _ICAO_FIELD + 1)
+        # anything without an address is a parse failure, wherever it goes
+        icao = fields[_ICAO_FIELD] if len(fields) > _ICAO_FIELD else ''
+        (lines, positions) = split[_shard(icao) % workers]
+        lines.append(line)
+        positions.append(position)
+        position += 1
+      for (shard, (lines, positions)) in zip(shards, split):
+        if lines:
+          shard.append((self._index[source], source.is_mlat, source.client_id, lines, positions))
+    # [shards not back yet, [(position, row)], the read's time, the
+    # (position, parsed_time) of its last line of a logged type]
+    batch = [0, [], cur_time, None]
+    for (tasks, chunks) in zip(self._tasks, shards):
+      if chunks:
+        tasks.put((self._next_batch, cur_time, chunks))
+        batch[0] += 1
+    if batch[0]:
+      self._batches[self._next_batch] = batch
+      self._next_batch += 1
+
+  def __len__(self):
+    return len(self._batches)
+
+  def rows(self, wait=False):
+    """
+    the rows of the reads that have been parsed, as reads() but all in one
+    list
+    """
+    return [row for (rows, _) in self.reads(wait) for row in rows]
+
+  def reads(self, wait=False):
+    """
+    (rows, time) for each read that has been parsed, in the order they
+    were read, with the rows in the order of their lines. the time is
+    what the main loop would poll a tracks.Aggregator at after the read:
+    the time it was read, or with `record_time`, that of its last line
+    of a logged type (None if it had none).
+
+    if the workers are more than MAX_PENDING reads behind, wait until
+    they aren't, or with `wait`, until they're done.
+    """
+    reads = []
+    while self._batches:
+      (first, batch) = next(self._batches.iteritems())
+      if not batch[0]:
+        del self._batches[first]
+        (_, rows, cur_time, latest) = batch
+        rows.sort(key=operator.itemgetter(0))
+        if self.record_time:
+          cur_time = latest[1] if latest is not None else None
+        reads.append(([row for (_, row) in rows], cur_time))
+        continue
+      block = wait or len(self._batches) > MAX_PENDING
+      try:
+        (done, worker, parsed, positions, latest, counts, dropped, live_updates) = self._results.get(block, 1.0)
+      except Queue.Empty:
+        if not block:
+          break
+        if not all(process.is_alive() for process in self._workers):
+          raise RuntimeError("a parser process exited")
+        continue
+      batch = self._batches[done]
+      batch[0] -= 1
+      batch[1].extend(zip(positions, parsed))
+      if latest is not None and (batch[3] is None or latest[0] > batch[3][0]):
+        batch[3] = latest
+      for (index, errors, suppressed_by_type, entries) in counts:
+        source = self.sources[index]
+        source.parse_errors += errors
+        self.throttles[source]._update(worker, suppressed_by_type, entries)
+      if dropped is not None:
+        self.filters._update(worker, dropped)
+      for (index, updates) in live_updates:
+        # each aircraft's messages are all parsed by one worker, so its
+        # updates still arrive in order
+        source = self.sources[index]
+        self.live_state.merge(updates, source.is_mlat, source.client_id)
+    return reads
+
+  def close(self):
+    for tasks in self._tasks:
+      tasks.put(None)
+      tasks.close()
+    for process in self._workers:
+      process.join(5.0)
+      if process.is_alive():
+        process.terminate()
+    self._results.close()
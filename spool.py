@@ -0,0 +1,213 @@
+# encoding: utf-8
+"""
+an on-disk spool for rows that couldn't be written to the database, and
+a writer wrapper that falls back to it during outages and replays it in
+bulk once the database is back.
+
+the spool is a directory of append-only segment files, each a sequence
+of length-prefixed pickled batches. segments are only deleted once every
+row in them has been committed, so rows survive a restart (a segment
+that was partly replayed when the process died is replayed again in
+full).
+"""
+
+import os
+import pickle
+import struct
+import time
+import traceback
+
+SEGMENT_SIZE = 4 * 1024 * 1024
+MAX_SIZE = 1024 * 1024 * 1024
+RETRY_DELAY = 10.0
+REPLAY_BATCH_SIZE = 5000
+
+_FRAME_HEADER = struct.Struct('<I')
+_SEGMENT_SUFFIX = ".spool"
+
+
+class Spool(object):
+  """
+  segment-rotated, size-bounded spool of row batches. when it grows past
+  `max_size`, the oldest segments are discarded.
+  """
+
+  def __init__(self, directory, segment_size=SEGMENT_SIZE, max_size=MAX_SIZE):
+    self.directory = directory
+    self.segment_size = segment_size
+    self.max_size = max_size
+    if not os.path.isdir(directory):
+      os.makedirs(directory)
+    # counters
+    self.spooled = 0
+    self.dropped_segments = 0
+    self._current = None
+    self._segments = sorted(
+      int(name[:-len(_SEGMENT_SUFFIX)])
+      for name in os.listdir(directory)
+      if name.endswith(_SEGMENT_SUFFIX)
+    )
+    self._sizes = dict((seq, os.path.getsize(self._path(seq))) for seq in self._segments)
+
+  def __len__(self):
+    # number of segments waiting to be replayed
+    return len(self._segments)
+
+  @property
+  def size(self):
+    return sum(self._sizes.values())
+
+  def _path(self, seq):
+    return os.path.join(self.directory, "%020d%s" % (seq, _SEGMENT_SUFFIX))
+
+  def append(self, rows):
+    if self._current is None:
+      seq = (self._segments[-1] + 1) if self._segments else 1
+      self._segments.append(seq)
+      self._sizes[seq] = 0
+      self._current = (seq, open(self._path(seq), 'ab'))
+    seq, f = self._current
+    data = pickle.dumps(list(rows), 2)
+    f.write(_FRAME_HEADER.pack(len(data)))
+    f.write(data)
+    f.flush()
+    self._sizes[seq] += _FRAME_HEADER.size + len(data)
+    self.spooled += len(rows)
+
+    if self._sizes[seq] >= self.segment_size:
+      self.rotate()
+    while self.size > self.max_size and len(self._segments) > 1:
+      self.remove(self._segments[0])
+      self.dropped_segments += 1
+
+  def rotate(self):
+    """
+    close the segment being appended to, so it can be replayed.
+    """
+    if self._current is not None:
+      seq, f = self._current
+      os.fsync(f.fileno())
+      f.close()
+      self._current = None
+
+  def read_oldest(self):
+    """
+    return (seq, rows) for the oldest segment, or None if the spool is
+    empty. a torn batch at the end of a segment (from a crash while it
+    was being written) is ignored.
+    """
+    if not self._segments:
+      return None
+    seq = self._segments[0]
+    if self._current is not None and self._current[0] == seq:
+      self.rotate()
+    rows = []
+    with open(self._path(seq), 'rb') as f:
+      while True:
+        header = f.read(_FRAME_HEADER.size)
+        if len(header) < _FRAME_HEADER.size:
+          break
+        (length,) = _FRAME_HEADER.unpack(header)
+        data = f.read(length)
+        if len(data) < length:
+          break
+        rows.extend(pickle.loads(data))
+    return (seq, rows)
+
+  def remove(self, seq):
+    if seq not in self._sizes:
+      # already discarded to stay under max_size
+      return
+    if self._current is not None and self._current[0] == seq:
+      self._current[1].close()
+      self._current = None
+    self._segments.remove(seq)
+    del self._sizes[seq]
+    os.remove(self._path(seq))
+
+  def close(self):
+    self.rotate()
+
+
+class SpoolingWriter(object):
+  """
+  wraps a `write(rows)` function (for a batching.RowBuffer). batches that
+  fail with one of `errors` go to the spool instead, and for the next
+  `retry_delay` seconds so does everything else. after that, each batch
+  tries the database again (calling `reconnect()` first); once a write
+  succeeds, `replay()` drains the spool `replay_batch_size` rows at a
+  time.
+
+  calls return the number of rows written to the database, so spooled
+  rows aren't counted as written until they've been replayed.
+  """
+
+  def __init__(self, write, spool, errors, reconnect=None, retry_delay=RETRY_DELAY, replay_batch_size=REPLAY_BATCH_SIZE):
+    self.write = write
+    self.spool = spool
+    self.errors = errors
+    self.reconnect = reconnect
+    self.retry_delay = retry_delay
+    self.replay_batch_size = replay_batch_size
+    self.replayed = 0
+    self._retry_at = None
+    self._replaying = None
+    if len(spool):
+      print "Spool in %s has %s segments to replay" % (spool.directory, len(spool))
+
+  @property
+  def outage(self):
+    return self._retry_at is not None
+
+  def _try_write(self, rows):
+    if self._retry_at is not None:
+      if time.time() < self._retry_at:
+        return False
+      try:
+        if self.reconnect is not None:
+          self.reconnect()
+        self.write(rows)
+      except self.errors:
+        self._retry_at = time.time() + self.retry_delay
+        return False
+      print "Database is back, replaying %s spooled segments" % (len(self.spool),)
+      self._retry_at = None
+      return True
+    try:
+      self.write(rows)
+    except self.errors:
+      traceback.print_exc()
+      print "Could not write to database, spooling to %s" % (self.spool.directory,)
+      self._retry_at = time.time() + self.retry_delay
+      return False
+    return True
+
+  def __call__(self, rows):
+    if not self._try_write(rows):
+      self.spool.append(rows)
+      return 0
+    return len(rows)
+
+  def replay(self):
+    """
+    write the next bulk batch of spooled rows, if the database is up.
+    returns the number of rows replayed.
+    """
+    if self._replaying is None:
+      if not len(self.spool):
+        return 0
+      if self.outage and time.time() < self._retry_at:
+        return 0
+      self._replaying = self.spool.read_oldest() + (0,)
+    seq, rows, offset = self._replaying
+    batch = rows[offset:offset + self.replay_batch_size]
+    if batch and not self._try_write(batch):
+      return 0
+    offset += len(batch)
+    self.replayed += len(batch)
+    if offset >= len(rows):
+      self.spool.remove(seq)
+      self._replaying = None
+    else:
+      self._replaying = (seq, rows, offset)
+    return len(batch)
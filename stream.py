@@ -0,0 +1,401 @@
+# encoding: utf-8
+"""
+line framing for the basestation tcp stream, reading from several
+streams at once, and replaying recorded captures.
+"""
+
+import errno
+import gzip
+import os
+import select
+import socket
+import sys
+import time
+
+import retry
+
+try:
+  import zstandard
+except ImportError:
+  zstandard = None
+
+# dump1090 lines are ~100 bytes, so this holds hundreds of messages per
+# recv() call at peak traffic.
+BUFFER_SIZE = 65536
+
+
+class LineReader(object):
+  """
+  reads a socket into a reusable buffer and hands back complete,
+  newline-terminated lines. a partial line at the end of a read is kept
+  at the front of the buffer until the rest of it arrives.
+  """
+
+  def __init__(self, sock, buffer_size=BUFFER_SIZE):
+    self.sock = sock
+    self._buf = bytearray(buffer_size)
+    self._view = memoryview(self._buf)
+    self._end = 0
+    # number of bytes discarded because a "line" filled the whole buffer
+    self.overflow_bytes = 0
+    self.bytes_read = 0
+
+  def read_lines(self):
+    """
+    do a single recv() and return the list of complete lines it finished
+    (without their line endings). returns None once the peer has closed
+    the connection.
+    """
+    n = self.sock.recv_into(self._view[self._end:])
+    if n == 0:
+      return None
+    self.bytes_read += n
+    end = self._end + n
+
+    last = self._buf.rfind(b'\n', 0, end)
+    if last < 0:
+      if end == len(self._buf):
+        # no line ending in a full buffer; this isn't basestation data
+        self.overflow_bytes += end
+        end = 0
+      self._end = end
+      return []
+
+    lines = [l.rstrip(b'\r') for l in self._view[:last].tobytes().split(b'\n')]
+
+    # carry the partial tail over to the front of the buffer
+    tail = end - last - 1
+    if tail:
+      self._buf[:tail] = self._buf[last + 1:end]
+    self._end = tail
+
+    return [l for l in lines if l]
+
+
+# mlat results from the flightaware client's basestation output
+MLAT_PORT = 31003
+
+# seconds to wait for a connection to be accepted
+CONNECT_TIMEOUT = 10.0
+# seconds without a byte from a source before it's reconnected; dump1090
+# sends nothing while no aircraft are in range, so this shouldn't be short
+IDLE_TIMEOUT = 300.0
+# seconds a connection is idle before tcp keepalive probes start. three
+# unanswered probes KEEPALIVE_INTERVAL seconds apart drop it, so a peer
+# that's gone away without closing the connection (a rebooted router, a
+# pulled cable) is noticed in under a minute rather than hours.
+KEEPALIVE_IDLE = 20
+KEEPALIVE_INTERVAL = 10
+KEEPALIVE_COUNT = 3
+
+
+def keepalive(sock, idle=KEEPALIVE_IDLE, interval=KEEPALIVE_INTERVAL, count=KEEPALIVE_COUNT):
+  """
+  turn on tcp keepalive for `sock`, with the timings where the platform
+  lets us set them
+  """
+  sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+  for (option, value) in (('TCP_KEEPIDLE', idle), ('TCP_KEEPINTVL', interval), ('TCP_KEEPCNT', count)):
+    if hasattr(socket, option):
+      sock.setsockopt(socket.IPPROTO_TCP, getattr(socket, option), value)
+
+
+class Source(object):
+  """
+  a dump1090 (or mlat) basestation feed, and the tags for rows from it.
+  """
+
+  def __init__(self, host, port, client_id=0, is_mlat=None):
+    self.host = host
+    self.port = port
+    self.client_id = client_id
+    if is_mlat is None:
+      is_mlat = (port == MLAT_PORT)
+    self.is_mlat = is_mlat
+    self.sock = None
+    self.reader = None
+    self.connecting = False
+    # when connecting gives up, or when the connection counts as idle
+    self.deadline = None
+    self.retry_at = 0.0
+    self.backoff = None
+    # counters
+    self.lines = 0
+    self.parse_errors = 0
+    self.reconnects = 0
+    self._closed_bytes_read = 0
+
+  @property
+  def bytes_read(self):
+    # over every connection so far
+    reader = self.reader
+    if reader is None:
+      return self._closed_bytes_read
+    return self._closed_bytes_read + reader.bytes_read
+
+  @classmethod
+  def parse(cls, spec):
+    """
+    parse a `host:port:client_id[:mlat]` source spec
+    """
+    parts = spec.split(':')
+    if len(parts) not in (3, 4) or (len(parts) == 4 and parts[3] != 'mlat'):
+      raise ValueError("expected host:port:client_id[:mlat], got %r" % (spec,))
+    return cls(parts[0], int(parts[1]), int(parts[2]), True if len(parts) == 4 else None)
+
+  def __str__(self):
+    return "%s:%s" % (self.host, self.port)
+
+
+class MultiReader(object):
+  """
+  reads lines from any number of sources on one thread with select(),
+  (re)connecting each one in the background with a retry.Backoff that
+  starts at `reconnect_delay` seconds. a connection attempt that takes
+  longer than `connect_timeout` seconds, or a connection that sends
+  nothing for `idle_timeout` seconds (if it's set), is given up on and
+  retried.
+  """
+
+  def __init__(self, sources, buffer_size=BUFFER_SIZE, reconnect_delay=1.0, connect_timeout=CONNECT_TIMEOUT, idle_timeout=IDLE_TIMEOUT):
+    self.sources = list(sources)
+    self.buffer_size = buffer_size
+    self.reconnect_delay = reconnect_delay
+    self.connect_timeout = connect_timeout
+    self.idle_timeout = idle_timeout
+
+  def _connect(self, source):
+    try:
+      source.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+      source.sock.setblocking(0)
+      keepalive(source.sock)
+      # the host name is looked up here, and that fails in a network
+      # blip like anything else (socket.gaierror is a socket.error)
+      err = source.sock.connect_ex((source.host, source.port))
+    except socket.error as e:
+      self._disconnect(source, e.args[-1])
+      return
+    if err in (0, errno.EINPROGRESS, errno.EWOULDBLOCK):
+      source.connecting = True
+      source.deadline = time.time() + self.connect_timeout
+    else:
+      self._disconnect(source, os.strerror(err))
+
+  def _connected(self, source):
+    err = source.sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+    if err:
+      self._disconnect(source, os.strerror(err))
+      return
+    source.connecting = False
+    source.reader = LineReader(source.sock, self.buffer_size)
+    self._active(source)
+    print "%s: Connected to %s" % (source.client_id, source)
+
+  def _disconnect(self, source, reason):
+    if source.reader is not None:
+      source._closed_bytes_read += source.reader.bytes_read
+    if source.sock is not None:
+      source.sock.close()
+    source.sock = None
+    source.reader = None
+    source.connecting = False
+    source.deadline = None
+    source.reconnects += 1
+    if source.backoff is None:
+      source.backoff = retry.Backoff(self.reconnect_delay)
+    delay = source.backoff.delay()
+    source.retry_at = time.time() + delay
+    print "%s: No broadcast received from %s (%s). Attempting to reconnect in %.1f seconds" % (source.client_id, source, reason, delay)
+
+  def _active(self, source):
+    if self.idle_timeout:
+      source.deadline = time.time() + self.idle_timeout
+    else:
+      source.deadline = None
+
+  def read(self, timeout):
+    """
+    wait up to `timeout` seconds for data, returning a list of
+    (source, lines) pairs for the sources that had any.
+    """
+    now = time.time()
+    for source in self.sources:
+      if source.deadline is not None and source.deadline <= now:
+        if source.connecting:
+          self._disconnect(source, "timed out connecting")
+        else:
+          self._disconnect(source, "nothing received for %.0f seconds" % (self.idle_timeout,))
+      if source.sock is None and source.retry_at <= now:
+        self._connect(source)
+
+    readable = [s.sock for s in self.sources if s.reader is not None]
+    writable = [s.sock for s in self.sources if s.connecting]
+    waiting = [s.retry_at - now for s in self.sources if s.sock is None]
+    if waiting:
+      timeout = max(0.0, min([timeout] + waiting))
+    if not readable and not writable:
+      time.sleep(timeout)
+      return []
+    (readable, writable, _) = select.select(readable, writable, [], timeout)
+
+    by_sock = dict((s.sock, s) for s in self.sources if s.sock is not None)
+    for sock in writable:
+      self._connected(by_sock[sock])
+
+    results = []
+    for sock in readable:
+      source = by_sock[sock]
+      try:
+        lines = source.reader.read_lines()
+      except socket.error as e:
+        if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+          continue
+        self._disconnect(source, e.args[-1])
+        continue
+      if lines is None:
+        self._disconnect(source, "connection closed")
+        continue
+      if source.backoff is not None:
+        source.backoff.reset()
+      self._active(source)
+      results.append((source, lines))
+    return results
+
+  def close(self):
+    for source in self.sources:
+      if source.sock is not None:
+        source.sock.close()
+        source.sock = None
+        source.reader = None
+
+
+class EndOfStream(Exception):
+  """
+  raised by FileReader.read() once every capture has been read
+  """
+
+
+class FileSource(object):
+  """
+  a recorded basestation capture: plain, gzip (.gz) or zstd (.zst), or
+  standard input for `-`.
+  """
+
+  def __init__(self, path, client_id=0, is_mlat=False):
+    self.path = path
+    self.client_id = client_id
+    self.is_mlat = is_mlat
+    # counters
+    self.lines = 0
+    self.parse_errors = 0
+    self.reconnects = 0
+    self.bytes_read = 0
+
+  def open(self):
+    if self.path == '-':
+      return sys.stdin
+    if self.path.endswith('.gz'):
+      return gzip.open(self.path, 'rb')
+    if self.path.endswith(('.zst', '.zstd')):
+      if zstandard is None:
+        raise IOError("reading zstd captures needs the zstandard package")
+      return zstandard.ZstdDecompressor().stream_reader(open(self.path, 'rb'))
+    return open(self.path, 'rb')
+
+  def __str__(self):
+    return self.path
+
+
+class FileReader(object):
+  """
+  reads the lines of each capture in turn, as fast as they're asked for,
+  with the same `read(timeout)` interface as MultiReader. with
+  `realtime`, lines are handed out no faster than the gaps between their
+  logged timestamps (as given by `timestamp(line)`, in seconds).
+  """
+
+  def __init__(self, sources, buffer_size=BUFFER_SIZE, realtime=False, timestamp=None):
+    self.sources = list(sources)
+    self.buffer_size = buffer_size
+    self.realtime = realtime
+    self.timestamp = timestamp
+    self._file = None
+    self._tail = b''
+    self._pending = []
+    self._next = 0
+    # wall clock time minus capture time, set by the first timestamp
+    self._offset = None
+
+  def _fill(self):
+    # read the next chunk of lines into self._pending
+    while True:
+      if not self.sources:
+        raise EndOfStream()
+      try:
+        if self._file is None:
+          print "Reading %s..." % (self.sources[0],)
+          self._file = self.sources[0].open()
+        chunk = self._file.read(self.buffer_size)
+      except (IOError, EOFError) as e:
+        # missing, unreadable or truncated; keep what we got and move on
+        print "Could not read %s: %s" % (self.sources[0], e)
+        self.close()
+        self.sources.pop(0)
+        self._tail = b''
+        continue
+      self.sources[0].bytes_read += len(chunk)
+      if not chunk:
+        # the last line may not have a line ending
+        lines = [self._tail] if self._tail.strip() else []
+        self._tail = b''
+        if self._file is not sys.stdin:
+          self._file.close()
+        self._file = None
+        source = self.sources.pop(0)
+      else:
+        data = self._tail + chunk
+        last = data.rfind(b'\n')
+        if last < 0:
+          self._tail = data
+          continue
+        self._tail = data[last + 1:]
+        lines = data[:last].split(b'\n')
+        source = self.sources[0]
+      lines = [l.rstrip(b'\r') for l in lines if l.strip()]
+      if lines:
+        self._source = source
+        self._pending = lines
+        self._next = 0
+        return
+
+  def read(self, timeout):
+    """
+    return a list of (source, lines) pairs, like MultiReader.read(), or
+    raise EndOfStream once there's nothing left.
+    """
+    if self._next >= len(self._pending):
+      self._fill()
+    if not self.realtime:
+      lines = self._pending[self._next:]
+      self._next = len(self._pending)
+      return [(self._source, lines)]
+
+    now = time.time()
+    start = self._next
+    while self._next < len(self._pending):
+      ts = self.timestamp(self._pending[self._next])
+      if ts is not None:
+        if self._offset is None:
+          self._offset = now - ts
+        wait = ts + self._offset - now
+        if wait > 0:
+          if self._next == start:
+            time.sleep(min(wait, timeout))
+          break
+      self._next += 1
+    return [(self._source, self._pending[start:self._next])]
+
+  def close(self):
+    if self._file is not None and self._file is not sys.stdin:
+      self._file.close()
+    self._file = None
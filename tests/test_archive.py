@@ -0,0 +1,53 @@
+# encoding: utf-8
+"""
+run with `python -m unittest discover tests` from the top of the repo
+"""
+
+import datetime
+import os
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+import archive
+import batching
+import pipeline
+import sbs1
+
+LINE = "MSG,4,111,11111,FE1753,111111,2019/04/16,12:00:00.003,2019/04/16,12:00:00.003,,,278,183,,,1114,,,,,"
+
+
+@unittest.skipIf(archive.pyarrow is None, "needs pyarrow")
+class ArchiveTest(unittest.TestCase):
+
+  def setUp(self):
+    self.directory = tempfile.mkdtemp()
+
+  def tearDown(self):
+    shutil.rmtree(self.directory)
+
+  def test_flushed_without_more_rows(self):
+    # a quiet feed: one row, then nothing until shutdown
+    archiver = archive.Archive(self.directory, flush_interval=0.2)
+    queue = pipeline.RowQueue(100)
+    writer = pipeline.Writer(queue, batching.RowBuffer(archiver.write, 100, 0.05), on_poll=archiver.poll)
+    writer.start()
+    try:
+      queue.put(sbs1.make_row(sbs1.parse_line(LINE), datetime.datetime(2019, 4, 16, 12), False, 0))
+      deadline = time.time() + 5
+      while not archiver._writers and time.time() < deadline:
+        time.sleep(0.05)
+      self.assertEqual(len(archiver._writers), 1)
+      self.assertEqual(archiver._pending, {})
+    finally:
+      writer.stop()
+      archiver.close()
+    self.assertEqual((archiver.rows, archiver.files), (1, 1))
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,53 @@
+# encoding: utf-8
+"""
+run with `python -m unittest discover tests` from the top of the repo
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+import pipeline
+
+
+class SpillFileTest(unittest.TestCase):
+
+  def setUp(self):
+    self.directory = tempfile.mkdtemp()
+    self.path = os.path.join(self.directory, "spill.dat")
+
+  def tearDown(self):
+    shutil.rmtree(self.directory)
+
+  def test_capped_on_disk_without_a_reader(self):
+    # as during a database outage: rows are only ever put
+    max_size = 100000
+    spill = pipeline.SpillFile(self.path, max_size=max_size)
+    queue = pipeline.RowQueue(10, 'spill', spill)
+    for i in range(50000):
+      queue.put((i, "x" * 20))
+    spill._file.flush()
+    self.assertLessEqual(spill.size, max_size)
+    self.assertLessEqual(os.path.getsize(self.path), 2 * max_size + 1024)
+    self.assertEqual(queue.spilled, 50000 - 10)
+    self.assertEqual(queue.dropped + spill.pending, queue.spilled)
+
+    # what's left is the newest rows, in order, after the queued ones
+    rows = []
+    while True:
+      batch = queue.get_batch(1000, 0)
+      if not batch:
+        break
+      rows.extend(batch)
+    ids = [i for (i, _) in rows]
+    self.assertEqual(ids[:10], range(10))
+    self.assertEqual(ids[10:], range(50000 - len(ids) + 10, 50000))
+    spill.close()
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,353 @@
+# encoding: utf-8
+"""
+per-aircraft, per-message-type rate limiting of the rows we store.
+"""
+
+import datetime
+import math
+import operator
+import time
+
+import sbs1
+
+try:
+  import numpy
+except ImportError:
+  numpy = None
+
+# python 2 has no monotonic clock in the standard library
+_clock = getattr(time, 'monotonic', time.time)
+
+MAX_ENTRIES = 65536
+SWEEP_INTERVAL = 60.0
+# ArrayThrottle steps through this many (icao, alias) groups at once;
+# fewer are finished one row at a time
+VECTOR_GROUPS = 16
+
+# ChangeThrottle defaults: the most seconds between rows of a type, and
+# the changes that store a row sooner
+HEARTBEAT = 60.0
+POSITION_DELTA = 250.0  # meters from where the aircraft was heading
+ALTITUDE_DELTA = 100  # feet
+TRACK_DELTA = 5.0  # degrees
+SPEED_DELTA = 10  # knots
+VERTICAL_RATE_DELTA = 500  # feet/minute
+
+_METERS_PER_DEGREE = 111320.0
+_METERS_PER_KNOT_SECOND = 1852.0 / 3600
+# fields stored rows are compared on
+_CHANGE_FIELDS = (
+  sbs1.CALLSIGN,
+  sbs1.ALTITUDE,
+  sbs1.GROUND_SPEED,
+  sbs1.TRACK,
+  sbs1.LAT,
+  sbs1.LON,
+  sbs1.VERTICAL_RATE,
+  sbs1.DECIMAL_SQUAWK,
+  sbs1.ALERT,
+  sbs1.EMERGENCY,
+  sbs1.SPI,
+  sbs1.IS_ON_GROUND,
+)
+(_ALTITUDE, _GROUND_SPEED, _TRACK, _LAT, _LON, _VERTICAL_RATE) = (
+  _CHANGE_FIELDS.index(f) for f in (sbs1.ALTITUDE, sbs1.GROUND_SPEED, sbs1.TRACK, sbs1.LAT, sbs1.LON, sbs1.VERTICAL_RATE)
+)
+_EXACT = tuple(_CHANGE_FIELDS.index(f) for f in (sbs1.CALLSIGN, sbs1.DECIMAL_SQUAWK, sbs1.ALERT, sbs1.EMERGENCY, sbs1.SPI, sbs1.IS_ON_GROUND))
+
+
+def _seconds(ttl):
+  if ttl is None:
+    return None
+  return ttl.total_seconds()
+
+
+class Throttle(object):
+  """
+  remembers when we last stored a row for each (icao, msgtype alias) pair
+  and suppresses rows that come sooner than the TTL for that type.
+
+  `ttls` and `aliases` are indexed by transmission type, like
+  TRANSMISSION_TYPE_TTL and TRANSMISSION_TYPE_ALIAS. entries older than
+  the longest TTL can't suppress anything, so they're dropped every
+  `sweep_interval` seconds; if there are still more than `max_entries`,
+  the oldest are dropped too. memory use stays flat no matter how many
+  airframes go by.
+  """
+
+  def __init__(self, ttls, aliases, max_entries=MAX_ENTRIES, sweep_interval=SWEEP_INTERVAL):
+    self.ttls = tuple(_seconds(ttl) for ttl in ttls)
+    self.aliases = tuple(aliases)
+    self.max_ttl = max(ttl for ttl in self.ttls if ttl is not None)
+    self.max_entries = max_entries
+    self.sweep_interval = sweep_interval
+    self._last_stored = {}
+    self._next_sweep = _clock() + sweep_interval
+    # stats
+    self.passed = 0
+    self.suppressed = 0
+    self.suppressed_by_type = [0] * len(self.aliases)
+    self.evicted = 0
+
+  def __len__(self):
+    return len(self._last_stored)
+
+  def allow(self, icao_addr, transmission_type, now=None, record=None):
+    """
+    whether to store a row for this aircraft and transmission type now
+    (or at `now`, in seconds, when replaying a capture). if so, its timer
+    is reset. `record` is only looked at by a ChangeThrottle.
+    """
+    if now is None:
+      now = _clock()
+    alias = self.aliases[transmission_type]
+    ttl = self.ttls[alias]
+    key = (icao_addr, alias)
+    if ttl is not None:
+      last = self._last_stored.get(key)
+      if last is not None and (now - last) <= ttl:
+        # too soon.
+        self.suppressed += 1
+        self.suppressed_by_type[transmission_type] += 1
+        return False
+    self._last_stored[key] = now
+    self.passed += 1
+    if now >= self._next_sweep or len(self._last_stored) > self.max_entries:
+      self.sweep(now)
+    return True
+
+  def sweep(self, now=None):
+    if now is None:
+      now = _clock()
+    self._next_sweep = now + self.sweep_interval
+    before = len(self._last_stored)
+    cutoff = now - self.max_ttl
+    self._last_stored = dict(
+      (key, ts) for (key, ts) in self._last_stored.items() if ts >= cutoff
+    )
+    if len(self._last_stored) > self.max_entries:
+      # keep the newest 90%, so we don't have to do this on every row
+      keep = sorted(self._last_stored.items(), key=operator.itemgetter(1))
+      keep = keep[len(keep) - int(self.max_entries * 0.9):]
+      self._last_stored = dict(keep)
+    self.evicted += before - len(self._last_stored)
+
+
+class ArrayThrottle(Throttle):
+  """
+  a Throttle that decides for arrays of rows at once (see columnar.py),
+  keeping its timers in sorted numpy arrays instead of a dict. needs
+  numpy.
+  """
+
+  def __init__(self, ttls, aliases, max_entries=MAX_ENTRIES, sweep_interval=SWEEP_INTERVAL):
+    Throttle.__init__(self, ttls, aliases, max_entries, sweep_interval)
+    self._alias_array = numpy.array(self.aliases)
+    # nan for types that aren't throttled
+    self._ttl_array = numpy.array([numpy.nan if ttl is None else ttl for ttl in self.ttls])
+    # icao_addr * len(aliases) + alias, and when a row was last stored
+    self._keys = numpy.zeros(0, numpy.int64)
+    self._last = numpy.zeros(0)
+
+  def __len__(self):
+    return len(self._keys)
+
+  def allow(self, icao_addr, transmission_type, now=None, record=None):
+    allowed = self.allow_many(
+      numpy.array([icao_addr]), numpy.array([transmission_type]),
+      None if now is None else numpy.array([now], float),
+    )
+    return bool(allowed[0])
+
+  def allow_many(self, icao_addrs, transmission_types, now=None):
+    """
+    allow() for arrays of rows, in order, returning a boolean array of
+    the rows to store. `now` is an array of times (in seconds), or None
+    for now.
+    """
+    n = len(icao_addrs)
+    if now is None:
+      now = numpy.empty(n)
+      now.fill(_clock())
+    alias = self._alias_array[transmission_types]
+    keys = icao_addrs.astype(numpy.int64) * len(self.aliases) + alias
+
+    # group the rows by key, keeping them in order within each group
+    order = numpy.argsort(keys, kind='mergesort')
+    times = now[order]
+    starts = numpy.flatnonzero(numpy.r_[True, keys[order][1:] != keys[order][:-1]]) if n else numpy.zeros(0, numpy.int64)
+    ends = numpy.r_[starts[1:], n].astype(numpy.int64)
+    group_keys = keys[order][starts]
+    ttl = self._ttl_array[alias[order][starts]]
+
+    # the timers we have for them
+    pos = numpy.searchsorted(self._keys, group_keys)
+    known = pos < len(self._keys)
+    known[known] = self._keys[pos[known]] == group_keys[known]
+    # -inf where there's no timer, so any row is late enough
+    last = numpy.empty(len(starts))
+    last.fill(-numpy.inf)
+    last[known] = self._last[pos[known]]
+
+    keep = numpy.zeros(n, bool)
+    # types without a ttl are always stored
+    untimed = numpy.isnan(ttl)
+    keep[numpy.repeat(untimed, ends - starts)] = True
+    last[untimed] = times[ends[untimed] - 1]
+
+    # step through the rest of each group a row at a time, for every
+    # group at once: a row is stored if its group's last stored row is
+    # more than the ttl before it
+    active = numpy.flatnonzero(~untimed)
+    row = starts.copy()
+    while len(active) >= VECTOR_GROUPS:
+      r = row[active]
+      t = times[r]
+      stored = (t - last[active]) > ttl[active]
+      keep[r[stored]] = True
+      last[active[stored]] = t[stored]
+      row[active] += 1
+      active = active[row[active] < ends[active]]
+    for g in active:
+      (l, limit) = (last[g], ttl[g])
+      for r in range(row[g], ends[g]):
+        t = times[r]
+        if (t - l) > limit:
+          keep[r] = True
+          l = t
+      last[g] = l
+
+    # remember the new timers
+    self._last[pos[known]] = last[known]
+    new = ~known & (last > -numpy.inf)
+    self._keys = numpy.insert(self._keys, pos[new], group_keys[new])
+    self._last = numpy.insert(self._last, pos[new], last[new])
+
+    allowed = numpy.empty(n, bool)
+    allowed[order] = keep
+    passed = int(allowed.sum())
+    self.passed += passed
+    self.suppressed += n - passed
+    suppressed_by_type = numpy.bincount(transmission_types[~allowed], minlength=len(self.aliases))
+    for (ttype, count) in enumerate(suppressed_by_type.tolist()):
+      self.suppressed_by_type[ttype] += count
+    if n and (now.max() >= self._next_sweep or len(self._keys) > self.max_entries):
+      self.sweep(now.max())
+    return allowed
+
+  def sweep(self, now=None):
+    if now is None:
+      now = _clock()
+    self._next_sweep = now + self.sweep_interval
+    before = len(self._keys)
+    fresh = self._last >= now - self.max_ttl
+    (keys, last) = (self._keys[fresh], self._last[fresh])
+    if len(keys) > self.max_entries:
+      # keep the newest 90%, so we don't have to do this on every row
+      newest = numpy.sort(numpy.argsort(last, kind='mergesort')[len(keys) - int(self.max_entries * 0.9):])
+      (keys, last) = (keys[newest], last[newest])
+    (self._keys, self._last) = (keys, last)
+    self.evicted += before - len(self._keys)
+
+
+class ChangeThrottle(Throttle):
+  """
+  a Throttle that stores a row for an (icao, msgtype alias) pair when
+  something in it has changed since the last one stored, or `heartbeat`
+  seconds after it, rather than at fixed intervals:
+
+  - a position more than `position_delta` meters from where the
+    aircraft would be had it kept the speed and track it last reported
+  - an altitude, speed, track or vertical rate more than its delta away
+  - any other value (callsign, squawk, flags) that's different
+
+  so an aircraft that's parked or flying straight and level only stores
+  a heartbeat, while one that's turning or climbing is stored in detail.
+  allow() needs the `record` (see sbs1.parse_line, or
+  sbs1.parse_line_compact with `compact`); without one, only the
+  heartbeat applies.
+  """
+
+  def __init__(self, aliases, heartbeat=HEARTBEAT, position_delta=POSITION_DELTA, altitude_delta=ALTITUDE_DELTA,
+               track_delta=TRACK_DELTA, speed_delta=SPEED_DELTA, vertical_rate_delta=VERTICAL_RATE_DELTA,
+               compact=False, max_entries=MAX_ENTRIES, sweep_interval=SWEEP_INTERVAL):
+    Throttle.__init__(self, [datetime.timedelta(seconds=heartbeat)] * len(aliases), aliases, max_entries, sweep_interval)
+    self.heartbeat = heartbeat
+    self.position_delta = position_delta
+    self._deltas = ((_ALTITUDE, altitude_delta), (_GROUND_SPEED, speed_delta), (_VERTICAL_RATE, vertical_rate_delta))
+    self.track_delta = track_delta
+    self.scale = float(sbs1.LATLON_SCALE) if compact else 1.0
+    # {(icao_addr, alias): _CHANGE_FIELDS of the last row stored}
+    self._stored = {}
+    # {icao_addr: (ground_speed, track)} last reported, stored or not
+    self._motion = {}
+
+  def allow(self, icao_addr, transmission_type, now=None, record=None):
+    if now is None:
+      now = _clock()
+    alias = self.aliases[transmission_type]
+    key = (icao_addr, alias)
+    if record is not None:
+      values = tuple(record[i] for i in _CHANGE_FIELDS)
+      if values[_GROUND_SPEED] is not None and values[_TRACK] is not None:
+        self._motion[icao_addr] = (values[_GROUND_SPEED], values[_TRACK])
+    else:
+      values = None
+    last = self._last_stored.get(key)
+    if last is not None and (now - last) < self.heartbeat:
+      stored = self._stored.get(key)
+      if values is None or (stored is not None and not self._changed(icao_addr, stored, values, now - last)):
+        # nothing new.
+        self.suppressed += 1
+        self.suppressed_by_type[transmission_type] += 1
+        return False
+    self._last_stored[key] = now
+    if values is not None:
+      self._stored[key] = values
+    self.passed += 1
+    if now >= self._next_sweep or len(self._last_stored) > self.max_entries:
+      self.sweep(now)
+    return True
+
+  def _changed(self, icao_addr, stored, values, elapsed):
+    for i in _EXACT:
+      if values[i] is not None and values[i] != stored[i]:
+        return True
+    for (i, delta) in self._deltas:
+      value = values[i]
+      if value is not None and (stored[i] is None or abs(value - stored[i]) >= delta):
+        return True
+    track = values[_TRACK]
+    if track is not None:
+      if stored[_TRACK] is None:
+        return True
+      turn = abs(track - stored[_TRACK]) % 360
+      if min(turn, 360 - turn) >= self.track_delta:
+        return True
+    if values[_LAT] is not None and values[_LON] is not None:
+      if stored[_LAT] is None or stored[_LON] is None:
+        return True
+      if self._deviation(icao_addr, stored, values, elapsed) >= self.position_delta:
+        return True
+    return False
+
+  def _deviation(self, icao_addr, stored, values, elapsed):
+    # meters between the position and the one dead reckoned from the
+    # last stored position
+    lat = float(stored[_LAT]) / self.scale
+    lon = float(stored[_LON]) / self.scale
+    motion = self._motion.get(icao_addr)
+    if motion is not None:
+      distance = motion[0] * _METERS_PER_KNOT_SECOND * elapsed
+      heading = math.radians(motion[1])
+      lat += distance * math.cos(heading) / _METERS_PER_DEGREE
+      lon += distance * math.sin(heading) / (_METERS_PER_DEGREE * max(math.cos(math.radians(lat)), 0.01))
+    north = (float(values[_LAT]) / self.scale - lat) * _METERS_PER_DEGREE
+    east = (float(values[_LON]) / self.scale - lon) * _METERS_PER_DEGREE * math.cos(math.radians(lat))
+    return math.hypot(north, east)
+
+  def sweep(self, now=None):
+    Throttle.sweep(self, now)
+    self._stored = dict((key, values) for (key, values) in self._stored.iteritems() if key in self._last_stored)
+    icaos = set(icao_addr for (icao_addr, _) in self._last_stored)
+    self._motion = dict((icao_addr, motion) for (icao_addr, motion) in self._motion.iteritems() if icao_addr in icaos)
@@ -0,0 +1,162 @@
+# encoding: utf-8
+"""
+merges the sparse per-message records of an aircraft into its current
+state, and turns that into one fully-populated track point per aircraft
+every so often.
+
+each transmission type carries a slice of the state: type 1 the
+callsign, 2 and 3 the position (and altitude), 4 speed and track, 5 and
+7 altitude, 6 the squawk (see TRANSMISSION_TYPE_ALIAS in the loggers).
+"""
+
+import datetime
+
+import sbs1
+
+# seconds between track points for one aircraft
+INTERVAL = 5.0
+# forget aircraft we haven't heard from in this many seconds
+MAX_AGE = 300.0
+
+# columns of a row as written to the `track_points` table
+TRACK_COLUMNS = (
+  'icao_addr',
+  'callsign',
+  'altitude',
+  'ground_speed',
+  'track',
+  'lat',
+  'lon',
+  'vertical_rate',
+  'decimal_squawk',
+  'alert',
+  'emergency',
+  'spi',
+  'is_on_ground',
+  'messages',
+  'parsed_time',
+  'is_mlat',
+  'client_id',
+)
+(
+  ICAO_ADDR,
+  CALLSIGN,
+  ALTITUDE,
+  GROUND_SPEED,
+  TRACK,
+  LAT,
+  LON,
+  VERTICAL_RATE,
+  DECIMAL_SQUAWK,
+  ALERT,
+  EMERGENCY,
+  SPI,
+  IS_ON_GROUND,
+  MESSAGES,
+  PARSED_TIME,
+  IS_MLAT,
+  CLIENT_ID,
+) = range(len(TRACK_COLUMNS))
+
+# the record fields that make up the state, in TRACK_COLUMNS order
+_STATE_FIELDS = (
+  sbs1.CALLSIGN,
+  sbs1.ALTITUDE,
+  sbs1.GROUND_SPEED,
+  sbs1.TRACK,
+  sbs1.LAT,
+  sbs1.LON,
+  sbs1.VERTICAL_RATE,
+  sbs1.DECIMAL_SQUAWK,
+  sbs1.ALERT,
+  sbs1.EMERGENCY,
+  sbs1.SPI,
+  sbs1.IS_ON_GROUND,
+)
+
+
+class _Aircraft(object):
+  __slots__ = ('state', 'messages', 'position_time', 'last_seen', 'next_point')
+
+  def __init__(self, now):
+    self.state = [None] * len(_STATE_FIELDS)
+    # squitters merged since the last track point
+    self.messages = 0
+    # when we got a position we haven't made a track point of yet
+    self.position_time = None
+    self.last_seen = now
+    self.next_point = now
+
+
+class Aggregator(object):
+  """
+  keeps the latest known value of every state field for each aircraft
+  (per client_id, and separately for mlat results). `poll()` returns a
+  `TRACK_COLUMNS` row for each aircraft that has reported a new position
+  and hasn't had a track point in the last `interval` seconds; fields
+  that weren't in this interval's messages carry over from earlier ones.
+  """
+
+  def __init__(self, interval=INTERVAL, max_age=MAX_AGE):
+    self.interval = datetime.timedelta(seconds=interval)
+    self.max_age = datetime.timedelta(seconds=max_age)
+    # scanning every aircraft on each read would be wasteful
+    self.poll_interval = min(self.interval, datetime.timedelta(seconds=1))
+    self._aircraft = {}
+    self._next_poll = None
+    # stats
+    self.merged = 0
+    self.points = 0
+    self.expired = 0
+
+  def __len__(self):
+    return len(self._aircraft)
+
+  def update(self, record, parsed_time, is_mlat, client_id):
+    """
+    merge a parsed record (see sbs1.parse_line) into its aircraft's state
+    """
+    key = (record[sbs1.ICAO_ADDR], is_mlat, client_id)
+    aircraft = self._aircraft.get(key)
+    if aircraft is None:
+      aircraft = self._aircraft[key] = _Aircraft(parsed_time)
+    state = aircraft.state
+    for (i, idx) in enumerate(_STATE_FIELDS):
+      value = record[idx]
+      if value is not None:
+        state[i] = value
+    if record[sbs1.LAT] is not None and record[sbs1.LON] is not None:
+      aircraft.position_time = parsed_time
+    aircraft.messages += 1
+    aircraft.last_seen = parsed_time
+    self.merged += 1
+
+  def poll(self, now, force=False):
+    """
+    return the track points that are due at `now`, and forget aircraft
+    that have gone quiet. `force` returns every pending track point
+    regardless of the interval, e.g. when shutting down.
+    """
+    if not force and self._next_poll is not None and now < self._next_poll:
+      return []
+    self._next_poll = now + self.poll_interval
+
+    points = []
+    expired = []
+    for (key, aircraft) in self._aircraft.iteritems():
+      if aircraft.position_time is not None and (force or now >= aircraft.next_point):
+        (icao_addr, is_mlat, client_id) = key
+        points.append(
+          (icao_addr,) + tuple(aircraft.state) +
+          (aircraft.messages, aircraft.position_time, is_mlat, client_id)
+        )
+        aircraft.messages = 0
+        aircraft.position_time = None
+        aircraft.next_point = now + self.interval
+      elif now - aircraft.last_seen > self.max_age:
+        expired.append(key)
+    for key in expired:
+      del self._aircraft[key]
+    self.points += len(points)
+    self.expired += len(expired)
+    return points